@@ -0,0 +1,211 @@
+import copy
+import logging
+
+from zope.component import getUtility
+
+from Products.GenericSetup.context import SetupEnviron
+
+from collective.wtf.interfaces import ICSVWorkflowConfig
+from collective.wtf.expressions import compileExpression
+from collective.wtf.exportimport import CSVWorkflowDefinitionConfigurator
+from collective.wtf.exportimport import importOneCSVWorkflow
+from collective.wtf.locking import lockWorkflowTool
+
+logger = logging.getLogger('collective.wtf')
+
+# Keys that exported info dicts have in addition to those of the templates
+_extra_keys = {'info': ('meta_type',)}
+
+# Lists of items in the info dict, and the name of the template of an item
+_item_lists = (('state_info', 'state_template',),
+               ('transition_info', 'transition_template',),
+               ('worklist_info', 'worklist_template',),
+               ('script_info', 'script_template',),)
+
+def _encode(value):
+    """Turn unicode (e.g. from JSON) into UTF-8 encoded strings, and
+    tuples into lists. _fill() makes them tuples again where the templates
+    have tuples.
+    """
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    elif isinstance(value, dict):
+        return dict([(_encode(k), _encode(v),) for k, v in value.items()])
+    elif isinstance(value, (list, tuple,)):
+        return [_encode(v) for v in value]
+    return value
+
+def _fill(template, value):
+    """Return a copy of template, updated with value. Values of keys that
+    are tuples in the template are made tuples.
+    """
+    result = copy.deepcopy(template)
+    for key, item in value.items():
+        if isinstance(template.get(key, None), tuple) and isinstance(item, list):
+            item = tuple(item)
+        result[key] = item
+    return result
+
+def _checkKeys(template, value, location, errors, extra=()):
+    if not isinstance(value, dict):
+        errors.append("%s: expected a dict" % location)
+        return False
+    for key in sorted(value.keys()):
+        if key not in template and key not in extra:
+            errors.append("%s: unknown key '%s'" % (location, key,))
+            continue
+        expected = template.get(key, None)
+        item = value[key]
+        if isinstance(expected, basestring) and not isinstance(item, basestring):
+            errors.append("%s: '%s' must be a string" % (location, key,))
+        elif isinstance(expected, bool) and not isinstance(item, bool):
+            errors.append("%s: '%s' must be true or false" % (location, key,))
+        elif isinstance(expected, (list, tuple,)) and not isinstance(item, (list, tuple,)):
+            errors.append("%s: '%s' must be a list" % (location, key,))
+    return True
+
+def _checkExpression(text, location, errors):
+    try:
+        compileExpression(text or '')
+    except Exception, e:
+        errors.append("%s: invalid TALES expression '%s': %s" % (location, text, str(e),))
+
+def normalizeWorkflowInfo(info, config_variant=u""):
+    """Return a complete info dict built from the given (possibly partial)
+    one, with the defaults of the ICSVWorkflowConfig templates filled in.
+    Strings are encoded as UTF-8. If 'permissions' is not given, it is
+    worked out from the permissions of the states, as when parsing CSV.
+    """
+    config = getUtility(ICSVWorkflowConfig, name=config_variant)
+    info = _encode(info)
+
+    result = _fill(config.info_template, info)
+    result.setdefault('meta_type', 'Workflow')
+
+    for key, template_name in _item_lists:
+        template = getattr(config, template_name)
+        result[key] = [_fill(template, item) for item in result[key]]
+
+    for state in result['state_info']:
+        state['permissions'] = [_fill(config.state_permission_template, p)
+                                    for p in state['permissions']]
+
+    for worklist in result['worklist_info']:
+        worklist['var_match'] = [tuple(v) for v in worklist['var_match']]
+
+    if 'permissions' not in info:
+        all_permissions = set()
+        for state in result['state_info']:
+            for p in state['permissions']:
+                all_permissions.add(p['name'])
+        result['permissions'] = sorted(all_permissions)
+
+    return result
+
+def validateWorkflowInfo(info, config_variant=u""):
+    """Check an info dict against the ICSVWorkflowConfig templates and for
+    consistency, and return a list of error messages, which is empty if
+    the info dict is valid. Missing keys are allowed, since they are
+    filled in by normalizeWorkflowInfo().
+    """
+    config = getUtility(ICSVWorkflowConfig, name=config_variant)
+    errors = []
+
+    if not _checkKeys(config.info_template, info, "workflow", errors, _extra_keys['info']):
+        return errors
+
+    workflow_id = info.get('id', '')
+    if not workflow_id:
+        errors.append("workflow: 'id' is required")
+    location = "workflow %s" % workflow_id
+
+    for key, template_name in _item_lists:
+        template = getattr(config, template_name)
+        seen = set()
+        for index, item in enumerate(info.get(key, None) or ()):
+            item_location = "%s, %s %d" % (location, key, index + 1,)
+            if not _checkKeys(template, item, item_location, errors):
+                continue
+            item_id = item.get('id', '')
+            if not item_id:
+                errors.append("%s: 'id' is required" % item_location)
+            elif item_id in seen:
+                errors.append("%s: duplicate id '%s'" % (item_location, item_id,))
+            seen.add(item_id)
+            if 'guard_expr' in item:
+                _checkExpression(item['guard_expr'], item_location, errors)
+            if key == 'script_info' and item.get('meta_type') == 'Script (Python)':
+                # The import reads their code from a file in the profile
+                errors.append("%s: 'Script (Python)' scripts can only be imported from a profile" % item_location)
+            if key == 'state_info':
+                for p_index, permission in enumerate(item.get('permissions', None) or ()):
+                    _checkKeys(config.state_permission_template, permission,
+                               "%s, permission %d" % (item_location, p_index + 1,), errors)
+
+    states = [s.get('id') for s in info.get('state_info', None) or () if isinstance(s, dict)]
+    transitions = [t.get('id') for t in info.get('transition_info', None) or () if isinstance(t, dict)]
+
+    if not states:
+        errors.append("%s: at least one state is required" % location)
+    elif info.get('initial_state', '') not in states:
+        errors.append("%s: the initial state '%s' is not one of the states" % (location, info.get('initial_state', ''),))
+
+    for transition in info.get('transition_info', None) or ():
+        if isinstance(transition, dict):
+            new_state_id = transition.get('new_state_id', '')
+            if new_state_id and new_state_id not in states:
+                errors.append("%s: transition '%s' leads to unknown state '%s'" % (location, transition.get('id'), new_state_id,))
+
+    for state in info.get('state_info', None) or ():
+        if isinstance(state, dict):
+            for transition_id in state.get('transitions', None) or ():
+                if transition_id not in transitions:
+                    errors.append("%s: state '%s' has unknown transition '%s'" % (location, state.get('id'), transition_id,))
+
+    return errors
+
+def exportWorkflowInfo(workflow):
+    """Return the info dict of the given workflow, as used by the CSV
+    serializer.
+    """
+    return CSVWorkflowDefinitionConfigurator(workflow).getWorkflowInfo(workflow.getId())
+
+def importWorkflowInfos(portal_workflow, infos, config_variant=u""):
+    """Validate the given info dicts, and if they are all valid, create or
+    update the workflows they describe in portal_workflow, as the
+    workflow-csv import step would, but without going through CSV.
+
+    Returns a tuple (errors, results). errors is a dict of workflow id (or
+    position, if there is no id) -> list of error messages; if it is not
+    empty, nothing was imported. results is a list of (workflow id,
+    'imported' or 'skipped') tuples, where 'skipped' means the workflow
+    was imported before and has not changed.
+    """
+    errors = {}
+    for index, info in enumerate(infos):
+        messages = validateWorkflowInfo(info, config_variant)
+        if messages:
+            key = isinstance(info, dict) and info.get('id') or str(index + 1)
+            errors[key] = messages
+    if errors:
+        return errors, []
+
+    lockWorkflowTool(portal_workflow)
+    environ = SetupEnviron()
+    results = []
+    for info in infos:
+        info = normalizeWorkflowInfo(info, config_variant)
+        wf_name = info['id']
+        imported = importOneCSVWorkflow(environ, portal_workflow, "<%s>" % wf_name,
+                                        wf_name, info, logger)
+        results.append((wf_name, imported and 'imported' or 'skipped',))
+    return {}, results
+
+def importWorkflowInfo(portal_workflow, info, config_variant=u""):
+    """Import one info dict. Raises ValueError with all error messages if
+    it is not valid, and otherwise returns 'imported' or 'skipped'.
+    """
+    errors, results = importWorkflowInfos(portal_workflow, [info], config_variant)
+    if errors:
+        raise ValueError('\n'.join(errors.values()[0]))
+    return results[0][1]
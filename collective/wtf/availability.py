@@ -0,0 +1,169 @@
+from Acquisition import aq_base, aq_inner, aq_parent
+from AccessControl import getSecurityManager
+
+from Products.CMFCore.utils import getToolByName
+from Products.DCWorkflow.Transitions import TRIGGER_USER_ACTION
+
+from collective.wtf.expressions import primeGuard
+from collective.wtf.utils import get_workflow_chain
+
+# Attribute on the workflow definition holding the availability matrix
+AVAILABILITY_ATTR = '_wtf_availability'
+
+def _signature(tdef):
+    """Return what the availability of a transition depends on, to detect
+    transitions that have been changed through the ZMI since compiling
+    """
+    guard = tdef.guard
+    if guard is None:
+        return (tdef.trigger_type, tdef.actbox_name, None,)
+    expr = guard.expr
+    return (tdef.trigger_type, tdef.actbox_name,
+            (tuple(guard.roles or ()), tuple(guard.permissions or ()),
+             tuple(guard.groups or ()), expr is not None and expr.text or None,),)
+
+def compileAvailability(workflow):
+    """Compile and store the transition availability matrix of the given
+    workflow.
+
+    For each state, this stores the tuple of the state's transitions, and
+    a tuple of (transition id, signature, roles, permissions, full) tuples,
+    one for each transition a user can trigger from the state (that is,
+    one with a title, as for the workflow menu). roles is a frozenset of
+    which the user needs at least one, permissions a tuple of which the
+    user needs at least one (either may be empty), and full is true if the
+    guard has an expression or groups, and so needs to be checked in full.
+    """
+    table = {}
+    for sdef in workflow.states.objectValues():
+        entries = []
+        for transition_id in sdef.transitions:
+            tdef = workflow.transitions.get(transition_id, None)
+            if tdef is None or tdef.trigger_type != TRIGGER_USER_ACTION or not tdef.actbox_name:
+                continue
+            signature = _signature(tdef)
+            roles = frozenset()
+            permissions = ()
+            full = False
+            if signature[2] is not None:
+                roles = frozenset(signature[2][0])
+                permissions = signature[2][1]
+                full = bool(signature[2][2]) or signature[2][3] is not None
+            entries.append((transition_id, signature, roles, permissions, full,))
+        table[sdef.getId()] = (tuple(sdef.transitions), tuple(entries),)
+    setattr(workflow, AVAILABILITY_ATTR, table)
+
+def getStateAvailability(workflow, sdef):
+    """Return the compiled (transition definition, roles, permissions,
+    full) tuples for the given state, or None if there is no compiled
+    matrix, or it is out of date.
+    """
+    table = getattr(aq_base(workflow), AVAILABILITY_ATTR, None)
+    if table is None:
+        return None
+    entry = table.get(sdef.getId(), None)
+    if entry is None:
+        return None
+    transitions, entries = entry
+    if tuple(sdef.transitions) != transitions:
+        return None
+    result = []
+    for transition_id, signature, roles, permissions, full in entries:
+        tdef = workflow.transitions.get(transition_id, None)
+        if tdef is None or _signature(tdef) != signature:
+            return None
+        result.append((tdef, roles, permissions, full,))
+    return result
+
+def listAvailableTransitions(workflow, ob, roles=None):
+    """Return the definitions of the transitions the current user may
+    trigger on ob in the given workflow, in the order of its state, like
+    the guard checks of the workflow's listObjectActions().
+
+    Using the compiled matrix (see compileAvailability()), the roles
+    guards are checked by intersecting sets with the user's roles in the
+    context of ob, which are only looked up once, and each permission is
+    only checked once. Guards are only evaluated in full if they have an
+    expression. Callers that already know the user's roles in context can
+    pass them in as roles. Without an up-to-date matrix, every guard is
+    checked in full.
+    """
+    sdef = workflow._getWorkflowStateOf(ob)
+    if sdef is None:
+        return []
+
+    entries = getStateAvailability(workflow, sdef)
+    if entries is None:
+        result = []
+        for transition_id in sdef.transitions:
+            tdef = workflow.transitions.get(transition_id, None)
+            if tdef is not None and tdef.trigger_type == TRIGGER_USER_ACTION and \
+                    tdef.actbox_name and workflow._checkTransitionGuard(tdef, ob):
+                result.append(tdef)
+        return result
+
+    sm = getSecurityManager()
+    user_roles = None
+    if roles is not None:
+        user_roles = frozenset(roles)
+
+    if workflow.manager_bypass:
+        if user_roles is None:
+            user_roles = frozenset(sm.getUser().getRolesInContext(ob))
+        if 'Manager' in user_roles:
+            return [e[0] for e in entries]
+
+    checked = {}
+    result = []
+    for tdef, required_roles, permissions, full in entries:
+        if full:
+            primeGuard(tdef.guard)
+            if workflow._checkTransitionGuard(tdef, ob):
+                result.append(tdef)
+            continue
+        if permissions:
+            for permission in permissions:
+                allowed = checked.get(permission, None)
+                if allowed is None:
+                    allowed = checked[permission] = bool(sm.checkPermission(permission, ob))
+                if allowed:
+                    break
+            else:
+                continue
+        if required_roles:
+            if user_roles is None:
+                user_roles = frozenset(sm.getUser().getRolesInContext(ob))
+            if required_roles.isdisjoint(user_roles):
+                continue
+        result.append(tdef)
+    return result
+
+def listTransitionActions(context, roles=None):
+    """Return a list of dicts with keys 'workflow', 'id', 'name', 'url'
+    and 'category' for each transition the current user may trigger on
+    context, in the workflows of its chain, as for the workflow menu.
+    """
+    wtool = getToolByName(context, 'portal_workflow')
+    portal = getToolByName(context, 'portal_url').getPortalObject()
+    info = {'content_url': context.absolute_url(),
+            'portal_url': portal.absolute_url(),
+            'folder_url': aq_parent(aq_inner(context)).absolute_url()}
+
+    result = []
+    for workflow_id in get_workflow_chain(context, wtool):
+        workflow = wtool.getWorkflowById(workflow_id)
+        if workflow is None or not hasattr(aq_base(workflow), 'states'):
+            continue
+        for tdef in listAvailableTransitions(workflow, context, roles):
+            result.append({'workflow': workflow_id,
+                           'id': tdef.getId(),
+                           'name': _format(tdef.actbox_name, info),
+                           'url': _format(tdef.actbox_url, info),
+                           'category': tdef.actbox_category})
+    return result
+
+def _format(text, info):
+    try:
+        return text % info
+    except (KeyError, ValueError, TypeError,):
+        return text
@@ -0,0 +1,127 @@
+import time
+import tarfile
+import zipfile
+
+try:
+    from hashlib import md5
+except ImportError: # Python 2.4
+    from md5 import new as md5
+
+from StringIO import StringIO
+from Products.Five.browser import BrowserView
+from Products.GenericSetup.context import SetupEnviron
+
+from collective.wtf.exportimport import exportWorkflowBody
+from collective.wtf.fingerprint import getLiveFingerprint
+
+class StreamWriter(object):
+    """A write-only file that passes what is written to it on to the
+    response in reasonably sized chunks, and keeps track of its position
+    so that zipfile can use it.
+    """
+
+    chunk_size = 8192
+
+    def __init__(self, write):
+        self._write = write
+        self.buffer = StringIO()
+        self.position = 0
+
+    def write(self, data):
+        self.buffer.write(data)
+        self.position += len(data)
+        if self.buffer.tell() >= self.chunk_size:
+            self.flush()
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        self._write(self.buffer.getvalue())
+        self.buffer.seek(0)
+        self.buffer.truncate()
+
+    def close(self):
+        self.flush()
+
+class WorkflowArchive(BrowserView):
+    """Download all workflows as CSV files in a zip file (or a tarball if
+    'format=tar' is passed), with a manifest. The archive is streamed, and
+    each workflow is only exported when its entry is written.
+
+    The ETag is a weak one, made from the fingerprints of the workflows
+    (see collective.wtf.compare.fingerprintInfo), so a client can use
+    If-None-Match to only download the archive again once a workflow has
+    changed.
+    """
+
+    def __call__(self):
+
+        format = self.request.get('format', 'zip')
+        if format not in ('zip', 'tar',):
+            format = 'zip'
+
+        response = self.request.response
+
+        etag = self.etag(format)
+        response.setHeader('ETag', etag)
+
+        if_none_match = self.request.get_header('If-None-Match', None)
+        if if_none_match and etag in [e.strip() for e in if_none_match.split(',')]:
+            response.setStatus(304)
+            return ''
+
+        if format == 'tar':
+            response.setHeader('Content-Type', 'application/x-tar')
+        else:
+            response.setHeader('Content-Type', 'application/zip')
+        response.setHeader('Content-Disposition', 'attachment;filename=workflows.%s' % format)
+
+        writer = StreamWriter(response.write)
+        if format == 'tar':
+            self.writeTar(writer)
+        else:
+            self.writeZip(writer)
+        writer.close()
+
+        return ''
+
+    def etag(self, format):
+        fingerprints = ["%s %s" % (wf.getId(), getLiveFingerprint(wf),)
+                            for wf in self.context.objectValues()]
+        fingerprints.sort()
+        fingerprints.append(format)
+        return 'W/"%s"' % md5('\n'.join(fingerprints)).hexdigest()
+
+    def entries(self):
+        """Generate (filename, body) tuples for each workflow, followed by
+        the manifest.
+        """
+        environ = SetupEnviron()
+        manifest = ["# id fingerprint md5 size"]
+        for wf in self.context.objectValues():
+            fingerprint, body = exportWorkflowBody(wf, environ)
+            if body is None:
+                continue
+            manifest.append("%s %s %s %d" % (wf.getId(), fingerprint, md5(body).hexdigest(), len(body),))
+            yield "%s.csv" % wf.getId(), body
+        yield "manifest.txt", '\n'.join(manifest) + '\n'
+
+    def writeTar(self, writer):
+        archive = tarfile.open(mode='w|', fileobj=writer)
+        now = time.time()
+        for filename, body in self.entries():
+            info = tarfile.TarInfo(filename)
+            info.size = len(body)
+            info.mtime = now
+            archive.addfile(info, StringIO(body))
+        archive.close()
+
+    def writeZip(self, writer):
+        archive = zipfile.ZipFile(writer, 'w', zipfile.ZIP_DEFLATED)
+        now = time.localtime()[:6]
+        for filename, body in self.entries():
+            info = zipfile.ZipInfo(filename, now)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            archive.writestr(info, body)
+        archive.close()
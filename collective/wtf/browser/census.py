@@ -0,0 +1,61 @@
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from StringIO import StringIO
+from Products.Five.browser import BrowserView
+
+from collective.wtf.interfaces import ICSVImportedWorkflow
+from collective.wtf.census import takeCensus
+
+class WorkflowCensus(BrowserView):
+    """Count the objects in each state of each workflow, by portal type,
+    from the catalog's index data. Pass 'csv_only=1' to only include
+    workflows imported from CSV, and 'format=json' to get JSON.
+    """
+
+    def __call__(self):
+
+        workflow_ids = None
+        if self.request.get('csv_only', None):
+            workflow_ids = [wf.getId() for wf in self.context.objectValues()
+                                if ICSVImportedWorkflow.providedBy(wf)]
+
+        census = takeCensus(self.context, workflow_ids)
+
+        if self.request.get('format', None) == 'json':
+            self.request.response.setHeader("Content-type", "application/json")
+            return json.dumps(census)
+
+        # Lazy stuff - this should be put into a proper template
+
+        out = StringIO()
+
+        print >> out, "Workflow census"
+        print >> out
+
+        total = 0
+        for workflow_id, entry in sorted(census.items()):
+            marker = ICSVImportedWorkflow.providedBy(self.context[workflow_id]) and ' [CSV]' or ''
+            print >> out, "%s (%s)%s" % (workflow_id, entry['title'], marker,)
+
+            if entry['states'] is None:
+                print >> out, "  The state variable %s is not indexed." % entry['state_variable']
+                print >> out
+                continue
+
+            workflow = self.context[workflow_id]
+            for state_id, counts in sorted(entry['states'].items()):
+                undefined = state_id not in workflow.states.objectIds() and ' (not defined)' or ''
+                print >> out, "  %-30s %8d%s" % (state_id, sum(counts.values()), undefined,)
+                for portal_type, count in sorted(counts.items()):
+                    print >> out, "    %-28s %8d" % (portal_type, count,)
+
+            print >> out, "  %-30s %8d" % ('Total', entry['total'],)
+            print >> out
+            total += entry['total']
+
+        print >> out, "Objects in workflows (objects with several workflows are counted once per workflow):", total
+
+        return out.getvalue()
@@ -0,0 +1,103 @@
+import transaction
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from StringIO import StringIO
+from Products.Five.browser import BrowserView
+
+from Acquisition import aq_inner, aq_parent
+from Products.GenericSetup.interfaces import ISetupTool
+
+from collective.wtf.compare import hasChanges
+from collective.wtf.fingerprint import checkDriftInSites
+from collective.wtf.fingerprint import diffDrift
+from collective.wtf.multisite import findSites
+from collective.wtf.browser.plan import printDiff
+
+class WorkflowDrift(BrowserView):
+    """Compare the CSV workflow definitions of a profile to the live
+    workflows, using fingerprints, and list the workflows that have
+    drifted. On portal_setup, the site it belongs to is checked. On the
+    Zope root, all sites are checked.
+    
+    Pass 'workflow' (and, on the Zope root, 'site') to get a structural
+    diff for one workflow.
+    """
+
+    def __call__(self):
+        
+        # This is strictly read-only
+        transaction.doom()
+        
+        profile_id = self.request.get('profile_id', None)
+        if not profile_id:
+            return "Use %s/%s?profile_id=profile-<name> to check the live workflows against the CSV workflows of a profile" % (self.context.absolute_url(), self.__name__)
+        
+        workflow_id = self.request.get('workflow', None)
+        if workflow_id:
+            return self.diff(profile_id, workflow_id)
+        
+        results = checkDriftInSites(self.sites(), profile_id)
+        drifted = [(path, [e for e in entries if e['status'] != 'ok'],) for path, entries in results]
+        
+        if self.request.get('format', None) == 'json':
+            self.request.response.setHeader("Content-type", "application/json")
+            return json.dumps(dict([(path, entries,) for path, entries in drifted if entries]))
+        
+        # Lazy stuff - this should be put into a proper template
+        
+        out = StringIO()
+        
+        print >> out, "Workflow drift for profile:", profile_id
+        print >> out
+        
+        count = 0
+        for path, entries in drifted:
+            for entry in entries:
+                count += 1
+                print >> out, "%s: %s %s (expected %s, live %s)" % (path, entry['workflow'], entry['status'],
+                                                                 entry['expected'], entry['live'] or '-',)
+        
+        if count:
+            print >> out
+        print >> out, "%d sites checked, %d workflows drifted." % (len(results), count,)
+        
+        return out.getvalue()
+    
+    def sites(self):
+        if ISetupTool.providedBy(self.context):
+            return [aq_parent(aq_inner(self.context))]
+        site_path = self.request.get('site', None)
+        if site_path:
+            return [self.context.unrestrictedTraverse(site_path)]
+        return findSites(self.context)
+    
+    def diff(self, profile_id, workflow_id):
+        sites = self.sites()
+        if len(sites) != 1:
+            return "Pass 'site' to choose the site to compare %s in" % workflow_id
+        site = sites[0]
+        
+        import_context = site.portal_setup._getImportContext(profile_id)
+        diff = diffDrift(import_context, workflow_id)
+        
+        if self.request.get('format', None) == 'json':
+            self.request.response.setHeader("Content-type", "application/json")
+            return json.dumps(diff)
+        
+        out = StringIO()
+        
+        print >> out, "Workflow %s in %s, compared to profile %s:" % (workflow_id, '/'.join(site.getPhysicalPath()), profile_id,)
+        print >> out
+        
+        if diff is None:
+            print >> out, "  The profile does not define this workflow."
+        elif not hasChanges(diff):
+            print >> out, "  No differences."
+        else:
+            printDiff(out, diff, added="only in the profile", removed="only in the live workflow")
+        
+        return out.getvalue()
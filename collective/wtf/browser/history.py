@@ -0,0 +1,89 @@
+import transaction
+
+from DateTime import DateTime
+from Products.Five.browser import BrowserView
+from Products.CMFCore.utils import getToolByName
+
+from collective.wtf.history import iterHistory
+from collective.wtf.history import writeHistoryCSV
+from collective.wtf.history import writeHistoryJSON
+from collective.wtf.browser.archive import StreamWriter
+
+class WorkflowHistoryExport(BrowserView):
+    """Stream the workflow history of the site's content as CSV, or as JSON
+    if 'format=json' is passed. The request may give
+
+      start, end -- dates; only transitions from start up to (but not
+        including) end are exported
+
+      action -- transition ids to export (several, or comma-separated)
+
+      workflow -- workflow ids whose history to export (several, or
+        comma-separated). Defaults to the workflows imported from CSV.
+
+      portal_type, path -- restrict the catalog query
+
+      chunk_size -- the number of objects loaded at a time (500 if it is
+        not a number)
+    """
+
+    def __call__(self):
+
+        # Nothing is changed, but objects are deactivated as we go
+        transaction.doom()
+
+        format = self.request.get('format', 'csv')
+        if format not in ('csv', 'json',):
+            format = 'csv'
+
+        query = {}
+        for key in ('portal_type', 'path',):
+            value = self.request.get(key, None)
+            if value:
+                query[key] = value
+
+        records = iterHistory(self.portal(), query,
+                              workflow_ids=self.getList('workflow'),
+                              start=self.getDate('start'),
+                              end=self.getDate('end'),
+                              actions=self.getList('action'),
+                              chunk_size=self.getInt('chunk_size', 500))
+
+        response = self.request.response
+        if format == 'json':
+            response.setHeader('Content-Type', 'application/json')
+        else:
+            response.setHeader('Content-Type', 'text/csv')
+        response.setHeader('Content-Disposition', 'attachment;filename=workflow-history.%s' % format)
+
+        writer = StreamWriter(response.write)
+        if format == 'json':
+            writeHistoryJSON(records, writer)
+        else:
+            writeHistoryCSV(records, writer)
+        writer.close()
+
+        return ''
+
+    def portal(self):
+        return getToolByName(self.context, 'portal_url').getPortalObject()
+
+    def getList(self, name):
+        value = self.request.get(name, None)
+        if not value:
+            return None
+        if isinstance(value, basestring):
+            value = value.split(',')
+        return [v.strip() for v in value if v.strip()]
+
+    def getDate(self, name):
+        value = self.request.get(name, None)
+        if not value:
+            return None
+        return DateTime(value)
+
+    def getInt(self, name, default):
+        try:
+            return max(1, int(self.request.get(name, default)))
+        except (TypeError, ValueError,):
+            return default
@@ -0,0 +1,70 @@
+import transaction
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from Products.Five.browser import BrowserView
+
+from collective.wtf.api import exportWorkflowInfo
+from collective.wtf.api import validateWorkflowInfo
+from collective.wtf.api import importWorkflowInfos
+
+class WorkflowInfo(BrowserView):
+    """Export, validate and import workflows as JSON info dicts, without
+    going through CSV.
+
+    A GET returns {"workflows": [info, ...]} for all workflows, or those
+    listed in 'ids' (comma-separated). POST a JSON body of the same form
+    (or a single info dict) to import the workflows, or add 'validate=1'
+    to only validate them. The response is {"errors": {id: [message,
+    ...]}, "results": [[id, "imported" or "skipped"], ...]}. If any
+    workflow is invalid, none are imported, and the status is 400.
+    """
+
+    def __call__(self):
+
+        response = self.request.response
+        response.setHeader("Content-type", "application/json")
+
+        if self.request.get('REQUEST_METHOD', 'GET') != 'POST':
+            transaction.doom()
+            return json.dumps({'workflows': [exportWorkflowInfo(wf) for wf in self.workflows()]})
+
+        try:
+            data = json.loads(self.request.get('BODY') or '')
+        except ValueError, e:
+            transaction.doom()
+            response.setStatus(400)
+            return json.dumps({'errors': {'': ["Invalid JSON: %s" % e]}, 'results': []})
+
+        if isinstance(data, dict) and 'workflows' in data:
+            infos = data['workflows']
+        else:
+            infos = [data]
+
+        if self.request.get('validate', None):
+            transaction.doom()
+            errors = {}
+            for index, info in enumerate(infos):
+                messages = validateWorkflowInfo(info)
+                if messages:
+                    errors[isinstance(info, dict) and info.get('id') or str(index + 1)] = messages
+            if errors:
+                response.setStatus(400)
+            return json.dumps({'errors': errors, 'results': []})
+
+        errors, results = importWorkflowInfos(self.context, infos)
+        if errors:
+            transaction.doom()
+            response.setStatus(400)
+        return json.dumps({'errors': errors, 'results': results})
+
+    def workflows(self):
+        ids = self.request.get('ids', None)
+        if not ids:
+            return self.context.objectValues()
+        if isinstance(ids, basestring):
+            ids = ids.split(',')
+        return [self.context[i.strip()] for i in ids if i.strip() in self.context.objectIds()]
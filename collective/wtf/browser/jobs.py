@@ -0,0 +1,102 @@
+import time
+import urllib
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from StringIO import StringIO
+from Products.Five.browser import BrowserView
+
+from Acquisition import aq_inner, aq_parent
+
+from collective.wtf.jobs import getJobStatus, listJobs
+from collective.wtf.importjob import startCSVImport
+
+class ImportJobs(BrowserView):
+    """Start an asynchronous import of the CSV workflows of a profile into
+    the site by POSTing 'profile_id' (and 'job_id' to resume a failed job),
+    and poll its progress by passing 'job_id'. Without parameters, the
+    jobs of this site are listed.
+    """
+
+    def __call__(self):
+
+        site = aq_parent(aq_inner(self.context))
+        site_path = '/'.join(site.getPhysicalPath())
+
+        profile_id = self.request.get('profile_id', None)
+        job_id = self.request.get('job_id', None)
+
+        if profile_id and self.request.get('REQUEST_METHOD', 'GET') == 'POST':
+            job_id = startCSVImport(site, profile_id, job_id)
+            self.request.response.redirect("%s/%s?job_id=%s" % (self.context.absolute_url(), self.__name__,
+                                                                 urllib.quote(job_id),))
+            return ''
+
+        root = self.context._p_jar.root()
+
+        if job_id:
+            progress = getJobStatus(root, job_id)
+            if self.request.get('format', None) == 'json':
+                self.request.response.setHeader("Content-type", "application/json")
+                return json.dumps(progress)
+            if progress is None:
+                return "Job %s has not started yet." % job_id
+            return self.formatJob(progress)
+
+        # History compaction jobs (see collective.wtf.history) are stored
+        # alongside, and can be polled here, but are not import jobs
+        history_prefix = site_path + ' history '
+        jobs = [p for p in listJobs(root) if p['id'].startswith(site_path + ' ')
+                                         and not p['id'].startswith(history_prefix)]
+
+        if self.request.get('format', None) == 'json':
+            self.request.response.setHeader("Content-type", "application/json")
+            return json.dumps(jobs)
+
+        out = StringIO()
+
+        print >> out, "Workflow import jobs in", site_path
+        print >> out
+
+        for progress in jobs:
+            print >> out, "%s: %s, %d/%d steps" % (progress['id'], progress['status'],
+                                                   progress['done'], len(progress['steps']),)
+
+        if not jobs:
+            print >> out, "No jobs. POST profile_id=profile-<name> to %s/%s to start one." % (self.context.absolute_url(), self.__name__,)
+
+        return out.getvalue()
+
+    def formatJob(self, progress):
+
+        out = StringIO()
+
+        print >> out, "Job:", progress['id']
+        print >> out, "Status:", progress['status']
+        if progress.get('phase'):
+            print >> out, "Current step:", progress['phase']
+        print >> out, "Steps done: %d/%d" % (progress['done'], len(progress['steps']),)
+
+        finished = progress['finished'] or time.time()
+        print >> out, "Elapsed: %.1fs" % (finished - progress['started'],)
+
+        if progress['counts']:
+            print >> out
+            print >> out, "Counts:"
+            for key, value in sorted(progress['counts'].items()):
+                print >> out, "  %s: %d" % (key, value,)
+
+        if progress['timings']:
+            print >> out
+            print >> out, "Timings:"
+            for name, seconds in progress['timings']:
+                print >> out, "  %-50s %8.2fs" % (name, seconds,)
+
+        if progress['error']:
+            print >> out
+            print >> out, "Error:", progress['error']
+
+        return out.getvalue()
@@ -0,0 +1,75 @@
+import transaction
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from StringIO import StringIO
+from Products.Five.browser import BrowserView
+
+from collective.wtf.exportimport import planCSVWorkflow
+
+class ImportPlan(BrowserView):
+    """Dry-run the workflow-csv import step for a profile, and report what
+    would change and how many objects would need their role mappings
+    updated. Nothing is written to the ZODB.
+    """
+
+    def __call__(self):
+        
+        # Make sure that nothing we touch can ever be committed
+        transaction.doom()
+        
+        profile_id = self.request.get('profile_id', None)
+        if not profile_id:
+            return "Use %s/%s?profile_id=profile-<name> to plan the CSV workflow import of a profile" % (self.context.absolute_url(), self.__name__)
+        
+        import_context = self.context._getImportContext(profile_id)
+        plan = planCSVWorkflow(import_context)
+        
+        if self.request.get('format', None) == 'json':
+            self.request.response.setHeader("Content-type", "application/json")
+            return json.dumps(plan)
+        
+        # Lazy stuff - this should be put into a proper template
+        
+        out = StringIO()
+        
+        print >> out, "Import plan for profile:", profile_id
+        print >> out
+        
+        if not plan:
+            print >> out, "No CSV workflow definitions found."
+        
+        total = 0
+        for entry in plan:
+            diff = entry['diff']
+            print >> out, "Workflow %s (%s): %s" % (entry['workflow'], entry['filename'], entry['action'],)
+            
+            printDiff(out, diff, removed="only in the live workflow (left in place)")
+            
+            if entry['affected']:
+                count = sum(entry['affected'].values())
+                total += count
+                print >> out, "  Objects needing role mapping updates: %d (%s)" % (count, ', '.join(["%s: %d" % i for i in sorted(entry['affected'].items())]),)
+            
+            print >> out
+        
+        print >> out, "Total objects needing role mapping updates:", total
+        
+        return out.getvalue()
+
+def printDiff(out, diff, added="added", removed="removed", changed="changed"):
+    """Print a diff from collective.wtf.compare.diffWorkflowInfo, indented
+    """
+    if diff['workflow']:
+        print >> out, "  Workflow settings %s: %s" % (changed, ', '.join(diff['workflow']),)
+    
+    for name in ('states', 'transitions', 'worklists', 'scripts',):
+        if diff['%s_added' % name]:
+            print >> out, "  %s %s: %s" % (name.capitalize(), added, ', '.join(diff['%s_added' % name]),)
+        if diff['%s_removed' % name]:
+            print >> out, "  %s %s: %s" % (name.capitalize(), removed, ', '.join(diff['%s_removed' % name]),)
+        for item_id, keys in sorted(diff['%s_changed' % name].items()):
+            print >> out, "  %s %s: %s (%s)" % (name.capitalize()[:-1], changed, item_id, ', '.join(keys),)
@@ -1,15 +1,32 @@
+import csv
 from StringIO import StringIO
 from Acquisition import aq_inner
 
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
 from Products.Five.browser import BrowserView
 from Products.CMFCore.utils import getToolByName
 
+from collective.wtf.roles import LocalRoleResolver
+from collective.wtf.roles import SubtreeLocalRoleMap
+from collective.wtf.roles import getPrincipalIds
+
 class RoleInfo(BrowserView):
     """Display information about a user's roles
+
+    Pass 'users' and/or 'paths' (as lists, or as comma-separated strings)
+    to check many users in many contexts in one request. The results are
+    streamed as CSV, or as JSON if 'format=json' is given.
     """
 
     def __call__(self):
         
+        if self.request.get('users', None) or self.request.get('paths', None):
+            return self.bulk()
+
         # Lazy stuff - this should be put into a proper template
         
         out = StringIO()
@@ -29,5 +46,163 @@ class RoleInfo(BrowserView):
         
         print >> out
         print >> out, "Use %s/%s?user=<name> to check roles for a particular user" % (context.absolute_url(), self.__name__)
+        print >> out, "Use %s/%s?users=<name>,<name>&paths=<path>,<path>&format=csv|json to check many at once" % (context.absolute_url(), self.__name__)
         
         return out.getvalue()
+
+    def bulk(self):
+        """Stream roles for each requested user in each requested path
+        """
+
+        format = self.request.get('format', 'csv')
+        response = self.request.response
+
+        write = getRowWriter(response, format, 'roles', ('user', 'path', 'roles',))
+
+        for userid, path, roles in self.rows():
+            if roles is not None and format != 'json':
+                roles = ', '.join(roles)
+            write((userid, path, roles,))
+        write.close()
+
+        return ''
+
+    def rows(self):
+        """Generate (user, path, roles) tuples. roles is None if the user
+        or path could not be found.
+        """
+
+        context = aq_inner(self.context)
+        portal_membership = getToolByName(context, 'portal_membership')
+        resolver = LocalRoleResolver()
+
+        userids = self._getList('users')
+        if not userids:
+            userids = [portal_membership.getAuthenticatedMember().getId()]
+
+        paths = self._getList('paths')
+        if paths:
+            contexts = [(path, context.unrestrictedTraverse(path, None)) for path in paths]
+        else:
+            contexts = [('/'.join(context.getPhysicalPath()), context)]
+
+        for userid in userids:
+            member = portal_membership.getMemberById(userid)
+            if member is None:
+                yield (userid, None, None)
+                continue
+
+            # Resolve group memberships once per user
+            principal_ids = getPrincipalIds(member)
+            global_roles = member.getRoles()
+
+            for path, obj in contexts:
+                if obj is None:
+                    yield (userid, path, None)
+                else:
+                    yield (userid, path, resolver.getRolesInContext(principal_ids, global_roles, obj))
+
+    def _getList(self, name):
+        value = self.request.get(name, None)
+        if not value:
+            return []
+        if isinstance(value, basestring):
+            value = value.split(',')
+        return [v.strip() for v in value if v.strip()]
+
+class LocalRoleMap(BrowserView):
+    """Stream the local roles of each principal on every catalogued object
+    in the subtree below the context, loading the objects a chunk at a
+    time (see collective.wtf.roles.SubtreeLocalRoleMap).
+
+    Pass 'format=json' for JSON output, and 'chunk_size' to control how
+    many objects are processed between ZODB cache cleanups.
+    """
+
+    def __call__(self):
+
+        format = self.request.get('format', 'csv')
+        try:
+            chunk_size = max(1, int(self.request.get('chunk_size', 1000)))
+        except (TypeError, ValueError,):
+            chunk_size = 1000
+        response = self.request.response
+
+        write = getRowWriter(response, format, 'local-roles', ('path', 'principal', 'roles', 'source',))
+
+        role_map = SubtreeLocalRoleMap(aq_inner(self.context), chunk_size=chunk_size)
+        for path, local_map, source in role_map:
+            for principal, roles in sorted(local_map.items()):
+                roles = sorted(roles)
+                if format != 'json':
+                    roles = ', '.join(roles)
+                write((path, principal, roles, source,))
+        write.close()
+
+        return ''
+
+def getRowWriter(response, format, filename, columns):
+    """Set the response headers for the given format, and return a row
+    writer that streams rows to the response.
+    """
+    if format == 'json':
+        response.setHeader("Content-type", "application/json")
+        return JSONRowWriter(response.write, columns)
+    else:
+        response.setHeader("Content-type", "text/csv")
+        response.setHeader("Content-disposition", "attachment;filename=%s.csv" % filename)
+        return CSVRowWriter(response.write, columns)
+
+class RowWriter(object):
+    """Buffer output and pass it to the response in reasonably sized chunks
+    """
+
+    chunk_size = 8192
+
+    def __init__(self, write, columns):
+        self.write = write
+        self.columns = columns
+        self.buffer = StringIO()
+
+    def flush(self):
+        self.write(self.buffer.getvalue())
+        self.buffer.seek(0)
+        self.buffer.truncate()
+
+    def maybe_flush(self):
+        if self.buffer.tell() >= self.chunk_size:
+            self.flush()
+
+    def close(self):
+        self.flush()
+
+class CSVRowWriter(RowWriter):
+    """Write rows as CSV, with a header row
+    """
+
+    def __init__(self, write, columns):
+        super(CSVRowWriter, self).__init__(write, columns)
+        self.writer = csv.writer(self.buffer)
+        self.writer.writerow([c.capitalize() for c in columns])
+
+    def __call__(self, row):
+        self.writer.writerow([value is not None and value or '' for value in row])
+        self.maybe_flush()
+
+class JSONRowWriter(RowWriter):
+    """Write rows as a JSON list of objects
+    """
+
+    def __init__(self, write, columns):
+        super(JSONRowWriter, self).__init__(write, columns)
+        self.buffer.write('[')
+        self.separator = ''
+
+    def __call__(self, row):
+        self.buffer.write(self.separator + json.dumps(dict(zip(self.columns, row))))
+        self.separator = ',\n'
+        self.maybe_flush()
+
+    def close(self):
+        self.buffer.write(']')
+        self.flush()
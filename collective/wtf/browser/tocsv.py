@@ -1,25 +1,53 @@
-from zope.component import getUtility
+from email.Utils import parsedate_tz, mktime_tz
+
+from persistent.TimeStamp import TimeStamp
+from App.Common import rfc1123_date
 
-from StringIO import StringIO
 from Products.Five.browser import BrowserView
+from Products.GenericSetup.context import SetupEnviron
+
+from collective.wtf.exportimport import exportWorkflowBody
+from collective.wtf.serial import modificationSerial
 
-from collective.wtf.interfaces import ICSVWorkflowSerializer
-from collective.wtf.exportimport import CSVWorkflowDefinitionConfigurator
-        
 class ToCSV(BrowserView):
     """Export the context workflow to CSV as a one-off
+
+    The response carries an ETag and a Last-Modified header derived from
+    the last transaction that modified the workflow, and conditional
+    requests are answered with 304 Not Modified without exporting anything.
+    The export itself is cached until the workflow is modified.
     """
-    
+
     def __call__(self):
-        
-        wfdc = CSVWorkflowDefinitionConfigurator(self.context)
-        info = wfdc.getWorkflowInfo(self.context.getId())
-        serializer = getUtility(ICSVWorkflowSerializer)
-        
-        output_stream = StringIO()
-        
-        serializer(info, output_stream) # allow parsing error to bubble
-
-        self.request.response.setHeader("Content-type","test/csv")
-        self.request.response.setHeader("Content-disposition","attachment;filename=%s.csv" % self.context.getId())    
-        return output_stream.getvalue()
\ No newline at end of file
+
+        response = self.request.response
+        serial = modificationSerial(self.context)
+
+        if serial is not None:
+            etag = '"%s"' % serial.encode('hex')
+            last_modified = int(TimeStamp(serial).timeTime())
+            response.setHeader("ETag", etag)
+            response.setHeader("Last-Modified", rfc1123_date(last_modified))
+            if self.notModified(etag, last_modified):
+                response.setStatus(304)
+                return ''
+
+        fingerprint, body = exportWorkflowBody(self.context, SetupEnviron())
+
+        response.setHeader("Content-type","text/csv")
+        response.setHeader("Content-disposition","attachment;filename=%s.csv" % self.context.getId())
+        return body
+
+    def notModified(self, etag, last_modified):
+        if_none_match = self.request.get_header('If-None-Match', None)
+        if if_none_match:
+            tags = [t.strip() for t in if_none_match.split(',')]
+            return etag in tags or '*' in tags
+
+        if_modified_since = self.request.get_header('If-Modified-Since', None)
+        if if_modified_since:
+            since = parsedate_tz(if_modified_since.split(';')[0])
+            if since is not None:
+                return last_modified <= mktime_tz(since)
+
+        return False
@@ -0,0 +1,18 @@
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from Acquisition import aq_inner
+from Products.Five.browser import BrowserView
+
+from collective.wtf.availability import listTransitionActions
+
+class AvailableTransitions(BrowserView):
+    """Return the transitions the current user may trigger on the context,
+    as JSON
+    """
+
+    def __call__(self):
+        self.request.response.setHeader("Content-type", "application/json")
+        return json.dumps(listTransitionActions(aq_inner(self.context)))
@@ -0,0 +1,18 @@
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from Acquisition import aq_inner
+from Products.Five.browser import BrowserView
+
+from collective.wtf.worklists import listWorklistCounts
+
+class WorklistCounts(BrowserView):
+    """Return the (cached) counts of the worklists of CSV-imported
+    workflows that the current user may see, as JSON
+    """
+
+    def __call__(self):
+        self.request.response.setHeader("Content-type", "application/json")
+        return json.dumps(listWorklistCounts(aq_inner(self.context)))
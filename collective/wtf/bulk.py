@@ -0,0 +1,233 @@
+import time
+import logging
+
+import transaction
+from ZODB.POSException import ConflictError
+
+from Acquisition import aq_base
+
+from Products.CMFCore.utils import getToolByName
+
+from collective.wtf.utils import defer_automatic_transitions
+from collective.wtf.utils import flush_automatic_transitions
+from collective.wtf.utils import fire_automatic_transitions
+from collective.wtf.worklists import invalidateWorklistCounts
+
+logger = logging.getLogger('collective.wtf')
+
+class BulkTransition(object):
+    """Perform one workflow transition on many objects.
+
+    The objects are given either as a catalog query or as a list of
+    physical paths. A query is resolved to a sorted list of paths once,
+    before any object is touched, so that the set of objects does not
+    shift as their states change.
+
+    The paths are processed in chunks of chunk_size. Within a chunk:
+
+      - each object is transitioned with the workflow tool's
+        doActionFor(), inside a savepoint, so a failure only rolls back
+        that object, and is recorded in the report;
+
+      - the usual workflow events are fired, and the workflow tool
+        reindexes the object, but the automatic transition handlers in
+        collective.wtf.utils only collect the objects they are called for;
+
+      - objects for which the transition is not currently available are
+        skipped. This makes it safe to run the same job again.
+
+    At the end of the chunk, automatic transitions are evaluated once for
+    each transitioned or collected object (deepest first, so that children
+    settle before their parents), and the objects that changed state have
+    their workflow variables reindexed. Objects that a workflow script
+    moved are only included if a handler collected them in their new
+    place. The chunk is then committed (or,
+    if commit is false, a savepoint is taken) and the ZODB cache is given
+    a chance to shrink. If the commit raises a ConflictError, the chunk is
+    retried up to 'retries' times.
+
+    The report returned by run() has a 'position' key, which is the index
+    of the first path not yet committed. To resume an interrupted run over
+    a list of paths, pass the same paths and start=position. When a query
+    was used, simply running the query again has the same effect, since
+    objects that have already been transitioned are either no longer
+    matched or are skipped.
+    """
+
+    chunk_size = 100
+    retries = 3
+
+    def __init__(self, context, transition, query=None, paths=None,
+                 chunk_size=None, commit=True, comment=''):
+        if (query is None) == (paths is None):
+            raise ValueError("Pass either a catalog query or a list of paths")
+
+        self.context = context
+        self.transition = transition
+        self.query = query
+        self.paths = paths
+        self.commit = commit
+        self.comment = comment
+        if chunk_size is not None:
+            self.chunk_size = chunk_size
+
+        self.portal = getToolByName(context, 'portal_url').getPortalObject()
+        self.wtool = getToolByName(context, 'portal_workflow')
+
+    def getPaths(self):
+        """Return the list of paths to process
+        """
+        if self.paths is None:
+            catalog = getToolByName(self.context, 'portal_catalog')
+            self.paths = sorted([b.getPath() for b in catalog(**self.query)])
+        return self.paths
+
+    def run(self, start=0):
+        """Process all paths from the given index on, and return a report
+        """
+        paths = self.getPaths()
+        report = {'transition': self.transition,
+                  'total': len(paths),
+                  'start': start,
+                  'position': start,
+                  'transitioned': 0,
+                  'skipped': 0,
+                  'automatic': 0,
+                  'failed': [],
+                  'conflicts': 0,
+                  'elapsed': 0.0,
+                  'rate': 0.0,
+                  }
+
+        started = time.time()
+        for position in xrange(start, len(paths), self.chunk_size):
+            chunk = paths[position:position + self.chunk_size]
+            self._runChunk(chunk, report)
+            report['position'] = position + len(chunk)
+
+            report['elapsed'] = time.time() - started
+            done = report['position'] - start
+            if report['elapsed'] > 0:
+                report['rate'] = done / report['elapsed']
+            logger.info("Bulk transition '%s': %d/%d (%.1f items/s, %d failed)" %
+                            (self.transition, report['position'], len(paths),
+                             report['rate'], len(report['failed']),))
+
+        return report
+
+    def _runChunk(self, chunk, report):
+        attempt = 0
+        while True:
+            counts = {'transitioned': 0, 'skipped': 0, 'automatic': 0}
+            failed = []
+            try:
+                self._processChunk(chunk, counts, failed)
+                if self.commit:
+                    transaction.commit()
+                else:
+                    transaction.savepoint(optimistic=True)
+            except ConflictError:
+                if not self.commit or attempt >= self.retries:
+                    raise
+                transaction.abort()
+                attempt += 1
+                report['conflicts'] += 1
+                logger.info("Bulk transition '%s': conflict, retrying chunk starting at %s" %
+                                (self.transition, chunk[0],))
+                continue
+            break
+
+        for key, value in counts.items():
+            report[key] += value
+        report['failed'].extend(failed)
+        self._minimizeCache()
+
+    def _processChunk(self, chunk, counts, failed):
+        touched = {}
+        defer_automatic_transitions()
+        try:
+            for path in chunk:
+                savepoint = transaction.savepoint(optimistic=True)
+                try:
+                    ob = self.portal.unrestrictedTraverse(path)
+                    result = self._transition(ob)
+                except ConflictError:
+                    raise
+                except Exception, e:
+                    savepoint.rollback()
+                    logger.warning("Bulk transition '%s' failed for %s: %s" %
+                                    (self.transition, path, e,))
+                    failed.append((path, '%s: %s' % (e.__class__.__name__, e,),))
+                    continue
+                if result is None:
+                    counts['skipped'] += 1
+                    continue
+                counts['transitioned'] += 1
+                if result is not False:
+                    touched['/'.join(result.getPhysicalPath())] = result
+        finally:
+            deferred = flush_automatic_transitions()
+
+        rolled_back = set([path for path, error in failed])
+        for path, ob in deferred.items():
+            if path not in rolled_back:
+                touched.setdefault(path, ob)
+
+        # Deepest first, so that children settle before their parents
+        paths = sorted(touched.keys(), key=lambda p: (-p.count('/'), p,))
+        for path in paths:
+            ob = touched[path]
+            if fire_automatic_transitions(ob):
+                counts['automatic'] += 1
+                self.wtool._reindexWorkflowVariables(ob)
+
+        if touched:
+            invalidateWorklistCounts(self.context)
+
+    def _transition(self, ob):
+        """Perform the transition on one object. Returns None if the
+        transition is not available, False if the object is no longer in
+        its place (a workflow script deleted or moved it), and the object
+        otherwise.
+        """
+        action = self.transition
+        for workflow in self.wtool.getWorkflowsFor(ob):
+            if workflow.isActionSupported(ob, action):
+                break
+        else:
+            return None
+
+        path = ob.getPhysicalPath()
+        self.wtool.doActionFor(ob, action, wf_id=workflow.getId(), comment=self.comment)
+        if aq_base(self.portal.unrestrictedTraverse(path, None)) is not aq_base(ob):
+            return False
+        return ob
+
+    def _minimizeCache(self):
+        jar = getattr(aq_base(self.portal), '_p_jar', None)
+        if jar is not None:
+            jar.cacheGC()
+
+def bulkTransition(context, transition, query=None, paths=None, start=0, **kw):
+    """Perform the given transition on all objects matching a catalog
+    query, or at the given paths, and return a report. See BulkTransition.
+    """
+    return BulkTransition(context, transition, query=query, paths=paths, **kw).run(start=start)
+
+def formatReport(report):
+    """Return a plain-text summary of a bulk transition report
+    """
+    lines = ["Transition:   %s" % report['transition'],
+             "Processed:    %d of %d (from %d)" % (report['position'] - report['start'],
+                                                   report['total'], report['start'],),
+             "Transitioned: %d" % report['transitioned'],
+             "Skipped:      %d" % report['skipped'],
+             "Automatic:    %d" % report['automatic'],
+             "Conflicts:    %d" % report['conflicts'],
+             "Failed:       %d" % len(report['failed']),
+             "Elapsed:      %.1fs (%.1f items/s)" % (report['elapsed'], report['rate'],),
+             "Resume at:    %d" % report['position'],
+             ]
+    for path, error in report['failed']:
+        lines.append("  %s: %s" % (path, error,))
+    return '\n'.join(lines)
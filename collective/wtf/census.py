@@ -0,0 +1,122 @@
+from BTrees.IIBTree import IISet
+from BTrees.IIBTree import intersection
+
+from Products.CMFCore.utils import getToolByName
+
+def getTypesByWorkflow(context):
+    """Return a dict of workflow id -> list of portal types whose chain
+    includes that workflow. Placeful workflow policies are not taken into
+    account.
+    """
+    portal_workflow = getToolByName(context, 'portal_workflow')
+    portal_types = getToolByName(context, 'portal_types')
+
+    types_by_workflow = {}
+    for portal_type in portal_types.listContentTypes():
+        for workflow_id in portal_workflow.getChainForPortalType(portal_type):
+            types_by_workflow.setdefault(workflow_id, []).append(portal_type)
+    return types_by_workflow
+
+def getIndexRIDs(catalog, index_name, value):
+    """Return the set of catalog record ids indexed under the given value
+    in a FieldIndex or KeywordIndex, read straight from the index data
+    without loading any brains or objects.
+    """
+    try:
+        index = catalog._catalog.getIndex(index_name)
+    except KeyError:
+        return None
+    rids = index._index.get(value, None)
+    if rids is None:
+        return IISet()
+    if isinstance(rids, int):
+        return IISet((rids,))
+    return rids
+
+def _readIndex(catalog, index_name, values=None):
+    """Return a dict of value -> record ids for the given index (optionally
+    only for the given values), or None if there is no such index.
+    """
+    try:
+        index = catalog._catalog.getIndex(index_name)
+    except KeyError:
+        return None
+    if values is None:
+        values = index._index.keys()
+    buckets = {}
+    for value in values:
+        rids = getIndexRIDs(catalog, index_name, value)
+        if rids:
+            buckets[value] = rids
+    return buckets
+
+def takeCensus(context, workflow_ids=None):
+    """Count the catalogued objects in each state of each workflow, by
+    portal type, using the index of each workflow's state variable and the
+    portal_type index. No brains or objects are loaded, and each index is
+    only read once.
+
+    Returns a dict of workflow id -> dict with keys 'state_variable',
+    'title', 'total' and 'states', a dict of state id -> dict of portal
+    type -> count. States that are not (or no longer) defined by the
+    workflow are included if objects of its types are in them. 'total' and
+    'states' are None if the state variable is not indexed.
+    """
+    portal_workflow = getToolByName(context, 'portal_workflow')
+    catalog = getToolByName(context, 'portal_catalog')
+
+    types_by_workflow = getTypesByWorkflow(context)
+    if workflow_ids is None:
+        workflow_ids = portal_workflow.objectIds()
+
+    type_rids = _readIndex(catalog, 'portal_type') or {}
+    state_indexes = {}
+
+    census = {}
+    for workflow_id in workflow_ids:
+        workflow = portal_workflow.getWorkflowById(workflow_id)
+        state_variable = getattr(workflow, 'state_var', None)
+        if state_variable is None:
+            continue
+
+        entry = census[workflow_id] = {'state_variable': state_variable,
+                                       'title': workflow.title_or_id(),
+                                       'total': None,
+                                       'states': None,
+                                       }
+
+        if state_variable not in state_indexes:
+            state_indexes[state_variable] = _readIndex(catalog, state_variable)
+        state_rids = state_indexes[state_variable]
+        if state_rids is None:
+            continue
+
+        states = dict([(state_id, {},) for state_id in workflow.states.objectIds()])
+        total = 0
+        for portal_type in types_by_workflow.get(workflow_id, []):
+            rids = type_rids.get(portal_type, None)
+            if not rids:
+                continue
+            for state_id, in_state in state_rids.items():
+                count = len(intersection(in_state, rids))
+                if count:
+                    states.setdefault(state_id, {})[portal_type] = count
+                    total += count
+
+        entry['states'] = states
+        entry['total'] = total
+
+    return census
+
+def countAffected(census, workflow_id, state_ids):
+    """Return a dict of state id -> number of objects, for the given states
+    of the given workflow, from a census. States without objects are left
+    out.
+    """
+    states = census.get(workflow_id, {}).get('states', None) or {}
+    affected = {}
+    for state_id in state_ids:
+        count = sum(states.get(state_id, {}).values())
+        if count:
+            affected[state_id] = count
+    return affected
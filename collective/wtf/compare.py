@@ -0,0 +1,219 @@
+from weakref import WeakKeyDictionary
+
+try:
+    from hashlib import md5
+except ImportError: # Python 2.4
+    from md5 import new as md5
+
+from collective.wtf.flyweight import FrozenDict
+
+# Fingerprints of frozen info dicts
+_frozen_fingerprints = WeakKeyDictionary()
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return str(value).strip()
+
+def _names(values):
+    return tuple(sorted(set([_text(v) for v in values or () if _text(v)])))
+
+def canonicalPermissions(permissions):
+    """Return a dict of permission name -> (acquired, roles)
+    """
+    return dict([(_text(p['name']), (bool(p['acquired']), _names(p['roles']),),)
+                    for p in permissions])
+
+def canonicalState(state):
+    return {'title': _text(state['title']),
+            'description': _text(state['description']),
+            'transitions': _names(state['transitions']),
+            'permissions': canonicalPermissions(state['permissions']),
+            'groups': tuple(sorted([(_text(g), _names(r),) for g, r in state.get('groups') or () if _names(r)])),
+            }
+
+def canonicalTransition(transition):
+    return {'title': _text(transition['title']),
+            'description': _text(transition['description']),
+            'new_state_id': _text(transition['new_state_id']),
+            'actbox_name': _text(transition['actbox_name']),
+            'actbox_url': _text(transition['actbox_url']),
+            'actbox_category': _text(transition['actbox_category']),
+            'trigger_type': _text(transition['trigger_type']).upper(),
+            'script_name': _text(transition['script_name']),
+            'after_script_name': _text(transition['after_script_name']),
+            'guard_expr': _text(transition['guard_expr']),
+            'guard_permissions': _names(transition['guard_permissions']),
+            'guard_roles': _names(transition['guard_roles']),
+            'guard_groups': _names(transition.get('guard_groups')),
+            }
+
+def canonicalWorklist(worklist):
+    return {'description': _text(worklist['description']),
+            'actbox_name': _text(worklist['actbox_name']),
+            'actbox_url': _text(worklist.get('actbox_url')),
+            'actbox_category': _text(worklist.get('actbox_category')),
+            'guard_expr': _text(worklist['guard_expr']),
+            'guard_permissions': _names(worklist['guard_permissions']),
+            'guard_roles': _names(worklist['guard_roles']),
+            'guard_groups': _names(worklist.get('guard_groups')),
+            'var_match': tuple(sorted([(_text(k), _text(v)) for k, v in worklist['var_match']])),
+            }
+
+def canonicalScript(script):
+    return {'meta_type': _text(script['meta_type']),
+            'module': _text(script['module']),
+            'function': _text(script['function']),
+            'filename': _text(script.get('filename')),
+            }
+
+def canonicalGuard(guard):
+    """Return a (permissions, roles, groups, expression) tuple for a guard
+    given as a dict with 'guard_*' keys, or () if there is no guard, or it
+    does not restrict anything
+    """
+    if not guard:
+        return ()
+    canonical = (_names(guard.get('guard_permissions')),
+                 _names(guard.get('guard_roles')),
+                 _names(guard.get('guard_groups')),
+                 _text(guard.get('guard_expr')),)
+    if not [c for c in canonical if c]:
+        return ()
+    return canonical
+
+def canonicalVariable(variable):
+    return (_text(variable['id']),
+            _text(variable.get('description')),
+            bool(variable.get('for_catalog')),
+            bool(variable.get('for_status')),
+            bool(variable.get('update_always')),
+            _text(variable.get('default_value')),
+            _text(variable.get('default_expr')),
+            canonicalGuard(variable),)
+
+def canonicalWorkflow(info):
+    return {'title': _text(info.get('title')),
+            'description': _text(info.get('description')),
+            'initial_state': _text(info.get('initial_state')),
+            'state_variable': _text(info.get('state_variable')),
+            'meta_type': _text(info.get('meta_type', 'Workflow')),
+            'permissions': _names(info.get('permissions')),
+            'recorded': _names([v['id'] for v in info.get('variable_info', ()) if v.get('for_status')]),
+            'manager_bypass': bool(info.get('manager_bypass')),
+            'creation_guard': canonicalGuard(info.get('creation_guard')),
+            'variables': tuple(sorted([canonicalVariable(v) for v in info.get('variable_info', ())])),
+            }
+
+def canonicalInfo(info):
+    """Return the canonical form of a whole info dict: a dict with the
+    keys 'workflow', and 'states', 'transitions', 'worklists' and 'scripts'
+    holding dicts of item id -> canonical item.
+    """
+    canonical = {'workflow': canonicalWorkflow(info)}
+    for name, key, canonicalItem in (('states', 'state_info', canonicalState,),
+                                     ('transitions', 'transition_info', canonicalTransition,),
+                                     ('worklists', 'worklist_info', canonicalWorklist,),
+                                     ('scripts', 'script_info', canonicalScript,),):
+        canonical[name] = dict([(_text(i['id']), canonicalItem(i)) for i in info.get(key, ())])
+    return canonical
+
+def _diffItems(old_items, new_items, canonical):
+    old = dict([(_text(i['id']), canonical(i)) for i in old_items])
+    new = dict([(_text(i['id']), canonical(i)) for i in new_items])
+
+    added = sorted([k for k in new if k not in old])
+    removed = sorted([k for k in old if k not in new])
+    changed = {}
+    for k in sorted(new):
+        if k in old and old[k] != new[k]:
+            changed[k] = sorted([key for key in new[k] if old[k].get(key) != new[k][key]])
+
+    return added, removed, changed
+
+def diffWorkflowInfo(old_info, new_info):
+    """Compare two info dicts. Returns a dict with the keys:
+
+      'workflow' -- a list of changed workflow-level keys
+
+      'states_added', 'states_removed' -- lists of state ids
+
+      'states_changed' -- a dict of state id -> list of changed keys
+
+      'permissions_changed' -- a list of ids of states whose permission
+        map will change, i.e. which need role mappings to be updated
+
+      'transitions_added', 'transitions_removed', 'transitions_changed',
+      'worklists_added', 'worklists_removed', 'worklists_changed',
+      'scripts_added', 'scripts_removed', 'scripts_changed' -- as for
+        states
+
+    old_info may be None, in which case everything is added.
+
+    Only the aspects of a workflow that can be expressed in the CSV format
+    are compared. Values are normalised so that a freshly parsed CSV file
+    compares equal to the live workflow it was imported into: whitespace
+    is stripped, empty list items are dropped, and lists whose order
+    carries no meaning are sorted.
+    """
+
+    if old_info is None:
+        old_info = {'state_info': [], 'transition_info': [], 'worklist_info': [], 'script_info': []}
+        workflow_changes = sorted(canonicalWorkflow(new_info).keys())
+    else:
+        old_wf = canonicalWorkflow(old_info)
+        new_wf = canonicalWorkflow(new_info)
+        workflow_changes = sorted([k for k in new_wf if old_wf[k] != new_wf[k]])
+
+    diff = {'workflow': workflow_changes}
+
+    for name, key, canonical in (('states', 'state_info', canonicalState,),
+                                 ('transitions', 'transition_info', canonicalTransition,),
+                                 ('worklists', 'worklist_info', canonicalWorklist,),
+                                 ('scripts', 'script_info', canonicalScript,),):
+        added, removed, changed = _diffItems(old_info.get(key, ()), new_info.get(key, ()), canonical)
+        diff['%s_added' % name] = added
+        diff['%s_removed' % name] = removed
+        diff['%s_changed' % name] = changed
+
+    # If the set of managed permissions changes, every state is affected
+    if 'permissions' in workflow_changes:
+        diff['permissions_changed'] = sorted([_text(s['id']) for s in new_info['state_info']])
+    else:
+        diff['permissions_changed'] = sorted([k for k, v in diff['states_changed'].items() if 'permissions' in v] +
+                                             diff['states_added'])
+
+    return diff
+
+def hasChanges(diff):
+    """Return True if the given diff contains any changes
+    """
+    for value in diff.values():
+        if value:
+            return True
+    return False
+
+def _stable(value):
+    if isinstance(value, dict):
+        return tuple(sorted([(k, _stable(v),) for k, v in value.items()]))
+    elif isinstance(value, (list, tuple,)):
+        return tuple([_stable(v) for v in value])
+    return value
+
+def fingerprintInfo(info):
+    """Return a fingerprint (a hex digest) of the given info dict. Two info
+    dicts have the same fingerprint if they describe the same workflow as
+    far as the CSV format is concerned, regardless of the order of states,
+    transitions, roles and so on (see canonicalInfo()).
+    """
+    if isinstance(info, FrozenDict):
+        fingerprint = _frozen_fingerprints.get(info, None)
+        if fingerprint is None:
+            fingerprint = _frozen_fingerprints[info] = _fingerprint(info)
+        return fingerprint
+    return _fingerprint(info)
+
+def _fingerprint(info):
+    return md5(repr(_stable(canonicalInfo(info)))).hexdigest()
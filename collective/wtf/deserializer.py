@@ -6,15 +6,65 @@ from zope.interface import implements
 from zope.component import getUtility
 
 from collective.wtf.interfaces import ParsingError
+from collective.wtf.interfaces import ParsingErrors
 from collective.wtf.interfaces import ICSVWorkflowDeserializer
 from collective.wtf.interfaces import ICSVWorkflowConfig
+from collective.wtf.expressions import compileExpression
 
 any_whitespace = re.compile(r'\s+')
 not_alnum = re.compile(r'[^a-z1-9-]')
 section_pattern = re.compile(r'^\s*\[.+\]\s*$')
 
 import logging
-logger = logging.getLogger()
+logger = logging.getLogger('collective.wtf')
+
+class PositionReader(object):
+    """Wraps a CSV reader, keeping track of the line the current row starts
+    on. In collecting mode, errors are gathered in the errors list instead
+    of being raised; otherwise errors is None.
+    """
+    
+    def __init__(self, reader, filename=None, collect=False):
+        self.reader = reader
+        self.filename = filename
+        self.errors = None
+        if collect:
+            self.errors = []
+        self.line = 0
+        
+    def __iter__(self):
+        return self
+        
+    def next(self):
+        self.line = int(self.reader.line_num) + 1
+        return self.reader.next()
+        
+    @property
+    def line_num(self):
+        return self.reader.line_num
+        
+    def fail(self, error, line=None):
+        """Fill in the position of the given ParsingError where it is not
+        known, and raise or collect it
+        """
+        if error.filename is None:
+            error.filename = self.filename
+        if error.line is None:
+            error.line = line
+        if self.errors is None:
+            raise error
+        self.errors.append(error)
+
+class SectionMap(dict):
+    """The keys and values of a section, as returned by get_map(). lines
+    maps each key to the line it was found on.
+    """
+    
+    __slots__ = ('lines',)
+    
+    def __init__(self, *args, **kw):
+        dict.__init__(self, *args, **kw)
+        self.lines = {}
 
 class DefaultDeserializer(object):
     implements(ICSVWorkflowDeserializer)
@@ -23,27 +73,38 @@ class DefaultDeserializer(object):
         self.handlers = dict(workflow=self.parse_workflow,
                              state=self.parse_state,
                              transition=self.parse_transition,
-                             script=self.parse_script)
+                             script=self.parse_script,
+                             variables=self.parse_variables)
 
-    def __call__(self, input_stream, config_variant=u""):
+    def __call__(self, input_stream, config_variant=u"", filename=None, collect=False):
 
         config = getUtility(ICSVWorkflowConfig, name=config_variant)
-        
-        try:
-            dialect = csv.Sniffer().sniff(input_stream.read(1024))
-        except csv.Error:
-            dialect = csv.excel
-        input_stream.seek(0)
-        reader = csv.reader(input_stream, dialect)
+        reader = self.make_reader(input_stream, filename, collect)
     
         info = copy.deepcopy(config.info_template)
         
         self.dispatch(config, info, reader)
-        self.backfill(info)
-        self.validate(info)
+        try:
+            self.backfill(info)
+            self.validate(info)
+        except ParsingError, e:
+            reader.fail(e)
+        
+        if reader.errors:
+            raise ParsingErrors(reader.errors, filename)
     
         return info
 
+    def make_reader(self, input_stream, filename=None, collect=False):
+        """Return a PositionReader for the stream, guessing its dialect
+        """
+        try:
+            dialect = csv.Sniffer().sniff(input_stream.read(1024))
+        except csv.Error:
+            dialect = csv.excel
+        input_stream.seek(0)
+        return PositionReader(csv.reader(input_stream, dialect), filename, collect)
+
     # parsing methods
 
     def dispatch(self, config, info, reader):
@@ -61,13 +122,18 @@ class DefaultDeserializer(object):
                 
             handler = self.handlers.get(section, None)
             if handler:
-                handler(config, info, reader)
+                start = reader.line
+                try:
+                    handler(config, info, reader)
+                except ParsingError, e:
+                    # In collecting mode, carry on with the next section
+                    reader.fail(e, start)
                 
         missing = checklist - found
         if len(missing) == 1:
-            raise ParsingError("Expected to find a [%s] section." % list(missing)[0].capitalize())
+            reader.fail(ParsingError("Expected to find a [%s] section." % list(missing)[0].capitalize()))
         elif len(missing) > 1:
-            raise ParsingError("Expected to find at least one of each of these sections: %s" % ', '.join(["[%s]" % m.capitalize() for m in missing]))
+            reader.fail(ParsingError("Expected to find at least one of each of these sections: %s" % ', '.join(["[%s]" % m.capitalize() for m in missing])))
     
     def parse_workflow(self, config, info, reader):
         """Parse a [Workflow] section
@@ -89,11 +155,45 @@ class DefaultDeserializer(object):
         
         info['state_variable'] = wf_info.get('state-variable', 'review_state')
         
+    def parse_variables(self, config, info, reader):
+        """Parse a [Variables] section
+        """
+        v_info = self.get_map(reader)
+        self.build_variables(config, info, v_info)
+        
+    def build_variables(self, config, info, v_info):
+        """Set which variables are recorded in the history, given the map
+        of a [Variables] section
+        """
+        
+        if 'record' not in v_info:
+            raise ParsingError("The [Variables] section must have a 'Record:' defined")
+        
+        recorded = [v for v in self.get_list(v_info['record']) if v]
+        if [v.lower() for v in recorded] == ['none']:
+            recorded = []
+        
+        known = [v['id'] for v in info['variable_info']]
+        unknown = [v for v in recorded if v not in known]
+        if unknown:
+            raise ParsingError("The 'Record:' of the [Variables] section lists unknown variables: %s. Known variables are: %s" % (', '.join(unknown), ', '.join(known),),
+                               **self.position(v_info, 'record'))
+        
+        for variable in info['variable_info']:
+            variable['for_status'] = variable['id'] in recorded
+        
     def parse_state(self, config, info, reader):
         """Parse a [State] section
         """
         
         s_info = self.get_map(reader, stop='permissions')
+        self.build_state(config, info, s_info, reader)
+        
+    def build_state(self, config, info, s_info, rows):
+        """Add a state (and its worklist, if any) to info, given the map
+        of a [State] section. The rows of the permissions table are read
+        from rows, up to a blank line.
+        """
         
         required = ['id', 'title']
         missing = [m for m in required if m not in s_info]
@@ -105,7 +205,8 @@ class DefaultDeserializer(object):
             
         roles = s_info['permissions'][1:]
         if not roles or self.normalize(roles[0]) not in ('acquire', 'acquired',):
-            raise ParsingError("The [State] section must end with a 'Permissions' table that contains role names along the top row, starting with 'Acquired'")
+            raise ParsingError("The [State] section must end with a 'Permissions' table that contains role names along the top row, starting with 'Acquired'",
+                               **self.position(s_info, 'permissions'))
         roles = [r.strip() for r in roles[1:]] # ignore the "acquire" column
         
         state = copy.deepcopy(config.state_template)
@@ -117,7 +218,7 @@ class DefaultDeserializer(object):
         state['transitions'] = self.get_list(s_info.get('transitions', ''))
 
         # Populate permission/role mappings
-        for line in reader:
+        for line in rows:
             if not line or not ''.join(line): #  EOF or blank line:
                 break
 
@@ -144,26 +245,40 @@ class DefaultDeserializer(object):
 
         # Populate worklist if any
         if 'worklist' in s_info:
-            
-            worklist = copy.deepcopy(config.worklist_template)
-            
-            worklist['id']                = self.normalize(s_info['worklist'])
-            worklist['actbox_name']       = s_info.get('worklist-label', '')
-            worklist['description']       = s_info['worklist'] 
-            worklist['actbox_url']        = '%(portal_url)s/search?review_state=' + state['id']
-            worklist['guard_roles']       = self.get_list(s_info.get('worklist-guard-role', s_info.get('worklist-guard-roles', '')))
-            worklist['guard_permissions'] = self.get_list(s_info.get('worklist-guard-permission', s_info.get('worklist-guard-permissions', '')))
-            worklist['guard_expr']        = s_info.get('worklist-guard-expression', '')
-            worklist['var_match']         = [('review_state', state['id'])]
-            
-            info['worklist_info'].append(worklist)
+            info['worklist_info'].append(self.build_worklist(config, state['id'], s_info))
+        
+    def build_worklist(self, config, state_id, s_info):
+        """Return the worklist for a state, given the map of its [State]
+        section
+        """
+        
+        worklist = copy.deepcopy(config.worklist_template)
+        
+        worklist['id']                = self.normalize(s_info['worklist'])
+        worklist['actbox_name']       = s_info.get('worklist-label', '')
+        worklist['description']       = s_info['worklist'] 
+        worklist['actbox_url']        = '%(portal_url)s/search?review_state=' + state_id
+        worklist['guard_roles']       = self.get_list(s_info.get('worklist-guard-role', s_info.get('worklist-guard-roles', '')))
+        worklist['guard_permissions'] = self.get_list(s_info.get('worklist-guard-permission', s_info.get('worklist-guard-permissions', '')))
+        worklist['guard_expr']        = s_info.get('worklist-guard-expression', '')
+        worklist['var_match']         = [('review_state', state_id)]
         
+        self.check_expression(worklist['guard_expr'], "'Worklist guard expression:' of the [State] section",
+                              **self.position(s_info, 'worklist-guard-expression'))
+        
+        return worklist
         
     def parse_transition(self, config, info, reader):
         """Parse a [Transition] section
         """
         
         t_info = self.get_map(reader)
+        self.build_transition(config, info, t_info)
+        
+    def build_transition(self, config, info, t_info):
+        """Add a transition (and any implicit scripts) to info, given the
+        map of a [Transition] section
+        """
         
         required = ['id']
         missing = [m for m in required if m not in t_info]
@@ -185,6 +300,9 @@ class DefaultDeserializer(object):
         transition['script_name']       = script_name = t_info.get('script-before', '')
         transition['after_script_name'] = after_script_name = t_info.get('script-after', '')
         transition['actbox_category']   = t_info.get('category', 'workflow')
+        
+        self.check_expression(transition['guard_expr'], "'Guard expression:' of the [Transition] section",
+                              **self.position(t_info, 'guard-expression'))
 
         # Create ExternalMethod scripts on the fly if given a module path
         if '.Extensions.' in script_name:
@@ -266,6 +384,17 @@ class DefaultDeserializer(object):
             
         
         
+    def check_expression(self, expression, location, line=None, column=None):
+        """Compile a TALES expression, so that syntax errors are reported
+        at import time rather than when the guard is first checked. The
+        compiled expression is kept for re-use by the guard at runtime.
+        """
+        try:
+            compileExpression(expression)
+        except Exception, e:
+            raise ParsingError("Invalid TALES expression '%s' in %s: %s" % (expression, location, str(e)),
+                               line=line, column=column)
+        
     # helper methods
         
     def read_section(self, line):
@@ -284,9 +413,10 @@ class DefaultDeserializer(object):
     def get_map(self, reader, stop=None):
         """Read all values until a blank line or the 'stop' line are hit.
         If the 'stop' line is hit, it will be included under that key in
-        full, as a list, so that the line is not lost.
+        full, as a list, so that the line is not lost. Returns a
+        SectionMap.
         """
-        values = {}
+        values = SectionMap()
         
         for line in reader:
             
@@ -294,7 +424,11 @@ class DefaultDeserializer(object):
                 break
 
             if len(line) < 2:
-                logger.warning("Expected key/value pair on line %s, skipping" % ','.join(line))
+                if reader.errors is None:
+                    logger.warning("Expected key/value pair on line %d: %s, skipping" % (reader.line, ','.join(line),))
+                else:
+                    reader.fail(ParsingError("Expected a key/value pair, found '%s'" % ','.join(line),
+                                             line=reader.line, column=2))
                 continue
             
             key = self.normalize(line[0])
@@ -302,13 +436,24 @@ class DefaultDeserializer(object):
             
             if value:
                 values[key] = line[1].strip()
+                values.lines[key] = reader.line
             
             if stop and key == stop:
                 values[key] = line
+                values.lines[key] = reader.line
                 break
             
         return values
         
+    def position(self, values, key, column=2):
+        """Return the line and column of the value of key in the given
+        section map, as keyword arguments for ParsingError
+        """
+        line = getattr(values, 'lines', {}).get(key, None)
+        if line is None:
+            return {}
+        return {'line': line, 'column': column}
+        
     def normalize(self, cell):
         """Make a cell value lowercase, remove non-alphanumeric characters, 
         strip leading and trailing whitespace, replace other whitespace with 
@@ -1,6 +1,12 @@
 import os.path
+import copy
 from StringIO import StringIO
 
+try:
+    from hashlib import md5
+except ImportError: # Python 2.4
+    from md5 import new as md5
+
 from zope.component import queryMultiAdapter
 from zope.component import getUtility
 
@@ -10,22 +16,52 @@ try:
 except ImportError:
     from Globals import InitializeClass
 
+from Products.CMFCore.utils import getToolByName
+
 from Products.GenericSetup.interfaces import IBody
 from Products.GenericSetup.interfaces import ISetupEnviron
 from Products.GenericSetup.utils import BodyAdapterBase
+from Products.GenericSetup.context import DirectoryExportContext
 
 from Products.DCWorkflow.interfaces import IDCWorkflowDefinition
 from Products.DCWorkflow.exportimport import WorkflowDefinitionConfigurator
 from Products.DCWorkflow.exportimport import _initDCWorkflow
 
 from zope.component import adapts
+from Acquisition import aq_inner, aq_parent
+from zope.interface import alsoProvides
 
 from collective.wtf.interfaces import ParsingError
 from collective.wtf.interfaces import ICSVWorkflowSerializer
 from collective.wtf.interfaces import ICSVWorkflowDeserializer 
+from collective.wtf.interfaces import ICSVWorkflowConfig
+from collective.wtf.interfaces import ICSVImportedWorkflow
+from collective.wtf.deserializer import DefaultDeserializer
+from collective.wtf.expressions import primeWorkflowGuards
+from collective.wtf.utils import clear_chain_cache
+from collective.wtf.rolemap import compileRoleMap
+from collective.wtf.rolemap import getStateGrants
+from collective.wtf.availability import compileAvailability
+from collective.wtf.availability import getStateAvailability
+from collective.wtf.flyweight import freezeInfo
+from collective.wtf.flyweight import thawInfo
+from collective.wtf.compare import diffWorkflowInfo
+from collective.wtf.compare import fingerprintInfo
+from collective.wtf.serial import modificationSerial
+from collective.wtf.locking import lockWorkflowTool
+from collective.wtf.census import takeCensus
+from collective.wtf.census import countAffected
+from collective.wtf.overlay import getOverlayBase
+from collective.wtf.overlay import parseOverlay
+from collective.wtf.overlay import applyOverlay
 
 import Products
 
+# Frozen info dicts of live workflows, keyed by physical path. Values are
+# (serial, info), see collective.wtf.serial.modificationSerial().
+_live_infos = {}
+_live_infos_size = 100
+
 class CSVWorkflowDefinitionConfigurator(WorkflowDefinitionConfigurator):
     """Cheat by borrowing a lot of logic from the DCWorkflow handler
     """
@@ -42,9 +78,29 @@ class CSVWorkflowDefinitionConfigurator(WorkflowDefinitionConfigurator):
         return self._workflowConfig(workflow_id=self._obj.getId())
         
     security.declarePublic('getWorkflowInfo')
-    def getWorkflowInfo(self, workflow_id ):
+    def getWorkflowInfo(self, workflow_id, frozen=False):
+        """Return the info dict for the workflow. If frozen is true, the
+        caller promises not to modify the result: it is then an immutable
+        version (see collective.wtf.flyweight), which is cached and shared
+        until the workflow is modified. For a workflow with uncommitted
+        changes, nothing can be cached, and a plain info dict is returned.
+        """
         if self.info is not None:
             return self.info
+        elif frozen:
+            workflow = self._obj
+            serial = modificationSerial(workflow)
+            if serial is None:
+                return self.getWorkflowInfo(workflow_id)
+            path = workflow.getPhysicalPath()
+            entry = _live_infos.get(path, None)
+            if entry is not None and entry[0] == serial and entry[1]['id'] == workflow_id:
+                return entry[1]
+            info = freezeInfo(self.getWorkflowInfo(workflow_id))
+            if len(_live_infos) >= _live_infos_size:
+                _live_infos.clear()
+            _live_infos[path] = (serial, info,)
+            return info
         else:
             
             workflow = self._obj
@@ -68,13 +124,16 @@ class DCWorkflowDefinitionBodyAdapter(BodyAdapterBase):
 
     adapts(IDCWorkflowDefinition, ISetupEnviron)
     
+    # The info dict to export, if the caller has extracted it already
+    info = None
+    
     def _exportBody(self):
         """Return the most commonly used aspects of a workflow as a CSV
         file string.
         """
         
         logger = self.environ.getLogger('workflow-csv')
-        wfdc = CSVWorkflowDefinitionConfigurator(self.context)
+        wfdc = CSVWorkflowDefinitionConfigurator(self.context, self.info)
         info = wfdc.getWorkflowInfo(self.context.getId())
         serializer = getUtility(ICSVWorkflowSerializer)
         
@@ -94,16 +153,16 @@ class DCWorkflowDefinitionBodyAdapter(BodyAdapterBase):
         
         logger = self.environ.getLogger('workflow-csv')
         
+        # Held until the transaction ends; importCSVWorkflow takes it first
+        lockWorkflowTool(aq_parent(aq_inner(self.context)))
+        
         if isinstance(body, dict):
             info = body
         else:
-            input_stream = StringIO(body)
-            deserializer = getUtility(ICSVWorkflowDeserializer)
-        
             info = {}
         
             try:
-                info = deserializer(input_stream)
+                info = parseCSVWorkflow(body, filename=self.filename)
             except ParsingError, p:
                 logger.error("Error parsing %s: %s" % (self.filename, str(p)))
                 raise p
@@ -172,20 +231,96 @@ class DCWorkflowDefinitionBodyAdapter(BodyAdapterBase):
                            , scripts
                            , self.environ
                            )
+        
+        if not ICSVImportedWorkflow.providedBy(self.context):
+            alsoProvides(self.context, ICSVImportedWorkflow)
+        
+        # share the expressions compiled (and checked) during parsing
+        primeWorkflowGuards(self.context)
+        
+        # used by collective.wtf.rolemap.applyRoleMap
+        compileRoleMap(self.context)
+        
+        # used by collective.wtf.availability.listAvailableTransitions
+        compileAvailability(self.context)
+        
+        # chains may name a workflow that did not exist before
+        clear_chain_cache()
 
     body = property(_exportBody, _importBody)
 
-def importCSVWorkflow(context):
-    """Import portlet managers and portlets
-    """
+# Parsed CSV workflow definitions, keyed by deserializer and config class
+# and the MD5 digest of the file body
+_parse_cache = {}
+_parse_cache_size = 100
+_parse_stats = {'hits': 0, 'misses': 0}
+
+def parseCSVWorkflow(body, frozen=False, base_body=None, filename=None, base_filename=None):
+    """Parse the given CSV workflow definition with the registered
+    deserializer, and return the info dict. If base_body is given, body
+    is an overlay of it (see collective.wtf.overlay). The base may not be
+    an overlay itself. filename and base_filename are used in error
+    messages.
     
-    site = context.getSite()
-    logger = context.getLogger('workflow-csv')
+    If the file has errors, it is parsed again in collecting mode, so that
+    the ParsingErrors raised lists all of them, with filename and
+    positions, rather than only the first.
     
-    portal_workflow = getattr(site, 'portal_workflow', None)
+    The result is cached for the lifetime of the process, so that when the
+    same file is imported into many sites it is only parsed once. Unless
+    frozen is true, each call returns a fresh copy, which the caller may
+    modify. If frozen is true, the shared, immutable version of the info
+    dict is returned (see collective.wtf.flyweight). Parsing errors are
+    not cached.
+    """
+    deserializer = getUtility(ICSVWorkflowDeserializer)
+    config = getUtility(ICSVWorkflowConfig)
+    key = (deserializer.__class__, config.__class__, md5(body).hexdigest(),)
+    if base_body is not None:
+        key += (md5(base_body).hexdigest(),)
     
-    if portal_workflow is None:
-        return
+    entry = _parse_cache.get(key, None)
+    if entry is None:
+        _parse_stats['misses'] += 1
+        if base_body is not None:
+            base_base_id = getOverlayBase(base_body)
+            if base_base_id is not None:
+                raise ParsingError("The base workflow of an overlay cannot be an overlay itself, "
+                                   "but %s is an overlay of %s" % (base_filename or 'the base', base_base_id,),
+                                   filename=filename)
+            base_info = parseCSVWorkflow(base_body, frozen=True, filename=base_filename)
+            # the result shares parts with the frozen base
+            info = thawInfo(applyOverlay(base_info, parseOverlay(body, filename=filename)))
+        else:
+            try:
+                info = deserializer(StringIO(body))
+            except ParsingError, e:
+                if not isinstance(deserializer, DefaultDeserializer):
+                    raise
+                deserializer(StringIO(body), filename=filename, collect=True)
+                raise e
+        entry = (info, freezeInfo(info),)
+        if len(_parse_cache) >= _parse_cache_size:
+            _parse_cache.clear()
+        _parse_cache[key] = entry
+    else:
+        _parse_stats['hits'] += 1
+    
+    if frozen:
+        return entry[1]
+    return copy.deepcopy(entry[0])
+
+def getParseStats():
+    """Return a copy of the parse cache counters: the number of 'hits'
+    and 'misses' since the process started
+    """
+    return dict(_parse_stats)
+
+def _iterCSVWorkflows(context, logger):
+    """Parse each workflow_csv/*.csv file in the given import context
+    that is not shadowed by an XML workflow definition, and generate
+    (filename, wf_name, info) tuples.
+    """
     
     csv_dir = context.listDirectory('workflow_csv')
     if not csv_dir:
@@ -215,39 +350,241 @@ def importCSVWorkflow(context):
         if body is None:
             return
         
-        input_stream = StringIO(body)
-        deserializer = getUtility(ICSVWorkflowDeserializer)
-        
         info = {}
         
         try:
-            info = deserializer(input_stream)
+            base_body = base_filename = None
+            base_id = getOverlayBase(body)
+            if base_id is not None:
+                base_filename = os.path.join("workflow_csv", "%s.csv" % base_id)
+                base_body = context.readDataFile(base_filename)
+                if base_body is None:
+                    raise ParsingError("The base workflow %s of the overlay was not found" % base_id,
+                                       filename=filename)
+            info = parseCSVWorkflow(body, frozen=True, base_body=base_body, filename=filename,
+                                    base_filename=base_filename)
         except ParsingError, p:
             logger.error("Error parsing %s: %s" % (filename, str(p)))
             raise p
         
-        wf = None
+        yield filename, wf_name, info
+
+def importCSVWorkflow(context):
+    """Import portlet managers and portlets
+    """
+    
+    site = context.getSite()
+    logger = context.getLogger('workflow-csv')
+    
+    portal_workflow = getattr(site, 'portal_workflow', None)
+    
+    if portal_workflow is None:
+        return
+    
+    # Keep other ZEO clients from importing at the same time
+    lock = lockWorkflowTool(portal_workflow)
+    skipped = 0
+    
+    for filename, wf_name, info in _iterCSVWorkflows(context, logger):
+        if not importOneCSVWorkflow(context, portal_workflow, filename, wf_name, info, logger):
+            skipped += 1
+    
+    request = getattr(site, 'REQUEST', None)
+    if lock is not None:
+        logger.info('CSV workflow import done: %d unchanged workflow(s) skipped, '
+                    'waited %.1fs for the import lock, %d conflict(s) on the lock, '
+                    'request retried %d time(s).' % (skipped, lock.waited, lock.conflicts,
+                                                     getattr(request, 'retry_count', 0),))
+
+def importOneCSVWorkflow(context, portal_workflow, filename, wf_name, info, logger):
+    """Create or update one workflow from a parsed CSV file. Returns False
+    if the workflow was skipped because it has not changed.
+    """
+    
+    wf = None
+    
+    if wf_name in portal_workflow.objectIds():
+        wf = portal_workflow[wf_name]
+        
+        # Rewriting a workflow that has not changed would only cause
+        # conflicts with concurrent transactions that use it. The bodies
+        # of Python scripts are read from files at import time, so they
+        # cannot be compared and such workflows are always imported.
+        if ICSVImportedWorkflow.providedBy(wf) and not _hasFileScripts(info) and \
+                getLiveFingerprint(wf) == fingerprintInfo(info):
+            logger.info('Workflow definition %s is unchanged, skipping.' % wf_name)
+            refreshCompiled(wf)
+            return False
+        
+        logger.info('Updating existing workflow definition %s.' % wf_name)
+    else:
+        logger.info('Creating workflow definition %s using standard workflows.' % wf_name)
+        wf_name = info['id']
+        meta_type = info.get('meta_type', 'Workflow')
+        for mt_info in Products.meta_types:
+            if mt_info['name'] == meta_type:
+                portal_workflow._setObject(wf_name, mt_info['instance'](wf_name))
+                break
+        
+        wf = portal_workflow[wf_name]
+    
+    importer = queryMultiAdapter((wf, context), IBody, name=u'collective.wtf')
+    importer.filename = filename # for error reporting
+    importer.body = info
+    return True
+
+def _hasFileScripts(info):
+    for script in info.get('script_info', ()):
+        if script.get('meta_type') == 'Script (Python)':
+            return True
+    return False
+
+def refreshCompiled(workflow):
+    """Prime the guards of the given workflow, and compile its role map and
+    availability matrix again if they are missing or out of date. As long
+    as they are current, the workflow is not modified.
+    """
+    primeWorkflowGuards(workflow)
+    states = workflow.states.objectValues()
+    if [s for s in states if getStateGrants(workflow, s.getId()) is None]:
+        compileRoleMap(workflow)
+    if [s for s in states if getStateAvailability(workflow, s) is None]:
+        compileAvailability(workflow)
+
+def planCSVWorkflow(context):
+    """Work out what importCSVWorkflow would do with the given import
+    context, without changing anything.
+    
+    Returns a list of dicts, one per CSV file, with keys 'filename',
+    'workflow', 'action' ('create' or 'update'), 'diff' (see
+    collective.wtf.compare.diffWorkflowInfo) and 'affected', a dict of
+    state id -> number of catalogued objects in that state (for the portal
+    types using the workflow) whose role mappings would need updating. 
+    """
+    
+    site = context.getSite()
+    logger = context.getLogger('workflow-csv')
+    
+    portal_workflow = getattr(site, 'portal_workflow', None)
+    
+    if portal_workflow is None:
+        return []
+    
+    catalog = getToolByName(site, 'portal_catalog', None)
+    
+    plan = []
+    files = list(_iterCSVWorkflows(context, logger))
+    
+    census = {}
+    if catalog is not None:
+        census = takeCensus(site, [wf_name for filename, wf_name, info in files
+                                    if wf_name in portal_workflow.objectIds()])
+    
+    for filename, wf_name, info in files:
+        
+        live_info = None
+        action = 'create'
         
         if wf_name in portal_workflow.objectIds():
-            logger.info('Updating existing workflow definition %s.' % wf_name)
+            action = 'update'
             wf = portal_workflow[wf_name]
+            wfdc = CSVWorkflowDefinitionConfigurator(wf)
+            live_info = wfdc.getWorkflowInfo(wf.getId())
         else:
-            logger.info('Creating workflow definition %s using standard workflows.' % wf_name)
             wf_name = info['id']
-            meta_type = info.get('meta_type', 'Workflow')
-            for mt_info in Products.meta_types:
-                if mt_info['name'] == meta_type:
-                    portal_workflow._setObject(wf_name, mt_info['instance'](wf_name))
-                    break
-            
-            wf = portal_workflow[wf_name]
         
-        importer = queryMultiAdapter((wf, context), IBody, name=u'collective.wtf')
-        importer.filename = filename # for error reporting
-        importer.body = info
+        diff = diffWorkflowInfo(live_info, info)
+        
+        affected = {}
+        if live_info is not None:
+            affected = countAffected(census, wf_name, diff['permissions_changed'])
+        
+        plan.append({'filename': filename,
+                     'workflow': wf_name,
+                     'action': action,
+                     'diff': diff,
+                     'affected': affected,
+                    })
+    
+    return plan
+
+# Fingerprints of live workflows, keyed by physical path. Values are
+# (serial, fingerprint), see collective.wtf.serial.modificationSerial().
+_live_fingerprints = {}
+
+def getLiveFingerprint(workflow):
+    """Return the fingerprint of the live workflow. This is cached until
+    the workflow is modified.
+    """
+    path = workflow.getPhysicalPath()
+    serial = modificationSerial(workflow)
+
+    if serial is not None:
+        entry = _live_fingerprints.get(path, None)
+        if entry is not None and entry[0] == serial:
+            return entry[1]
+
+    wfdc = CSVWorkflowDefinitionConfigurator(workflow)
+    fingerprint = fingerprintInfo(wfdc.getWorkflowInfo(workflow.getId()))
+
+    if serial is not None:
+        _live_fingerprints[path] = (serial, fingerprint,)
+    return fingerprint
+
+# Exported CSV bodies, keyed by workflow path. Values are (serial,
+# fingerprint, body), see collective.wtf.serial.modificationSerial().
+_export_cache = {}
+_export_cache_size = 100
+
+MANIFEST = os.path.join("workflow_csv", "manifest.txt")
+
+def exportWorkflowBody(wf, context):
+    """Return a tuple (fingerprint, body) for the given workflow, where
+    body is its CSV export (or None if it cannot be exported). The body is
+    cached, and the workflow is only serialized again once it has been
+    modified.
+    """
+    path = wf.getPhysicalPath()
+    serial = modificationSerial(wf)
+    
+    entry = _export_cache.get(path, None)
+    if serial is not None and entry is not None and entry[0] == serial:
+        return entry[1], entry[2]
+    
+    wfdc = CSVWorkflowDefinitionConfigurator(wf)
+    info = wfdc.getWorkflowInfo(wf.getId(), frozen=True)
+    fingerprint = fingerprintInfo(info)
+    
+    body = None
+    exporter = queryMultiAdapter((wf, context), IBody, name=u'collective.wtf')
+    if exporter is not None:
+        exporter.info = info
+        body = exporter.body
+    
+    if serial is not None:
+        if len(_export_cache) >= _export_cache_size:
+            _export_cache.clear()
+        _export_cache[path] = (serial, fingerprint, body,)
+    return fingerprint, body
+
+def readManifest(text):
+    """Parse a manifest written by exportCSVWorkflow into a dict of
+    workflow id -> (fingerprint, md5 digest of the CSV file, size)
+    """
+    manifest = {}
+    for line in (text or '').splitlines():
+        parts = line.split()
+        if len(parts) == 4 and not line.startswith('#'):
+            manifest[parts[0]] = (parts[1], parts[2], int(parts[3]),)
+    return manifest
 
 def exportCSVWorkflow(context):
     """Export portlet managers and portlets
+    
+    Workflows that have not been modified since the last export are not
+    serialized again. A manifest listing the id, fingerprint (see
+    collective.wtf.compare.fingerprintInfo), MD5 digest and size of each
+    file is written to workflow_csv/manifest.txt.
     """
     site = context.getSite()
     portal_workflow = getattr(site, 'portal_workflow', None)
@@ -255,10 +592,58 @@ def exportCSVWorkflow(context):
     if portal_workflow is None:
         return
     
+    _writeCSVWorkflows(portal_workflow, context)
+
+def exportCSVWorkflowToDirectory(site, profile_path):
+    """Export the workflows of the given site as CSV files into the
+    workflow_csv directory of the profile at profile_path, like the
+    workflow-csv export step. Files whose contents would not change, going
+    by the manifest of the previous export, are not written again.
+    Returns the ids of the workflows whose files were written.
+    """
+    portal_workflow = getToolByName(site, 'portal_workflow')
+    context = DirectoryExportContext(getToolByName(site, 'portal_setup'), profile_path)
+    
+    previous = {}
+    manifest_path = os.path.join(profile_path, MANIFEST)
+    if os.path.exists(manifest_path):
+        manifest_file = open(manifest_path, 'rb')
+        try:
+            previous = readManifest(manifest_file.read())
+        finally:
+            manifest_file.close()
+    
+    def unchanged(filename, workflow_id, digest, size):
+        return previous.get(workflow_id, (None, None, None,))[1:] == (digest, size,) and \
+                os.path.exists(os.path.join(profile_path, filename))
+    
+    return _writeCSVWorkflows(portal_workflow, context, unchanged)
+
+def _writeCSVWorkflows(portal_workflow, context, unchanged=None):
+    """Write the CSV files of all workflows that can be exported, and the
+    manifest, to the given export context, except for those for which
+    unchanged(filename, workflow id, digest, size) returns true. Returns
+    the ids of the workflows whose files were written.
+    """
+    manifest = []
+    written = []
     for wf in portal_workflow.objectValues():
-        exporter = queryMultiAdapter((wf, context), IBody, name=u'collective.wtf')
+        fingerprint, body = exportWorkflowBody(wf, context)
+        if body is None:
+            continue
         
         filename = os.path.join("workflow_csv", "%s.csv" % wf.getId())
-        body = exporter.body
-        if body is not None:
-            context.writeDataFile(filename, body, 'text/csv')
\ No newline at end of file
+        digest = md5(body).hexdigest()
+        manifest.append("%s %s %s %d" % (wf.getId(), fingerprint, digest, len(body),))
+        
+        if unchanged is not None and unchanged(filename, wf.getId(), digest, len(body)):
+            continue
+        
+        context.writeDataFile(filename, body, 'text/csv')
+        written.append(wf.getId())
+    
+    if manifest:
+        manifest.insert(0, "# id fingerprint md5 size")
+        context.writeDataFile(MANIFEST, '\n'.join(manifest) + '\n', 'text/plain')
+    
+    return written
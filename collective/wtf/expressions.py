@@ -0,0 +1,58 @@
+import logging
+logger = logging.getLogger('collective.wtf')
+
+try:
+    from Products.PageTemplates.Expressions import getEngine
+except ImportError: # pure parsing, e.g. in unit tests
+    getEngine = None
+    logger.warning("Products.PageTemplates is not available: TALES expressions "
+                   "in workflow CSV files will not be checked or compiled")
+
+# Compiled TALES expressions, keyed by expression text. Compiled
+# expressions are not modified when they are evaluated, so they can be
+# shared between all workflows, threads and ZODB connections.
+_compiled = {}
+
+def compileExpression(text):
+    """Compile the given TALES expression, or return the shared compiled
+    expression if the same text has been compiled before. Returns None if
+    the text is empty or no expression engine is available. Compilation
+    errors are raised as-is.
+    """
+    text = text.strip()
+    if not text or getEngine is None:
+        return None
+    compiled = _compiled.get(text, None)
+    if compiled is None:
+        compiled = _compiled[text] = getEngine().compile(text)
+    return compiled
+
+def primeGuard(guard):
+    """Make sure the expression of the given guard does not need to be
+    compiled again when the guard is checked.
+
+    CMF's Expression objects keep their compiled form in a volatile
+    attribute, which is lost whenever the object is removed from the ZODB
+    cache. Setting it from the shared cache avoids recompiling each time.
+    """
+    if guard is None:
+        return
+    expr = guard.expr
+    if expr is not None and expr._v_compiled is None and expr.text.strip():
+        expr._v_compiled = compileExpression(expr.text)
+
+def primeTransitionGuards(workflow, sdef):
+    """Prime the guards of all transitions out of the given state
+    """
+    for tid in sdef.transitions:
+        tdef = workflow.transitions.get(tid, None)
+        if tdef is not None:
+            primeGuard(tdef.guard)
+
+def primeWorkflowGuards(workflow):
+    """Prime the guards of all transitions and worklists in a workflow
+    """
+    for tdef in workflow.transitions.objectValues():
+        primeGuard(tdef.guard)
+    for qdef in workflow.worklists.objectValues():
+        primeGuard(qdef.guard)
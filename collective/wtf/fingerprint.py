@@ -0,0 +1,76 @@
+try:
+    from zope.site.hooks import getSite, setSite
+except ImportError: # Zope < 2.12
+    from zope.app.component.hooks import getSite, setSite
+
+from collective.wtf.compare import diffWorkflowInfo
+from collective.wtf.compare import fingerprintInfo
+from collective.wtf.exportimport import CSVWorkflowDefinitionConfigurator
+from collective.wtf.exportimport import getLiveFingerprint
+from collective.wtf.exportimport import _iterCSVWorkflows
+
+def checkDrift(context):
+    """Compare the CSV workflow definitions in the given import context to
+    the live workflows of its site.
+
+    Returns a list of dicts, one per CSV file, with keys 'workflow',
+    'filename', 'status' ('ok', 'changed' or 'missing'), 'expected' and
+    'live' (the fingerprints, 'live' being None for missing workflows).
+    """
+    site = context.getSite()
+    logger = context.getLogger('workflow-csv')
+    portal_workflow = getattr(site, 'portal_workflow', None)
+    if portal_workflow is None:
+        return []
+
+    result = []
+    for filename, wf_name, info in _iterCSVWorkflows(context, logger):
+        expected = fingerprintInfo(info)
+        live = None
+        status = 'missing'
+        if wf_name in portal_workflow.objectIds():
+            live = getLiveFingerprint(portal_workflow[wf_name])
+            status = live == expected and 'ok' or 'changed'
+        result.append({'workflow': wf_name,
+                       'filename': filename,
+                       'status': status,
+                       'expected': expected,
+                       'live': live,
+                       })
+    return result
+
+def checkDriftInSites(sites, profile_id):
+    """Run checkDrift() for the given profile in each of the given sites.
+    Returns a list of (site path, result) tuples.
+    """
+    result = []
+    old_site = getSite()
+    try:
+        for site in sites:
+            setSite(site)
+            import_context = site.portal_setup._getImportContext(profile_id)
+            result.append(('/'.join(site.getPhysicalPath()), checkDrift(import_context),))
+    finally:
+        setSite(old_site)
+    return result
+
+def diffDrift(context, workflow_id):
+    """Return a structural diff (see collective.wtf.compare) between the
+    live workflow with the given id and its CSV definition in the given
+    import context, or None if the profile does not define it.
+    """
+    site = context.getSite()
+    logger = context.getLogger('workflow-csv')
+    portal_workflow = getattr(site, 'portal_workflow', None)
+
+    for filename, wf_name, info in _iterCSVWorkflows(context, logger):
+        if wf_name != workflow_id:
+            continue
+        live_info = None
+        if portal_workflow is not None and wf_name in portal_workflow.objectIds():
+            wf = portal_workflow[wf_name]
+            wfdc = CSVWorkflowDefinitionConfigurator(wf)
+            live_info = wfdc.getWorkflowInfo(wf.getId(), frozen=True)
+        return diffWorkflowInfo(live_info, info)
+
+    return None
@@ -0,0 +1,78 @@
+from weakref import WeakValueDictionary
+
+class FrozenDict(dict):
+    """An immutable, hashable dict. Copying it returns the same object.
+    """
+
+    __slots__ = ('_hash', '__weakref__',)
+
+    def __hash__(self):
+        try:
+            return self._hash
+        except AttributeError:
+            self._hash = hash(frozenset(self.iteritems()))
+            return self._hash
+
+    def _immutable(self, *args, **kw):
+        raise TypeError("%s is immutable" % self.__class__.__name__)
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _immutable
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (self.__class__, (dict(self),),)
+
+# Frozen dicts handed out so far. Structurally equal dicts are only kept
+# once, for as long as anyone refers to them.
+_pool = WeakValueDictionary()
+
+def freezeInfo(value):
+    """Return an immutable version of the given info dict (or of any value
+    in it), in which
+
+      - dicts are FrozenDicts, and equal dicts are the same object, so
+        e.g. identical permission tables, states, or whole workflows
+        across sites are only held in memory once;
+
+      - lists are tuples;
+
+      - byte strings, such as role and permission names, are interned.
+
+    Code that only reads info dicts can use the result as-is.
+    """
+    if isinstance(value, FrozenDict):
+        return value
+    elif isinstance(value, dict):
+        frozen = FrozenDict([(freezeInfo(k), freezeInfo(v),) for k, v in value.iteritems()])
+        try:
+            # keyed by content, so that the key does not keep the value alive
+            key = frozenset(frozen.iteritems())
+        except TypeError: # contains something unhashable
+            return frozen
+        shared = _pool.get(key, None)
+        if shared is not None:
+            return shared
+        _pool[key] = frozen
+        return frozen
+    elif isinstance(value, (list, tuple,)):
+        return tuple([freezeInfo(v) for v in value])
+    elif type(value) is str:
+        return intern(value)
+    return value
+
+def thawInfo(value):
+    """Return a modifiable copy of a (possibly frozen) info dict, or of any
+    value in it. Tuples stay tuples, but dicts inside them are thawed too.
+    """
+    if isinstance(value, dict):
+        return dict([(k, thawInfo(v),) for k, v in value.iteritems()])
+    elif isinstance(value, tuple):
+        return tuple([thawInfo(v) for v in value])
+    elif isinstance(value, list):
+        return [thawInfo(v) for v in value]
+    return value
@@ -0,0 +1,376 @@
+import os
+import csv
+import time
+import logging
+
+from cPickle import dumps
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+import transaction
+
+from Acquisition import aq_base
+from DateTime import DateTime
+
+from Products.CMFCore.utils import getToolByName
+
+from collective.wtf.interfaces import ICSVImportedWorkflow
+from collective.wtf.census import getTypesByWorkflow
+from collective.wtf.importjob import SiteJob
+from collective.wtf.jobs import startJob
+
+logger = logging.getLogger('collective.wtf')
+
+def _size(entries):
+    return len(dumps(tuple(entries), 1))
+
+def compactHistory(ob, keep=None, max_age=None, strip=False, wtool=None):
+    """Trim the workflow_history of ob according to a retention policy:
+
+      keep -- if given, the number of most recent entries to keep per
+        workflow. The last entry, which holds the current status, is
+        always kept.
+
+      max_age -- if given, only entries older than this many days are
+        removed. Entries without a 'time' are then kept.
+
+    Without keep or max_age, no entries are removed.
+
+      strip -- if true, also remove the variables that the workflow no
+        longer records in its history (see the [Variables] section of the
+        CSV format) from the entries that are kept.
+
+    Returns a tuple (removed, bytes_saved), where removed is a dict of
+    workflow id -> list of removed entries, and bytes_saved an estimate of
+    the reduction of the pickled size of the history.
+    """
+    history = getattr(aq_base(ob), 'workflow_history', None)
+    if not history:
+        return {}, 0
+
+    if wtool is None and strip:
+        wtool = getToolByName(ob, 'portal_workflow')
+
+    prune = keep is not None or max_age is not None
+    keep = max(keep or 1, 1)
+    cutoff = None
+    if max_age is not None:
+        cutoff = DateTime() - max_age
+
+    removed = {}
+    saved = 0
+    for workflow_id, entries in history.items():
+        entries = tuple(entries)
+        kept = []
+        dropped = []
+        for index, entry in enumerate(entries):
+            recent = index >= len(entries) - keep
+            when = entry.get('time', None)
+            young = cutoff is not None and (not isinstance(when, DateTime) or when >= cutoff)
+            if not prune or recent or young:
+                kept.append(entry)
+            else:
+                dropped.append(entry)
+
+        if strip:
+            workflow = wtool.getWorkflowById(workflow_id)
+            if workflow is not None:
+                allowed = set([v.getId() for v in workflow.variables.objectValues() if v.for_status])
+                allowed.add(workflow.state_var)
+                stripped = []
+                for entry in kept:
+                    if [k for k in entry.keys() if k not in allowed]:
+                        entry = dict([(k, v,) for k, v in entry.items() if k in allowed])
+                    stripped.append(entry)
+                kept = stripped
+
+        if dropped or kept != list(entries):
+            saved += _size(entries) - _size(kept)
+            history[workflow_id] = tuple(kept)
+            if dropped:
+                removed[workflow_id] = dropped
+
+    return removed, saved
+
+def _jsonable(value):
+    if isinstance(value, DateTime):
+        return value.ISO8601()
+    if isinstance(value, (basestring, int, long, float, bool,)) or value is None:
+        return value
+    if isinstance(value, (list, tuple,)):
+        return [_jsonable(v) for v in value]
+    if isinstance(value, dict):
+        return dict([(k, _jsonable(v),) for k, v in value.items()])
+    return str(value)
+
+class HistoryArchive(object):
+    """Appends removed history entries to a file, as one JSON object per
+    line with the keys 'path', 'workflow' and 'entry'. The entries removed
+    in a transaction are written, and synced to disk, just before it
+    commits, so that none are lost once it has. If the transaction fails or
+    is aborted after that, they are removed from the file again.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._transaction = None
+        self._records = None
+
+    def add(self, path, workflow_id, entries):
+        txn = transaction.get()
+        if self._transaction is not txn:
+            self._transaction = txn
+            self._records = []
+            txn.addBeforeCommitHook(self._write, (txn, self._records,))
+        self._records.extend([json.dumps({'path': path, 'workflow': workflow_id, 'entry': _jsonable(entry)})
+                                for entry in entries])
+
+    def _write(self, txn, records):
+        if not records:
+            return
+        out = open(self.filename, 'ab')
+        try:
+            out.seek(0, 2)
+            txn.join(_ArchiveTruncation(self.filename, out.tell()))
+            for record in records:
+                print >> out, record
+            out.flush()
+            os.fsync(out.fileno())
+        finally:
+            out.close()
+
+class _ArchiveTruncation(object):
+    """A data manager that truncates the archive file back to the given
+    size if the transaction it joined is aborted or fails to commit.
+    """
+
+    transaction_manager = transaction.manager
+
+    def __init__(self, filename, size):
+        self.filename = filename
+        self.size = size
+
+    def truncate(self, txn=None):
+        out = open(self.filename, 'r+b')
+        try:
+            out.truncate(self.size)
+        finally:
+            out.close()
+
+    abort = tpc_abort = truncate
+
+    def tpc_begin(self, txn):
+        pass
+
+    def commit(self, txn):
+        pass
+
+    def tpc_vote(self, txn):
+        pass
+
+    def tpc_finish(self, txn):
+        pass
+
+    def sortKey(self):
+        return 'collective.wtf.history:%s' % self.filename
+
+class HistoryCompactionJob(SiteJob):
+    """A job (see collective.wtf.jobs) to compact the workflow history of
+    the objects at the given paths with compactHistory(), a chunk of
+    objects per transaction. If archive_filename is given, removed entries
+    are appended to that file (see HistoryArchive).
+    """
+
+    def __init__(self, site_path, paths, chunk_size=500, archive_filename=None, **policy):
+        SiteJob.__init__(self, site_path)
+        self.paths = paths
+        self.chunk_size = chunk_size
+        self.policy = policy
+        self.archive = archive_filename and HistoryArchive(archive_filename) or None
+
+    def steps(self):
+        steps = []
+        for start in range(0, len(self.paths), self.chunk_size):
+            chunk = self.paths[start:start + self.chunk_size]
+            steps.append(("objects %d-%d" % (start + 1, start + len(chunk),), self.chunkStep(chunk),))
+        return steps
+
+    def chunkStep(self, paths):
+        def step(connection):
+            site = self.getSite(connection)
+            counts = {'objects': 0, 'compacted': 0, 'entries_removed': 0, 'bytes_saved': 0}
+            try:
+                wtool = getToolByName(site, 'portal_workflow')
+                for path in paths:
+                    ob = site.unrestrictedTraverse(path, None)
+                    if ob is None:
+                        continue
+                    counts['objects'] += 1
+                    removed, saved = compactHistory(ob, wtool=wtool, **self.policy)
+                    if not saved:
+                        ob._p_deactivate()
+                        continue
+                    counts['compacted'] += 1
+                    counts['bytes_saved'] += saved
+                    for workflow_id, entries in removed.items():
+                        counts['entries_removed'] += len(entries)
+                        if self.archive is not None:
+                            self.archive.add(path, workflow_id, entries)
+                return counts
+            finally:
+                self.cleanUp()
+        return step
+
+def startHistoryCompaction(site, query=None, chunk_size=500, archive_filename=None,
+                           job_id=None, **policy):
+    """Start compacting the workflow history of the catalogued objects in
+    the site matching the given catalog query (or all of them) in a worker
+    thread. policy holds the keyword arguments of compactHistory(). Returns
+    the job id, which can be passed to collective.wtf.jobs.getJobStatus().
+
+    Pass the id of a failed job to resume it. The objects to process are
+    looked up again, so the query should not depend on the history.
+    """
+    site_path = '/'.join(site.getPhysicalPath())
+    if job_id is None:
+        job_id = '%s history %s' % (site_path, time.strftime('%Y-%m-%d %H:%M:%S'),)
+    catalog = getToolByName(site, 'portal_catalog')
+    paths = sorted([b.getPath() for b in catalog.unrestrictedSearchResults(**(query or {}))])
+    job = HistoryCompactionJob(site_path, paths, chunk_size, archive_filename, **policy)
+    startJob(site._p_jar.db(), job_id, job.steps())
+    logger.info("Started job %s for %d objects" % (job_id, len(paths),))
+    return job_id
+
+def iterHistory(context, query=None, workflow_ids=None, start=None, end=None,
+                actions=None, chunk_size=500):
+    """Generate a dict for each workflow_history entry of the catalogued
+    objects matching the given catalog query, with the keys 'path',
+    'portal_type', 'workflow', 'state' (the value of the workflow's state
+    variable) and 'entry' (the history entry itself).
+
+      workflow_ids -- the workflows whose history to read. Defaults to the
+        workflows imported from CSV. Unless the query gives a portal_type,
+        only the types using these workflows are searched.
+
+      start, end -- if given, only entries with a 'time' at or after start
+        and before end (DateTimes) are included. Objects created after end
+        are not loaded at all.
+
+      actions -- if given, only entries of these transitions are included.
+
+    Objects are loaded chunk_size at a time. At the end of each chunk,
+    they and their histories are deactivated again, and the ZODB cache is
+    garbage collected, so that memory use does not grow with the number of
+    objects.
+    """
+    wtool = getToolByName(context, 'portal_workflow')
+    catalog = getToolByName(context, 'portal_catalog')
+
+    if workflow_ids is None:
+        workflow_ids = [wf.getId() for wf in wtool.objectValues()
+                            if ICSVImportedWorkflow.providedBy(wf)]
+    state_variables = {}
+    for workflow_id in workflow_ids:
+        workflow = wtool.getWorkflowById(workflow_id)
+        if workflow is not None:
+            state_variables[workflow_id] = getattr(workflow, 'state_var', 'review_state')
+    if not state_variables:
+        return
+
+    query = dict(query or {})
+    if 'portal_type' not in query:
+        portal_types = set()
+        types_by_workflow = getTypesByWorkflow(context)
+        for workflow_id in state_variables.keys():
+            portal_types.update(types_by_workflow.get(workflow_id, ()))
+        if not portal_types:
+            return
+        query['portal_type'] = sorted(portal_types)
+    if end is not None and 'created' not in query and 'created' in catalog.indexes():
+        query['created'] = {'query': end, 'range': 'max'}
+
+    if actions is not None:
+        actions = set(actions)
+
+    jar = getattr(aq_base(context), '_p_jar', None)
+    results = catalog.unrestrictedSearchResults(**query)
+    for offset in range(0, len(results), chunk_size):
+        woken = []
+        for brain in results[offset:offset + chunk_size]:
+            ob = brain._unrestrictedGetObject()
+            base = aq_base(ob)
+            woken.append(base)
+            history = getattr(base, 'workflow_history', None)
+            if not history:
+                continue
+            woken.append(history)
+            path = brain.getPath()
+            for workflow_id in sorted(history.keys()):
+                state_variable = state_variables.get(workflow_id, None)
+                if state_variable is None:
+                    continue
+                for entry in history[workflow_id]:
+                    if actions is not None and entry.get('action', None) not in actions:
+                        continue
+                    if start is not None or end is not None:
+                        when = entry.get('time', None)
+                        if not isinstance(when, DateTime):
+                            continue
+                        if (start is not None and when < start) or (end is not None and when >= end):
+                            continue
+                    yield {'path': path,
+                           'portal_type': brain.portal_type,
+                           'workflow': workflow_id,
+                           'state': entry.get(state_variable, None),
+                           'entry': entry}
+
+        for ob in woken:
+            if getattr(ob, '_p_changed', True) is False:
+                ob._p_deactivate()
+        if jar is not None:
+            jar.cacheGC()
+
+# Columns of the CSV history export
+HISTORY_COLUMNS = ('path', 'portal_type', 'workflow', 'time', 'action', 'state', 'actor', 'comments',)
+
+def _cell(value):
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(_jsonable(value))
+
+def writeHistoryCSV(records, out):
+    """Write the records generated by iterHistory() to the file-like out as
+    CSV, with the columns in HISTORY_COLUMNS. Returns the number of
+    records written.
+    """
+    writer = csv.writer(out)
+    writer.writerow(HISTORY_COLUMNS)
+    count = 0
+    for record in records:
+        entry = record['entry']
+        writer.writerow([_cell(record['path']), _cell(record['portal_type']),
+                         _cell(record['workflow']), _cell(entry.get('time', None)),
+                         _cell(entry.get('action', None)), _cell(record['state']),
+                         _cell(entry.get('actor', None)), _cell(entry.get('comments', None))])
+        count += 1
+    return count
+
+def writeHistoryJSON(records, out):
+    """Write the records generated by iterHistory() to the file-like out as
+    a JSON list, one record at a time. Returns the number of records
+    written.
+    """
+    out.write('[')
+    separator = '\n'
+    count = 0
+    for record in records:
+        out.write(separator + json.dumps(_jsonable(record)))
+        separator = ',\n'
+        count += 1
+    out.write('\n]\n')
+    return count
@@ -0,0 +1,128 @@
+import time
+import logging
+
+from Testing.makerequest import makerequest
+from AccessControl.SecurityManagement import newSecurityManager
+from AccessControl.SecurityManagement import noSecurityManager
+from AccessControl.SpecialUsers import system
+
+try:
+    from zope.site.hooks import setSite
+except ImportError: # Zope < 2.12
+    from zope.app.component.hooks import setSite
+
+from Products.CMFCore.utils import getToolByName
+
+from collective.wtf.exportimport import _iterCSVWorkflows
+from collective.wtf.exportimport import importOneCSVWorkflow
+from collective.wtf.locking import lockWorkflowTool
+from collective.wtf.rolemap import updateRoleMappings
+from collective.wtf.utils import clear_chain_cache
+from collective.wtf.jobs import startJob
+
+logger = logging.getLogger('collective.wtf')
+
+class SiteJob(object):
+    """Base class for jobs whose steps work on a site. getSite() sets up
+    the request, security and local site for the step's connection, and
+    cleanUp() tears them down again.
+    """
+
+    def __init__(self, site_path):
+        self.site_path = site_path
+
+    def getSite(self, connection):
+        app = makerequest(connection.root()['Application'])
+        newSecurityManager(None, system)
+        site = app.unrestrictedTraverse(self.site_path)
+        setSite(site)
+        return site
+
+    def cleanUp(self):
+        setSite(None)
+        noSecurityManager()
+
+class CSVImportJob(SiteJob):
+    """The steps of an asynchronous import of the CSV workflows of a
+    profile into a site: for each workflow, one step to import it and one
+    to update the role mappings of the objects using it. Each step runs in
+    a transaction of its own (see collective.wtf.jobs.JobRunner).
+
+    Role mappings are only updated for workflows that were actually
+    changed, unless the job is resumed in another process, in which case
+    they are all updated.
+    """
+
+    def __init__(self, site_path, profile_id, workflow_ids):
+        if not profile_id.startswith('profile-') and not profile_id.startswith('snapshot-'):
+            profile_id = 'profile-%s' % profile_id
+        SiteJob.__init__(self, site_path)
+        self.profile_id = profile_id
+        self.workflow_ids = workflow_ids
+        self.changed = None
+
+    def steps(self):
+        steps = []
+        for wf_name in self.workflow_ids:
+            steps.append(("import %s" % wf_name, self.importStep(wf_name),))
+            steps.append(("role mappings %s" % wf_name, self.roleMappingStep(wf_name),))
+        return steps
+
+    def importStep(self, wf_name):
+        def step(connection):
+            site = self.getSite(connection)
+            try:
+                import_context = site.portal_setup._getImportContext(self.profile_id)
+                step_logger = import_context.getLogger('workflow-csv')
+                portal_workflow = getToolByName(site, 'portal_workflow')
+                lockWorkflowTool(portal_workflow)
+                for filename, name, info in _iterCSVWorkflows(import_context, step_logger):
+                    if name != wf_name:
+                        continue
+                    if self.changed is None:
+                        self.changed = set()
+                    if importOneCSVWorkflow(import_context, portal_workflow, filename, name, info, step_logger):
+                        self.changed.add(wf_name)
+                        clear_chain_cache()
+                        return {'imported': 1}
+                    return {'skipped': 1}
+                return {'missing': 1}
+            finally:
+                self.cleanUp()
+        return step
+
+    def roleMappingStep(self, wf_name):
+        def step(connection):
+            if self.changed is not None and wf_name not in self.changed:
+                return {}
+            site = self.getSite(connection)
+            try:
+                checked, changed = updateRoleMappings(site, [wf_name])
+                return {'checked': checked, 'updated': changed}
+            finally:
+                self.cleanUp()
+        return step
+
+def listCSVWorkflows(site, profile_id):
+    """Return the ids of the CSV workflows the import step would import
+    from the given profile into the given site.
+    """
+    if not profile_id.startswith('profile-') and not profile_id.startswith('snapshot-'):
+        profile_id = 'profile-%s' % profile_id
+    import_context = site.portal_setup._getImportContext(profile_id)
+    return [wf_name for filename, wf_name, info in
+                _iterCSVWorkflows(import_context, import_context.getLogger('workflow-csv'))]
+
+def startCSVImport(site, profile_id, job_id=None):
+    """Start importing the CSV workflows of the given profile into the given
+    site in a worker thread. Returns the job id, which can be passed to
+    collective.wtf.jobs.getJobStatus(). Pass the id of a failed job to
+    resume it.
+    """
+    site_path = '/'.join(site.getPhysicalPath())
+    if job_id is None:
+        job_id = '%s %s %s' % (site_path, profile_id, time.strftime('%Y-%m-%d %H:%M:%S'),)
+    job = CSVImportJob(site_path, profile_id, listCSVWorkflows(site, profile_id))
+    startJob(site._p_jar.db(), job_id, job.steps())
+    logger.info("Started job %s" % job_id)
+    return job_id
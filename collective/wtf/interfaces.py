@@ -1,7 +1,44 @@
 from zope.interface import Interface, Attribute
 
 class ParsingError(Exception):
-    """Raised when a CSV file cannot be parsed.
+    """Raised when a CSV file cannot be parsed. filename, line and column
+    (both counting from 1) give the position of the problem, where known.
+    """
+    
+    def __init__(self, message='', filename=None, line=None, column=None):
+        Exception.__init__(self, message)
+        self.message = message
+        self.filename = filename
+        self.line = line
+        self.column = column
+    
+    def __str__(self):
+        position = []
+        if self.filename:
+            position.append(self.filename)
+        if self.line:
+            position.append("line %d" % self.line)
+        if self.column:
+            position.append("column %d" % self.column)
+        if position:
+            return "%s: %s" % (', '.join(position), self.message,)
+        return str(self.message)
+
+class ParsingErrors(ParsingError):
+    """Raised when parsing a CSV file in collecting mode found one or more
+    problems. errors is the list of ParsingErrors, in file order.
+    """
+    
+    def __init__(self, errors, filename=None):
+        ParsingError.__init__(self, "%d problem(s) found" % len(errors))
+        self.filename = filename
+        self.errors = errors
+    
+    def __str__(self):
+        return '\n'.join([self.message] + ["  %s" % e for e in self.errors])
+
+class ImportLockTimeout(Exception):
+    """Raised when the workflow import lock could not be acquired in time.
     """
 
 class ICSVWorkflowSerializer(Interface):
@@ -16,9 +53,11 @@ class ICSVWorkflowDeserializer(Interface):
     """Import workflow from CSV
     """
     
-    def __call__(input_stream, config_variant=u""):
+    def __call__(input_stream, config_variant=u"", filename=None, collect=False):
         """Read CSV from the given input stream and return a workflow
-        info dict.
+        info dict. filename is used in error messages. If collect is
+        true, parsing continues past errors, and a ParsingErrors listing
+        all of them is raised at the end.
         """
 
 class ICSVWorkflowConfig(Interface):
@@ -36,6 +75,11 @@ class ICSVWorkflowConfig(Interface):
     transition_template = Attribute("A template a transition dict inside info['transition_info']")
     worklist_template = Attribute("A template a worklist dict inside info['workflist_info']")
     
+class ICSVImportedWorkflow(Interface):
+    """Marker interface for workflow definitions that were (last) imported
+    from a CSV file.
+    """
+
 class ISanityChecker(Interface):
     """Get a list of messages describing any problems with a particular
     workflow. Adapts a workflow definition.
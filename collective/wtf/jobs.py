@@ -0,0 +1,165 @@
+import time
+import logging
+import threading
+import traceback
+
+import transaction
+from ZODB.POSException import ConflictError
+from BTrees.OOBTree import OOBTree
+
+logger = logging.getLogger('collective.wtf')
+
+# Name of the BTree in the ZODB root holding job progress records
+ROOT_KEY = 'collective.wtf.jobs'
+
+class JobRunner(object):
+    """Run a job made up of a list of (name, callable) steps, in its own
+    ZODB connection, committing after each step.
+
+    Each step is called with the connection, and may return a dict of
+    counts, which are added up in the job's progress record. The progress
+    record is a plain dict stored under the job id in a BTree in the ZODB
+    root, with the keys:
+
+      'id', 'status' ('running', 'done' or 'failed'), 'phase' (the name of
+      the current step), 'steps' (the names of all steps), 'done' (the
+      number of steps completed), 'counts', 'timings' (a list of (step
+      name, seconds) tuples), 'started', 'finished' and 'error'.
+
+    The record is updated in the same transaction as the work of each step,
+    so that it never claims more than has been committed. A step that
+    raises a ConflictError is retried up to 'retries' times. If a step
+    fails, the job stops, and can be resumed from that step by running it
+    again with the same id. Recording the failure is retried as often; if
+    that keeps conflicting, the stored record still says 'running', and
+    only the returned one and the log say 'failed'.
+
+    The connection uses the thread's default transaction manager, so the
+    runner should normally be used in a thread of its own (see startJob).
+    """
+
+    retries = 3
+
+    def __init__(self, db, job_id, steps):
+        self.db = db
+        self.job_id = job_id
+        self.steps = steps
+
+    def run(self):
+        connection = self.db.open()
+        try:
+            return self._run(connection)
+        finally:
+            transaction.abort()
+            connection.close()
+
+    def _run(self, connection):
+        transaction.begin()
+        progress = getJobStatus(connection.root(), self.job_id)
+        if progress is None or progress['status'] == 'done':
+            progress = {'id': self.job_id,
+                        'done': 0,
+                        'counts': {},
+                        'timings': [],
+                        'started': time.time(),
+                        }
+        progress.update({'status': 'running',
+                         'steps': [name for name, step in self.steps],
+                         'error': None,
+                         'finished': None,
+                         })
+
+        for index in range(progress['done'], len(self.steps)):
+            name, step = self.steps[index]
+            progress['phase'] = name
+            self._save(connection, progress)
+
+            started = time.time()
+            attempt = 0
+            while True:
+                try:
+                    counts = step(connection) or {}
+                    progress['done'] = index + 1
+                    progress['timings'] = progress['timings'] + [(name, time.time() - started,)]
+                    for key, value in counts.items():
+                        progress['counts'][key] = progress['counts'].get(key, 0) + value
+                    self._save(connection, progress)
+                    break
+                except ConflictError:
+                    transaction.abort()
+                    attempt += 1
+                    if attempt > self.retries:
+                        return self._fail(connection, progress, name)
+                    progress['counts']['conflicts'] = progress['counts'].get('conflicts', 0) + 1
+                    logger.info("Job %s: conflict in step %s, retrying" % (self.job_id, name,))
+                except Exception:
+                    transaction.abort()
+                    return self._fail(connection, progress, name)
+
+            logger.info("Job %s: %s done in %.2fs (%d/%d)" % (self.job_id, name, time.time() - started,
+                                                               index + 1, len(self.steps),))
+
+        progress['status'] = 'done'
+        progress['phase'] = None
+        progress['finished'] = time.time()
+        self._save(connection, progress)
+        return progress
+
+    def _fail(self, connection, progress, name):
+        progress['status'] = 'failed'
+        progress['error'] = "%s: %s" % (name, traceback.format_exc(),)
+        progress['finished'] = time.time()
+        logger.error("Job %s failed in step %s" % (self.job_id, name,))
+        # The step's work was rolled back, so keep the record of what was
+        # committed before it, but try hard to record the failure
+        attempt = 0
+        while True:
+            try:
+                self._save(connection, progress)
+                break
+            except ConflictError:
+                transaction.abort()
+                attempt += 1
+                if attempt > self.retries:
+                    logger.error("Job %s: could not record the failure, %d conflicts" % (self.job_id, attempt,))
+                    break
+        return progress
+
+    def _save(self, connection, progress):
+        root = connection.root()
+        jobs = root.get(ROOT_KEY, None)
+        if jobs is None:
+            jobs = root[ROOT_KEY] = OOBTree()
+        jobs[self.job_id] = dict(progress, counts=dict(progress['counts']))
+        transaction.commit()
+
+def getJobStatus(root, job_id):
+    """Return a copy of the progress record of the given job, or None,
+    reading from the given ZODB root.
+    """
+    jobs = root.get(ROOT_KEY, None)
+    if jobs is None:
+        return None
+    progress = jobs.get(job_id, None)
+    if progress is None:
+        return None
+    return dict(progress, counts=dict(progress['counts']))
+
+def listJobs(root):
+    """Return copies of all progress records, most recent first
+    """
+    jobs = root.get(ROOT_KEY, None)
+    if jobs is None:
+        return []
+    result = [getJobStatus(root, job_id) for job_id in jobs.keys()]
+    result.sort(key=lambda p: p.get('started') or 0, reverse=True)
+    return result
+
+def startJob(db, job_id, steps):
+    """Run a job in a new daemon thread, and return the thread
+    """
+    runner = JobRunner(db, job_id, steps)
+    thread = threading.Thread(target=runner.run, name='collective.wtf job %s' % job_id)
+    thread.setDaemon(True)
+    thread.start()
+    return thread
@@ -0,0 +1,187 @@
+import os
+import time
+import random
+import socket
+import threading
+
+import transaction
+from ZODB.POSException import ConflictError
+from BTrees.OOBTree import OOBTree
+
+from collective.wtf.interfaces import ImportLockTimeout
+
+# Name of the BTree in the ZODB root holding the locks
+ROOT_KEY = 'collective.wtf.locks'
+
+# Locks held by the current thread: key -> lock
+_held = threading.local()
+
+class ImportLock(object):
+    """A cluster-wide lock, stored in the ZODB so that all ZEO clients see
+    it.
+
+    The lock is written through a separate connection with its own
+    transaction manager, so acquiring and releasing it commits straight
+    away, independently of the transaction doing the actual work. A lock
+    that has not been released after 'timeout' seconds (e.g. because the
+    client holding it died) is considered stale and may be taken over.
+    acquire() waits up to 'wait' seconds for another holder to release it,
+    and then raises ImportLockTimeout.
+
+    The 'conflicts' attribute counts the ConflictErrors that occurred while
+    acquiring or releasing the lock, which are retried up to 'retries'
+    times before ImportLockTimeout is raised.
+    """
+
+    poll = 0.5
+    retries = 10
+
+    def __init__(self, db, key, timeout=600, wait=120):
+        self.db = db
+        self.key = key
+        self.timeout = timeout
+        self.wait = wait
+        self.token = '%s:%d:%d:%d' % (socket.gethostname(), os.getpid(),
+                                      threading.currentThread().ident or 0,
+                                      random.randint(0, 1 << 30),)
+        self.conflicts = 0
+        self.waited = 0.0
+
+    def acquire(self):
+        started = time.time()
+        while True:
+            if self._update(self._take):
+                self.waited = time.time() - started
+                return
+            if time.time() - started > self.wait:
+                self.waited = time.time() - started
+                raise ImportLockTimeout("Could not acquire the import lock for %s within %d seconds" %
+                                            (self.key, self.wait,))
+            time.sleep(self.poll)
+
+    def release(self):
+        self._update(self._drop)
+
+    def _take(self, locks):
+        now = time.time()
+        entry = locks.get(self.key, None)
+        if entry is not None and entry[0] != self.token and entry[1] > now:
+            return False
+        locks[self.key] = (self.token, now + self.timeout,)
+        return True
+
+    def _drop(self, locks):
+        entry = locks.get(self.key, None)
+        if entry is not None and entry[0] == self.token:
+            del locks[self.key]
+        return True
+
+    def _update(self, operation):
+        tm = transaction.TransactionManager()
+        connection = self.db.open(transaction_manager=tm)
+        attempts = 0
+        try:
+            while True:
+                tm.begin()
+                try:
+                    root = connection.root()
+                    locks = root.get(ROOT_KEY, None)
+                    if locks is None:
+                        locks = root[ROOT_KEY] = OOBTree()
+                    result = operation(locks)
+                    if result:
+                        tm.commit()
+                    else:
+                        tm.abort()
+                    return result
+                except ConflictError:
+                    tm.abort()
+                    self.conflicts += 1
+                    attempts += 1
+                    if attempts > self.retries:
+                        raise ImportLockTimeout("Could not update the import lock for %s: %d conflicts" %
+                                                    (self.key, attempts,))
+        finally:
+            connection.close()
+
+class _LockReleaser(object):
+    """A data manager that releases an import lock when the transaction
+    it has joined commits or aborts.
+    """
+
+    def __init__(self, lock):
+        self.lock = lock
+        self.transaction_manager = transaction.manager
+
+    def _release(self):
+        held = getattr(_held, 'locks', None) or {}
+        if held.get(self.lock.key, None) is self.lock:
+            del held[self.lock.key]
+            try:
+                self.lock.release()
+            except ImportLockTimeout:
+                # The transaction is over either way; the lock goes stale
+                # after its timeout
+                pass
+
+    def abort(self, txn):
+        self._release()
+
+    def tpc_begin(self, txn):
+        pass
+
+    def commit(self, txn):
+        pass
+
+    def tpc_vote(self, txn):
+        pass
+
+    def tpc_finish(self, txn):
+        self._release()
+
+    def tpc_abort(self, txn):
+        self._release()
+
+    def sortKey(self):
+        return '~collective.wtf.locking:%s' % self.lock.key
+
+    def savepoint(self):
+        return _NoopSavepoint()
+
+class _NoopSavepoint(object):
+
+    def rollback(self):
+        pass
+
+def lockForTransaction(db, key, **kw):
+    """Acquire the import lock for the given key (typically the path of
+    the workflow tool), unless the current thread already holds it, and
+    hold it until the current transaction commits or aborts. Keyword
+    arguments are passed to ImportLock. Returns the lock.
+    """
+    held = getattr(_held, 'locks', None)
+    if held is None:
+        held = _held.locks = {}
+    lock = held.get(key, None)
+    if lock is not None:
+        return lock
+    lock = ImportLock(db, key, **kw)
+    lock.acquire()
+    held[key] = lock
+    try:
+        transaction.get().join(_LockReleaser(lock))
+    except:
+        del held[key]
+        lock.release()
+        raise
+    return lock
+
+def lockWorkflowTool(portal_workflow, **kw):
+    """Take the import lock for the given workflow tool until the current
+    transaction ends, or do nothing and return None if the tool is not
+    stored in a database.
+    """
+    jar = getattr(portal_workflow, '_p_jar', None)
+    if jar is None:
+        return None
+    return lockForTransaction(jar.db(), '/'.join(portal_workflow.getPhysicalPath()), **kw)
@@ -0,0 +1,129 @@
+import sys
+import time
+import logging
+
+import transaction
+
+from Acquisition import aq_base
+from AccessControl.SecurityManagement import newSecurityManager
+from AccessControl.SecurityManagement import noSecurityManager
+from AccessControl.SpecialUsers import system
+
+try:
+    from zope.site.hooks import getSite, setSite
+except ImportError: # Zope < 2.12
+    from zope.app.component.hooks import getSite, setSite
+
+from Products.CMFCore.interfaces import ISiteRoot
+
+from collective.wtf.exportimport import getParseStats
+
+logger = logging.getLogger('collective.wtf')
+
+def findSites(container):
+    """Return all CMF sites in the given container, looking inside plain
+    folders but not inside sites.
+    """
+    sites = []
+    for ob in container.objectValues():
+        if ISiteRoot.providedBy(ob):
+            sites.append(ob)
+        elif getattr(aq_base(ob), 'meta_type', None) == 'Folder':
+            sites.extend(findSites(ob))
+    return sites
+
+def importInSites(sites, profile_id, step_id='workflow-csv', commit=True):
+    """Run the given import step of the given profile in each of the given
+    sites, committing after each site. A site that fails is rolled back and
+    reported, and the remaining sites are still processed.
+
+    CSV files are parsed once for all sites (see
+    collective.wtf.exportimport.parseCSVWorkflow), as long as the sites
+    use the same deserializer and configuration.
+
+    Returns a report: a dict with the keys 'sites', a list of dicts with
+    keys 'path', 'seconds' and 'error' (None on success), 'seconds', and
+    'parsed' and 'reused', the number of CSV files that were parsed and
+    taken from the parse cache.
+    """
+    if not profile_id.startswith('profile-') and not profile_id.startswith('snapshot-'):
+        profile_id = 'profile-%s' % profile_id
+
+    stats = getParseStats()
+    report = {'sites': [], 'seconds': 0.0, 'parsed': 0, 'reused': 0}
+
+    started = time.time()
+    old_site = getSite()
+    try:
+        for count, site in enumerate(sites):
+            path = '/'.join(site.getPhysicalPath())
+            site_started = time.time()
+            error = None
+            try:
+                setSite(site)
+                site.portal_setup.runImportStepFromProfile(profile_id, step_id,
+                                                           run_dependencies=False)
+                if commit:
+                    transaction.commit()
+            except Exception, e:
+                transaction.abort()
+                error = '%s: %s' % (e.__class__.__name__, e,)
+                logger.exception("Importing %s into %s failed" % (profile_id, path,))
+            seconds = time.time() - site_started
+            report['sites'].append({'path': path, 'seconds': seconds, 'error': error})
+            logger.info("Imported %s into %s (%d/%d) in %.2fs%s" %
+                            (profile_id, path, count + 1, len(sites), seconds,
+                             error and ' - FAILED' or '',))
+    finally:
+        setSite(old_site)
+
+    report['seconds'] = time.time() - started
+    current = getParseStats()
+    report['parsed'] = current['misses'] - stats['misses']
+    report['reused'] = current['hits'] - stats['hits']
+    return report
+
+def formatReport(report):
+    """Return a plain-text version of an importInSites() report
+    """
+    lines = []
+    for site in report['sites']:
+        lines.append("%-50s %8.2fs  %s" % (site['path'], site['seconds'],
+                                            site['error'] or 'OK',))
+    failed = len([s for s in report['sites'] if s['error']])
+    lines.append("%d sites, %d failed, in %.2fs. %d CSV files parsed, %d reused." %
+                    (len(report['sites']), failed, report['seconds'],
+                     report['parsed'], report['reused'],))
+    return '\n'.join(lines)
+
+def main(app, argv=None):
+    """Entry point for 'bin/instance run', e.g.:
+
+      bin/instance run path/to/collective/wtf/multisite.py my.package:default [site paths]
+
+    Without site paths, all sites in the Zope root are imported into.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    if not argv:
+        print "Usage: multisite <profile id> [<site path> ...]"
+        return 1
+
+    from Testing.makerequest import makerequest
+    app = makerequest(app)
+    newSecurityManager(None, system)
+    try:
+        profile_id = argv[0]
+        if len(argv) > 1:
+            sites = [app.unrestrictedTraverse(path) for path in argv[1:]]
+        else:
+            sites = findSites(app)
+        report = importInSites(sites, profile_id)
+    finally:
+        noSecurityManager()
+
+    print formatReport(report)
+    return len([s for s in report['sites'] if s['error']]) and 1 or 0
+
+if __name__ == '__main__':
+    sys.exit(main(app)) # 'app' is provided by 'bin/instance run'
@@ -0,0 +1,382 @@
+"""Workflow families: overlay CSV files that derive a workflow from a base
+
+An overlay is a CSV file whose [Workflow] section names a base workflow
+with 'Base:'. It only contains what differs from the base:
+
+  - keys of the [Workflow] section other than 'Id:' and 'Base:' replace
+    those of the base;
+
+  - a [State] or [Transition] section with the id of a state or transition
+    of the base only replaces the keys it contains. In the permissions
+    table of a state, only the cells that are not empty are changed, so an
+    overlay may change a single role of a single permission;
+
+  - sections with new ids add states or transitions, and must be complete;
+
+  - [Variables] and [Script] sections work as in a normal CSV file.
+"""
+
+import copy
+from StringIO import StringIO
+
+from zope.component import getUtility
+
+from collective.wtf.interfaces import ParsingError
+from collective.wtf.interfaces import ICSVWorkflowConfig
+from collective.wtf.deserializer import DefaultDeserializer
+from collective.wtf.flyweight import thawInfo
+
+# [Workflow] keys an overlay may change -> info dict keys
+WORKFLOW_KEYS = (('title', 'title',),
+                 ('description', 'description',),
+                 ('initial-state', 'initial_state',),
+                 ('type', 'meta_type',),
+                 ('state-variable', 'state_variable',),)
+
+# Transition info keys -> the [Transition] keys they are read from
+TRANSITION_KEYS = (('new_state_id', ('target-state',),),
+                   ('actbox_name', ('title',),),
+                   ('title', ('description',),),
+                   ('description', ('details',),),
+                   ('trigger_type', ('trigger',),),
+                   ('actbox_url', ('url',),),
+                   ('guard_roles', ('guard-role', 'guard-roles',),),
+                   ('guard_permissions', ('guard-permission', 'guard-permissions',),),
+                   ('guard_expr', ('guard-expression',),),
+                   ('script_name', ('script-before',),),
+                   ('after_script_name', ('script-after',),),
+                   ('actbox_category', ('category',),),)
+
+WORKLIST_KEYS = ('worklist', 'worklist-label', 'worklist-guard-role', 'worklist-guard-roles',
+                 'worklist-guard-permission', 'worklist-guard-permissions',
+                 'worklist-guard-expression',)
+
+def _plain(value):
+    """Return a version of an info dict item for comparisons, in which
+    lists and tuples are the same
+    """
+    if isinstance(value, dict):
+        return dict([(k, _plain(v),) for k, v in value.items()])
+    elif isinstance(value, (list, tuple,)):
+        return tuple([_plain(v) for v in value])
+    return value
+
+def _empty(value):
+    if isinstance(value, (list, tuple,)):
+        return not [v for v in value if v]
+    return not value
+
+def getOverlayBase(body):
+    """Return the id of the base workflow if the given CSV file is an
+    overlay, or None. Only the [Workflow] section is read.
+    """
+    deserializer = DefaultDeserializer()
+    reader = deserializer.make_reader(StringIO(body))
+    for line in reader:
+        if deserializer.read_section(line) == 'workflow':
+            return deserializer.get_map(reader).get('base', None)
+    return None
+
+def parseOverlay(body, config_variant=u"", filename=None):
+    """Parse an overlay CSV file into a patch, which applyOverlay() can
+    apply to the info dict of its base. ParsingErrors give the filename
+    and position of the problem, where known.
+    """
+    config = getUtility(ICSVWorkflowConfig, name=config_variant)
+    deserializer = DefaultDeserializer()
+    reader = deserializer.make_reader(StringIO(body), filename)
+
+    patch = {'workflow': None,
+             'variables': None,
+             'states': [],
+             'transitions': [],
+             'scripts': [],
+             'filename': filename,
+             }
+
+    workflow_start = None
+    for line in reader:
+        section = deserializer.read_section(line)
+        start = reader.line_num
+        try:
+            if section == 'workflow':
+                workflow_start = start
+                patch['workflow'] = deserializer.get_map(reader)
+            elif section == 'variables':
+                patch['variables'] = deserializer.get_map(reader)
+            elif section == 'state':
+                s_info = deserializer.get_map(reader, stop='permissions')
+                rows = []
+                if 'permissions' in s_info:
+                    for row in reader:
+                        if not row or not ''.join(row): # EOF or blank line
+                            break
+                        rows.append(row)
+                patch['states'].append((s_info, rows, start,))
+            elif section == 'transition':
+                patch['transitions'].append((deserializer.get_map(reader), start,))
+            elif section == 'script':
+                scripts = {'script_info': []}
+                deserializer.parse_script(config, scripts, reader)
+                patch['scripts'].extend(scripts['script_info'])
+        except ParsingError, e:
+            reader.fail(e, start)
+
+    wf_info = patch['workflow']
+    if wf_info is None or 'id' not in wf_info or 'base' not in wf_info:
+        raise ParsingError("The [Workflow] section of an overlay must have an 'Id:' and a 'Base:' defined",
+                           filename=filename, line=workflow_start)
+
+    return patch
+
+def _patchPermissions(deserializer, config, state, s_info, rows, start):
+    header = s_info['permissions'][1:]
+    if not header or deserializer.normalize(header[0]) not in ('acquire', 'acquired',):
+        raise ParsingError("The 'Permissions' table of the [State] section must contain role names along the top row, starting with 'Acquired'",
+                           **deserializer.position(s_info, 'permissions'))
+    roles = [r.strip() for r in header[1:]]
+
+    permissions = [thawInfo(p) for p in state['permissions']]
+    by_name = dict([(p['name'], p,) for p in permissions])
+
+    for row in rows:
+        name = row[0].strip()
+        permission = by_name.get(name, None)
+        if permission is None:
+            permission = by_name[name] = copy.deepcopy(config.state_permission_template)
+            permission['name'] = name
+            permission['roles'] = []
+            permissions.append(permission)
+
+        if len(row) >= 2 and row[1].strip():
+            permission['acquired'] = deserializer.get_bool(row[1])
+
+        granted = set(permission['roles'])
+        for role, cell in zip(roles, row[2:]):
+            if not cell.strip():
+                continue # not overridden
+            if deserializer.get_bool(cell):
+                granted.add(role)
+            else:
+                granted.discard(role)
+        permission['roles'] = sorted(granted)
+
+    return permissions
+
+def applyOverlay(base_info, patch, config_variant=u""):
+    """Return the info dict of the workflow described by the given patch
+    (see parseOverlay()) on top of the info dict of its base, which may be
+    frozen, and is not modified. States, transitions and worklists the
+    overlay does not touch are shared with the base.
+    """
+    config = getUtility(ICSVWorkflowConfig, name=config_variant)
+    deserializer = DefaultDeserializer()
+
+    info = dict(base_info)
+    wf_info = patch['workflow']
+    info['id'] = wf_info['id']
+    for key, info_key in WORKFLOW_KEYS:
+        if key in wf_info:
+            info[info_key] = wf_info[key]
+
+    states = list(info['state_info'])
+    transitions = list(info['transition_info'])
+    worklists = list(info['worklist_info'])
+    scripts = list(info['script_info'])
+
+    # Anything new is built by the deserializer into this scratch info dict
+    new = {'state_info': [], 'transition_info': [], 'worklist_info': [], 'script_info': []}
+
+    start = None
+    try:
+        state_index = dict([(s['id'], i,) for i, s in enumerate(states)])
+        for s_info, rows, start in patch['states']:
+            state_id = s_info.get('id', None)
+            if state_id is None:
+                raise ParsingError("The [State] section must have an 'Id:' defined")
+
+            if state_id not in state_index:
+                deserializer.build_state(config, new, s_info, iter(rows))
+                states.append(new['state_info'].pop())
+                worklists.extend(new['worklist_info'])
+                new['worklist_info'] = []
+                continue
+
+            state = thawInfo(states[state_index[state_id]])
+            for key in ('title', 'description',):
+                if key in s_info:
+                    state[key] = s_info[key]
+            if 'transitions' in s_info:
+                state['transitions'] = deserializer.get_list(s_info['transitions'])
+            if 'permissions' in s_info:
+                state['permissions'] = _patchPermissions(deserializer, config, state, s_info, rows, start)
+            states[state_index[state_id]] = state
+
+            if [k for k in WORKLIST_KEYS if k in s_info]:
+                if 'worklist' not in s_info:
+                    raise ParsingError("The [State] section changes a worklist, so it must have a 'Worklist:' defined")
+                match = ('review_state', state_id,)
+                worklists = [w for w in worklists if match not in [tuple(v) for v in w['var_match']]]
+                worklists.append(deserializer.build_worklist(config, state_id, s_info))
+
+        transition_index = dict([(t['id'], i,) for i, t in enumerate(transitions)])
+        for t_info, start in patch['transitions']:
+            deserializer.build_transition(config, new, t_info)
+            built = new['transition_info'].pop()
+            if built['id'] not in transition_index:
+                transitions.append(built)
+                continue
+            transition = thawInfo(transitions[transition_index[built['id']]])
+            for key, sources in TRANSITION_KEYS:
+                if [s for s in sources if s in t_info]:
+                    transition[key] = built[key]
+            transitions[transition_index[built['id']]] = transition
+
+        start = None
+        script_index = dict([(s['id'], i,) for i, s in enumerate(scripts)])
+        for script in new['script_info'] + patch['scripts']:
+            if script['id'] in script_index:
+                scripts[script_index[script['id']]] = script
+            else:
+                script_index[script['id']] = len(scripts)
+                scripts.append(script)
+
+        info['state_info'] = states
+        info['transition_info'] = transitions
+        info['worklist_info'] = worklists
+        info['script_info'] = scripts
+
+        if patch['variables'] is not None:
+            info['variable_info'] = [thawInfo(v) for v in info['variable_info']]
+            deserializer.build_variables(config, info, patch['variables'])
+
+        deserializer.backfill(info)
+        deserializer.validate(info)
+    except ParsingError, e:
+        # Errors point to the section they were found in
+        if e.filename is None:
+            e.filename = patch.get('filename', None)
+        if e.line is None:
+            e.line = start
+        raise
+
+    return info
+
+def writeOverlay(base_info, info, output_stream, base_id=None, config_variant=u""):
+    """Write the given workflow as an overlay of the given base workflow,
+    containing only what differs from the base. base_id defaults to the id
+    of the base. Items the base has but the workflow does not cannot be
+    expressed, and raise a ValueError.
+    """
+    import csv
+    from collective.wtf.serializer import DefaultSerializer
+
+    config = getUtility(ICSVWorkflowConfig, name=config_variant)
+    serializer = DefaultSerializer()
+    writer = csv.writer(output_stream)
+    r = writer.writerow
+
+    for key, items in (('state_info', 'states',), ('transition_info', 'transitions',),):
+        missing = set([i['id'] for i in base_info[key]]) - set([i['id'] for i in info[key]])
+        if missing:
+            raise ValueError("The base has %s the workflow does not: %s" % (items, ', '.join(sorted(missing)),))
+
+    r(['[Workflow]'])
+    r(['Id:', info['id']])
+    r(['Base:', base_id or base_info['id']])
+    labels = {'title': 'Title:', 'description': 'Description:', 'initial_state': 'Initial state:',
+              'meta_type': 'Type:', 'state_variable': 'State variable:'}
+    for key, info_key in WORKFLOW_KEYS:
+        if info.get(info_key) != base_info.get(info_key):
+            r([labels[info_key], info[info_key]])
+    r([])
+
+    recorded = [v['id'] for v in info.get('variable_info', ()) if v['for_status']]
+    base_recorded = [v['id'] for v in base_info.get('variable_info', ()) if v['for_status']]
+    if sorted(recorded) != sorted(base_recorded):
+        r(['[Variables]'])
+        r(['Record:', ', '.join(recorded) or 'none'])
+        r([])
+
+    all_roles = serializer.get_roles(config, info)
+    all_roles += [role for role in serializer.get_roles(config, base_info) if role not in all_roles]
+    worklists = serializer.get_state_worklists(info)
+    base_worklists = serializer.get_state_worklists(base_info)
+    base_states = dict([(s['id'], s,) for s in base_info['state_info']])
+
+    for state in info['state_info']:
+        base_state = base_states.get(state['id'], None)
+        worklist = worklists.get(state['id'], None)
+        if base_state is None:
+            serializer.write_state(writer, config, state, all_roles, worklist)
+            continue
+
+        rows = []
+        for key, label in (('title', 'Title:',), ('description', 'Description:',),):
+            if state[key] != base_state[key]:
+                rows.append([label, state[key].strip()])
+        if tuple(state['transitions']) != tuple(base_state['transitions']):
+            rows.append(['Transitions', ', '.join(state['transitions'])])
+        base_worklist = base_worklists.get(state['id'], None)
+        if worklist is not None and _plain(worklist) != _plain(base_worklist):
+            rows.append(['Worklist:', worklist['description'].strip()])
+            rows.append(['Worklist label:', worklist['actbox_name']])
+            rows.append(['Worklist guard permission:', ', '.join(worklist['guard_permissions'])])
+            rows.append(['Worklist guard role:', ', '.join(worklist['guard_roles'])])
+            rows.append(['Worklist guard expression:', worklist['guard_expr']])
+
+        base_permissions = dict([(p['name'], p,) for p in base_state['permissions']])
+        cells = []
+        for permission in state['permissions']:
+            base_permission = base_permissions.get(permission['name'], None)
+            if base_permission is None:
+                base_permission = {'acquired': None, 'roles': ()}
+            row = [permission['name'], '']
+            if bool(permission['acquired']) != base_permission['acquired']:
+                row[1] = permission['acquired'] and 'Y' or 'N'
+            for role in all_roles:
+                granted = role in permission['roles']
+                if base_permission['acquired'] is None or granted != (role in base_permission['roles']):
+                    row.append(granted and 'Y' or 'N')
+                else:
+                    row.append('')
+            if [c for c in row[1:] if c]:
+                cells.append(row)
+
+        if not rows and not cells:
+            continue
+
+        r(['[State]'])
+        r(['Id:', state['id']])
+        for row in rows:
+            r(row)
+        if cells:
+            r(['Permissions', 'Acquire'] + all_roles)
+            for row in cells:
+                r(row)
+        r([])
+
+    base_transitions = dict([(t['id'], t,) for t in base_info['transition_info']])
+    for transition in info['transition_info']:
+        base_transition = base_transitions.get(transition['id'], None)
+        if base_transition is None:
+            serializer.write_transition(writer, transition)
+        elif _plain(transition) != _plain(base_transition):
+            # Empty values in a section are ignored, so they cannot undo
+            # what the base sets
+            cleared = [k for k, sources in TRANSITION_KEYS
+                            if _empty(transition[k]) and not _empty(base_transition[k])]
+            if cleared:
+                raise ValueError("Transition %s clears %s, which an overlay cannot express" % (transition['id'], ', '.join(cleared),))
+            serializer.write_transition(writer, transition)
+
+    base_scripts = dict([(s['id'], s,) for s in base_info['script_info']])
+    for script in info['script_info']:
+        if script['meta_type'] == 'External Method' and \
+                _plain(script) != _plain(base_scripts.get(script['id'], None)):
+            r(['[Script]'])
+            r(['Id:', script['id']])
+            r(['Type:', script['meta_type']])
+            r(['Module:', script['module']])
+            r(['Function:', script['function']])
+            r([])
@@ -0,0 +1,102 @@
+import transaction
+
+from Acquisition import aq_base
+
+from Products.CMFCore.utils import getToolByName
+
+# Process-wide counters, for diagnostics
+_stats = {'queued': 0, 'merged': 0, 'reindexed': 0}
+
+class ReindexQueue(object):
+    """Objects whose workflow variables need to be reindexed before the
+    current transaction commits. Requests for the same object are merged,
+    so that it is catalogued only once, with the union of the requested
+    indexes.
+
+    As for reindexObject(), an empty list of indexes means all indexes.
+    Once an object has been queued for all indexes, it stays that way.
+    """
+
+    def __init__(self):
+        self.entries = {}
+
+    def add(self, ob, idxs, security=True):
+        path = '/'.join(ob.getPhysicalPath())
+        entry = self.entries.get(path, None)
+        _stats['queued'] += 1
+        idxs = idxs and set(idxs) or None
+        if entry is None:
+            self.entries[path] = [ob, idxs, security]
+        else:
+            _stats['merged'] += 1
+            entry[0] = ob
+            if entry[1] is not None:
+                if idxs is None:
+                    entry[1] = None
+                else:
+                    entry[1].update(idxs)
+            entry[2] = entry[2] or security
+
+    def flush(self):
+        entries, self.entries = self.entries, {}
+        for path in sorted(entries.keys()):
+            ob, idxs, security = entries[path]
+
+            # Do not put back objects that were deleted in the meantime
+            current = ob.getPhysicalRoot().unrestrictedTraverse(path, None)
+            if current is None or aq_base(current) is not aq_base(ob):
+                continue
+
+            base = aq_base(ob)
+            if hasattr(base, 'reindexObject'):
+                ob.reindexObject(idxs=sorted(idxs or ()))
+            if security and hasattr(base, 'reindexObjectSecurity'):
+                ob.reindexObjectSecurity()
+            _stats['reindexed'] += 1
+
+    def __len__(self):
+        return len(self.entries)
+
+def getReindexQueue(create=True):
+    """Return the reindex queue of the current transaction. If there is
+    none yet, one is created and registered to be flushed in a
+    before-commit hook, unless create is false, in which case None is
+    returned.
+    """
+    txn = transaction.get()
+    for hook, args, kws in txn.getBeforeCommitHooks():
+        if hook is _flushBeforeCommit:
+            return args[0]
+    if not create:
+        return None
+    queue = ReindexQueue()
+    txn.addBeforeCommitHook(_flushBeforeCommit, (queue,))
+    return queue
+
+def queueWorkflowReindex(ob):
+    """Queue the reindexing that WorkflowTool._reindexWorkflowVariables()
+    would do for ob: the catalog variables of its workflows (all indexes
+    if there are none), and its security. The object is reindexed once,
+    when the transaction commits.
+    """
+    wtool = getToolByName(ob, 'portal_workflow')
+    if not wtool._default_cataloging:
+        return
+    idxs = (wtool.getCatalogVariablesFor(ob) or {}).keys()
+    getReindexQueue().add(ob, idxs)
+
+def flushReindexQueue():
+    """Perform any queued reindexing now, e.g. before searching the
+    catalog for objects that were just transitioned.
+    """
+    queue = getReindexQueue(create=False)
+    if queue is not None:
+        queue.flush()
+
+def getReindexStats():
+    """Return a copy of the process-wide reindex queue counters
+    """
+    return dict(_stats)
+
+def _flushBeforeCommit(queue):
+    queue.flush()
@@ -0,0 +1,158 @@
+from Acquisition import aq_base
+from AccessControl.Permission import pname
+
+from Products.CMFCore.utils import getToolByName
+from Products.DCWorkflow.utils import modifyRolesForPermission
+from Products.DCWorkflow.utils import modifyRolesForGroup
+
+from collective.wtf.census import getTypesByWorkflow
+from collective.wtf.utils import get_workflow_chain
+
+# Attribute on the workflow definition holding the compiled role map
+ROLE_MAP_ATTR = '_wtf_role_map'
+
+def compileRoleMap(workflow):
+    """Compile and store the permission grants of each state of the given
+    workflow.
+
+    For each state, this stores a tuple of (permission, attribute name,
+    acquired, roles) tuples, one for each permission managed by the
+    workflow, where 'attribute name' is the name of the attribute in which
+    Zope keeps the roles for that permission on an object. A copy of the
+    state's permission_roles is kept with it, so that a state that has been
+    changed through the ZMI since can be detected.
+    """
+    permissions = tuple(workflow.permissions)
+    table = {}
+    for sdef in workflow.states.objectValues():
+        source = dict(sdef.permission_roles or {})
+        grants = []
+        for permission in permissions:
+            roles = source.get(permission, [])
+            grants.append((permission, pname(permission), isinstance(roles, list), tuple(roles),))
+        table[sdef.getId()] = (source, tuple(grants),)
+    setattr(workflow, ROLE_MAP_ATTR, (permissions, table,))
+
+def getStateGrants(workflow, state_id):
+    """Return the compiled grants for the given state, or None if there is
+    no compiled role map, or it is out of date.
+    """
+    role_map = getattr(aq_base(workflow), ROLE_MAP_ATTR, None)
+    if role_map is None:
+        return None
+    permissions, table = role_map
+    if tuple(workflow.permissions) != permissions:
+        return None
+    entry = table.get(state_id, None)
+    sdef = workflow.states.get(state_id, None)
+    if entry is None or sdef is None:
+        return None
+    source, grants = entry
+    if source != (sdef.permission_roles or {}):
+        return None
+    return grants
+
+def applyRoleMap(workflow, ob):
+    """Update the role to permission mappings of ob according to its state
+    in the given workflow, like workflow.updateRoleMappingsFor(ob). Returns
+    True if anything changed.
+
+    The roles stored on the object are compared to the compiled grants
+    directly, and only permissions whose roles differ are passed on to
+    DCWorkflow. Unlike updateRoleMappingsFor(), this does not need to list
+    all the permissions of the object for each managed permission, and a
+    permission that should simply be acquired and is not set on the object
+    is not reported as a change. Falls back to updateRoleMappingsFor() if
+    there is no up-to-date compiled role map.
+    """
+    state_id = workflow._getWorkflowStateOf(ob, id_only=1)
+    if state_id is None:
+        return False
+
+    grants = getStateGrants(workflow, state_id)
+    if grants is None:
+        return bool(workflow.updateRoleMappingsFor(ob))
+
+    base = aq_base(ob)
+    activate = getattr(base, '_p_activate', None)
+    if activate is not None:
+        activate()
+    current_roles = getattr(base, '__dict__', {})
+
+    changed = False
+    for permission, attr, acquired, roles in grants:
+        current = current_roles.get(attr, _marker)
+        if current is _marker:
+            if acquired and not roles:
+                continue
+        elif isinstance(current, list) == acquired and tuple(current) == roles:
+            continue
+        if acquired:
+            roles = list(roles)
+        if modifyRolesForPermission(ob, permission, roles):
+            changed = True
+
+    groups = workflow.getGroups()
+    managed_roles = workflow.getRoles()
+    if groups and managed_roles:
+        sdef = workflow.states[state_id]
+        for group in groups:
+            roles = ()
+            if sdef.group_roles is not None:
+                roles = sdef.group_roles.get(group, ())
+            if modifyRolesForGroup(ob, group, roles, managed_roles):
+                changed = True
+
+    return changed
+
+def updateRoleMappings(context, workflow_ids=None):
+    """Update the role mappings of all catalogued objects of the portal
+    types using the given workflows (or all workflows), with
+    applyRoleMap(). Objects whose mappings changed have their security
+    reindexed. Objects that were not changed are deactivated again.
+
+    Returns a tuple (checked, changed). Unlike the workflow tool's
+    updateRoleMappings(), objects that are not in the catalog are not
+    visited.
+    """
+    wtool = getToolByName(context, 'portal_workflow')
+    catalog = getToolByName(context, 'portal_catalog')
+
+    types_by_workflow = getTypesByWorkflow(context)
+    if workflow_ids is None:
+        workflow_ids = wtool.getWorkflowIds()
+    workflow_ids = set(workflow_ids)
+
+    portal_types = set()
+    for workflow_id in workflow_ids:
+        portal_types.update(types_by_workflow.get(workflow_id, ()))
+    if not portal_types:
+        return (0, 0,)
+
+    workflows = {}
+    checked = changed = 0
+    for brain in catalog.unrestrictedSearchResults(portal_type=sorted(portal_types)):
+        ob = brain._unrestrictedGetObject()
+        checked += 1
+
+        did = False
+        for workflow_id in get_workflow_chain(ob, wtool):
+            if workflow_id not in workflow_ids:
+                continue
+            workflow = workflows.get(workflow_id, None)
+            if workflow is None:
+                workflow = workflows[workflow_id] = wtool.getWorkflowById(workflow_id)
+            if workflow is not None and applyRoleMap(workflow, ob):
+                did = True
+
+        base = aq_base(ob)
+        if did:
+            changed += 1
+            if hasattr(base, 'reindexObject'):
+                ob.reindexObject(idxs=['allowedRolesAndUsers'])
+        elif getattr(base, '_p_changed', True) is False:
+            base._p_deactivate()
+
+    return (checked, changed,)
+
+_marker = object()
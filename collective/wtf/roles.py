@@ -0,0 +1,213 @@
+from Acquisition import aq_base, aq_inner, aq_parent
+from zope.component import getAdapters
+
+from Products.CMFCore.utils import getToolByName
+
+try:
+    from borg.localrole.interfaces import ILocalRoleProvider
+except ImportError: # plain CMF, without Plone's local role PAS plugin
+    ILocalRoleProvider = None
+
+def getLocalRoles(context):
+    """Return a mapping of principal id -> roles granted on context itself.
+
+    If borg.localrole is available, the roles are gathered from all the
+    ILocalRoleProvider adapters of context, as Plone's local role PAS
+    plugin does (the default adapter reads __ac_local_roles__). Note that
+    providers are asked for getAllRoles(), so a provider that only grants
+    roles through getRoles() for specific principals is not taken into
+    account. Otherwise, __ac_local_roles__ is read directly.
+    """
+    if ILocalRoleProvider is None:
+        local_roles = getattr(aq_base(context), '__ac_local_roles__', None)
+        if callable(local_roles):
+            local_roles = local_roles()
+        return local_roles or {}
+
+    local_roles = {}
+    for name, provider in getAdapters((context,), ILocalRoleProvider):
+        for principal, roles in provider.getAllRoles():
+            if roles:
+                local_roles[principal] = local_roles.get(principal, frozenset()) | frozenset(roles)
+    return local_roles
+
+def mergeLocalRoles(context, parent_map):
+    """Return the local role map for context, given the map that applies
+    to its parent. If context defines no local roles of its own, the
+    parent's map is returned as-is, so that it can be shared.
+    """
+    base = aq_base(context)
+    local_roles = getLocalRoles(context)
+
+    if getattr(base, '__ac_local_roles_block__', False):
+        parent_map = {}
+
+    if not local_roles:
+        return parent_map
+
+    local_map = dict(parent_map)
+    for principal, roles in local_roles.items():
+        if roles:
+            local_map[principal] = local_map.get(principal, frozenset()) | frozenset(roles)
+    return local_map
+
+class LocalRoleResolver(object):
+    """Compute roles in context for many users and many objects.
+
+    Local roles are gathered by walking up the acquisition chain, in the
+    same way as the PAS user's getRolesInContext(), and read with
+    getLocalRoles(), but the merged local role map of each container is
+    cached by physical path. Siblings, and the same object checked for
+    many users, therefore share one lookup.
+
+    An instance should only live for the duration of a request, since
+    the cache is not invalidated when local roles change.
+    """
+
+    def __init__(self):
+        self._maps = {}
+
+    def getLocalRoleMap(self, context):
+        """Return a mapping of principal id -> frozenset of local roles
+        that apply in the given context, including those acquired from
+        parents (unless local role acquisition is blocked).
+        """
+        context = aq_inner(context)
+        path = context.getPhysicalPath()
+
+        local_map = self._maps.get(path, None)
+        if local_map is not None:
+            return local_map
+
+        parent = aq_parent(context)
+        if parent is None:
+            parent_map = {}
+        else:
+            parent_map = self.getLocalRoleMap(parent)
+
+        local_map = mergeLocalRoles(context, parent_map)
+        self._maps[path] = local_map
+        return local_map
+
+    def getRolesInContext(self, principal_ids, global_roles, context):
+        """Return a sorted list of roles for a user with the given global
+        roles, whose user id and group ids are given as principal_ids.
+        """
+        local_map = self.getLocalRoleMap(context)
+        roles = set(global_roles)
+        for principal in principal_ids:
+            roles.update(local_map.get(principal, ()))
+        return sorted(roles)
+
+def getPrincipalIds(member):
+    """Return the user id followed by the ids of all groups the given
+    member belongs to. Group memberships are only resolved once, here.
+    """
+    user = member.getUser()
+    principal_ids = [member.getId()]
+    getGroups = getattr(user, 'getGroups', None)
+    if getGroups is not None:
+        principal_ids.extend(getGroups() or ())
+    return principal_ids
+
+class SubtreeLocalRoleMap(object):
+    """Reconstruct the local role map of every catalogued object in a
+    subtree.
+
+    The subtree is walked one folder at a time, using the path index to
+    find the children of each folder. The catalog cannot tell which local
+    roles an object has: allowedRolesAndUsers only lists the principals
+    that may view it, not which roles they hold or where they hold them.
+    Each child is therefore loaded to read its own local roles (see
+    getLocalRoles()), and deactivated again straight away unless it was
+    already in memory. Children without local roles of their own share
+    their parent's map.
+
+    Only the rids of a single folder's children are held in memory at a
+    time, and these are processed in chunks of chunk_size, after which
+    the ZODB cache is given a chance to shrink.
+    """
+
+    def __init__(self, context, chunk_size=1000):
+        self.context = aq_inner(context)
+        self.chunk_size = chunk_size
+
+        catalog = getToolByName(self.context, 'portal_catalog')
+        self.catalog = catalog._catalog
+        self.path_index = self.catalog.getIndex('path')
+
+        self.loaded = 0
+        self.inherited = 0
+
+    def __iter__(self):
+        """Generate (path, local_map, source) tuples, where source is
+        'local' if the object has local roles of its own, and 'inherited'
+        if its map is the same as its parent's.
+        """
+        root = self.context
+        root_path = '/'.join(root.getPhysicalPath())
+        resolver = LocalRoleResolver()
+        root_map = resolver.getLocalRoleMap(root)
+        source = 'local'
+        parent = aq_parent(root)
+        if parent is not None and resolver.getLocalRoleMap(parent) is root_map:
+            source = 'inherited'
+        yield (root_path, root_map, source)
+
+        folders = [(root_path, root_map)]
+        while folders:
+            folder_path, folder_map = folders.pop()
+            for path, local_map, source, folderish in self._children(folder_path, folder_map):
+                yield (path, local_map, source)
+                if folderish:
+                    folders.append((path, local_map))
+
+    def _children(self, folder_path, folder_map):
+        query = {'path': {'query': folder_path, 'depth': 1}}
+        result = self.path_index._apply_index(query)
+        if result is None:
+            return
+        rids = list(result[0])
+
+        for start in xrange(0, len(rids), self.chunk_size):
+            for rid in rids[start:start + self.chunk_size]:
+                path = self.catalog.paths.get(rid, None)
+                if path is None or path == folder_path:
+                    continue
+
+                entry = self._read(path, folder_map)
+                if entry is None:
+                    continue
+                local_map, folderish = entry
+
+                if local_map is folder_map:
+                    source = 'inherited'
+                    self.inherited += 1
+                else:
+                    source = 'local'
+
+                yield (path, local_map, source, folderish)
+
+            self._minimizeCache()
+
+    def _read(self, path, parent_map):
+        """Return the local role map of the object at path and whether it
+        is folderish, or None if it cannot be found
+        """
+        obj = self.context.unrestrictedTraverse(path, None)
+        if obj is None:
+            return None
+        base = aq_base(obj)
+        ghost = getattr(base, '_p_changed', False) is None
+        if ghost:
+            self.loaded += 1
+        local_map = mergeLocalRoles(obj, parent_map)
+        folderish = bool(getattr(base, 'isPrincipiaFolderish', False))
+        if ghost and getattr(base, '_p_changed', True) is False:
+            base._p_deactivate()
+        return local_map, folderish
+
+    def _minimizeCache(self):
+        jar = getattr(aq_base(self.context), '_p_jar', None)
+        if jar is not None:
+            jar.cacheGC()
@@ -0,0 +1,44 @@
+from persistent import Persistent
+from Acquisition import aq_base
+
+def modificationSerial(workflow, depth=4):
+    """Return the serial (transaction id) of the most recent change to the
+    given workflow or any persistent object stored within it, such as its
+    states, transitions and their permission maps and guards. Returns None
+    if the workflow has not been saved yet, or has uncommitted changes.
+    """
+    serials = []
+    if not _collectSerials(aq_base(workflow), depth, serials):
+        return None
+    return max(serials)
+
+def _collectSerials(ob, depth, serials):
+    if getattr(ob, '_p_jar', None) is None:
+        return False
+    ob._p_activate()
+    if ob._p_changed:
+        return False
+    serials.append(ob._p_serial)
+    # BTrees and other persistent objects implemented in C have no __dict__
+    attributes = getattr(ob, '__dict__', None)
+    if depth > 0 and attributes is not None:
+        return _collectValues(attributes.values(), depth - 1, serials)
+    return True
+
+def _collectValues(values, depth, serials):
+    """Follow the persistent objects among values, and in the dicts, lists
+    and tuples among them, which are stored with the object holding them.
+    This is how DCWorkflow's containers (ContainerTab._mapping) hold the
+    states, transitions and so on.
+    """
+    for value in values:
+        if isinstance(value, Persistent):
+            if not _collectSerials(value, depth, serials):
+                return False
+        elif isinstance(value, dict):
+            if not _collectValues(value.values(), depth, serials):
+                return False
+        elif isinstance(value, (list, tuple,)):
+            if not _collectValues(value, depth, serials):
+                return False
+    return True
@@ -15,19 +15,8 @@ class DefaultSerializer(object):
         
         config = getUtility(ICSVWorkflowConfig, name=config_variant)
         
-        custom_roles = set()
-        for s in info['state_info']:
-            for p in s['permissions']:
-                for r in p['roles']:
-                    if r not in config.known_roles:
-                        custom_roles.add(r)
-        all_roles = config.known_roles + sorted(custom_roles)
-    
-        state_worklists = {}
-        for w in info['worklist_info']:
-            for v in w['var_match']:
-                if v[0] == 'review_state':
-                    state_worklists[v[1]] = w
+        all_roles = self.get_roles(config, info)
+        state_worklists = self.get_state_worklists(info)
     
         writer = csv.writer(output_stream)
     
@@ -41,80 +30,21 @@ class DefaultSerializer(object):
         r(['Type:',           info['meta_type']           ])
         r(['State variable:', info['state_variable']      ])
         r([]) # terminator row
-    
-        for s in info['state_info']:
-            r(['[State]'])
-            r(['Id:',           s['id']                     ])
-            r(['Title:',        s['title'].strip()          ])
-            r(['Description:',  s['description'].strip()    ])
-            r(['Transitions',   ', '.join(s['transitions']) ])
-        
-            w = state_worklists.get(s['id'], None)
-            if w is not None:
-                r(['Worklist:',                  w['description'].strip()          ])
-                r(['Worklist label:',            w['actbox_name']                  ])
-                r(['Worklist guard permission:', ', '.join(w['guard_permissions']) ])
-                r(['Worklist guard role:',       ', '.join(w['guard_roles'])       ])
-                r(['Worklist guard expression:', w['guard_expr']                   ])
-        
-            r(['Permissions', 'Acquire'] + all_roles)
-        
-            permission_map = dict([p['name'], p] for p in s['permissions'])
-            ordered_permissions = [permission_map[p] for p in config.known_permissions if p in permission_map] + \
-                                  [p for p in s['permissions'] if p['name'] not in config.known_permissions]
-
-            for p in ordered_permissions:
-                acquired = 'N'
-                if p['acquired']:
-                    acquired = 'Y'
-            
-                role_map = []
-                for role in all_roles:
-                    if role in p['roles']:
-                        role_map.append('Y')
-                    else:
-                        role_map.append('N')
-                
-                r([p['name'], acquired] + role_map)
         
+        # Only write a [Variables] section if the workflow does not record
+        # the default variables in its history
+        recorded = [v['id'] for v in info.get('variable_info', ()) if v['for_status']]
+        default = [v['id'] for v in config.info_template['variable_info'] if v['for_status']]
+        if sorted(recorded) != sorted(default):
+            r(['[Variables]'])
+            r(['Record:', ', '.join(recorded) or 'none'])
             r([]) # terminator row
+    
+        for s in info['state_info']:
+            self.write_state(writer, config, s, all_roles, state_worklists.get(s['id'], None))
         
         for t in info['transition_info']:
-            r(['[Transition]'])
-        
-            r(['Id:',               t['id']                             ])
-            r(['Title:',            t['actbox_name']                    ])
-            r(['Description:',      t['title'].strip()                  ])
-            
-            if(t['description'].strip()):
-                r(['Details:',          t['description'].strip()        ])
-            
-            r(['Target state:',     t['new_state_id']                   ])
-            
-            if(t['actbox_url']):
-                r(['URL:',              t['actbox_url']                 ])
-            
-            r(['Trigger:',          t['trigger_type'].capitalize()      ])
-
-            if(t['guard_permissions']):
-                r(['Guard permission:', ', '.join(t['guard_permissions'])])
-                
-            if(t['guard_roles']):
-                r(['Guard role:',       ', '.join(t['guard_roles'])     ])
-                
-            if(t['guard_expr']):
-                r(['Guard expression:', t['guard_expr']                 ])
-            
-            if(t['script_name']):
-                r(['Script before:',    t['script_name']                ])
-                
-            if(t['after_script_name']):
-                r(['Script after:',     t['after_script_name']          ])
-
-            if t['actbox_category'] != 'workflow':
-                r(['Category:', t['actbox_category']])
-
-            r([]) # terminator row
+            self.write_transition(writer, t)
 
         for s in info['script_info']:
             if s['meta_type'] == 'External Method':
@@ -133,3 +63,105 @@ class DefaultSerializer(object):
             ##     r(['File:',     s['filename']  ])
 
             r([]) # terminator row
+
+    def get_roles(self, config, info):
+        """Return the roles to use as the columns of the permission tables
+        """
+        custom_roles = set()
+        for s in info['state_info']:
+            for p in s['permissions']:
+                for r in p['roles']:
+                    if r not in config.known_roles:
+                        custom_roles.add(r)
+        return config.known_roles + sorted(custom_roles)
+    
+    def get_state_worklists(self, info):
+        """Return a dict of state id -> the worklist of that state
+        """
+        state_worklists = {}
+        for w in info['worklist_info']:
+            for v in w['var_match']:
+                if v[0] == 'review_state':
+                    state_worklists[v[1]] = w
+        return state_worklists
+    
+    def write_state(self, writer, config, s, all_roles, w=None):
+        """Write a [State] section, with the state's worklist w, if any
+        """
+        r = writer.writerow
+        
+        r(['[State]'])
+        r(['Id:',           s['id']                     ])
+        r(['Title:',        s['title'].strip()          ])
+        r(['Description:',  s['description'].strip()    ])
+        r(['Transitions',   ', '.join(s['transitions']) ])
+    
+        if w is not None:
+            r(['Worklist:',                  w['description'].strip()          ])
+            r(['Worklist label:',            w['actbox_name']                  ])
+            r(['Worklist guard permission:', ', '.join(w['guard_permissions']) ])
+            r(['Worklist guard role:',       ', '.join(w['guard_roles'])       ])
+            r(['Worklist guard expression:', w['guard_expr']                   ])
+    
+        r(['Permissions', 'Acquire'] + all_roles)
+    
+        permission_map = dict([p['name'], p] for p in s['permissions'])
+        ordered_permissions = [permission_map[p] for p in config.known_permissions if p in permission_map] + \
+                              [p for p in s['permissions'] if p['name'] not in config.known_permissions]
+
+        for p in ordered_permissions:
+            acquired = 'N'
+            if p['acquired']:
+                acquired = 'Y'
+        
+            role_map = []
+            for role in all_roles:
+                if role in p['roles']:
+                    role_map.append('Y')
+                else:
+                    role_map.append('N')
+            
+            r([p['name'], acquired] + role_map)
+    
+        r([]) # terminator row
+    
+    def write_transition(self, writer, t):
+        """Write a [Transition] section
+        """
+        r = writer.writerow
+        
+        r(['[Transition]'])
+    
+        r(['Id:',               t['id']                             ])
+        r(['Title:',            t['actbox_name']                    ])
+        r(['Description:',      t['title'].strip()                  ])
+        
+        if(t['description'].strip()):
+            r(['Details:',          t['description'].strip()        ])
+        
+        r(['Target state:',     t['new_state_id']                   ])
+        
+        if(t['actbox_url']):
+            r(['URL:',              t['actbox_url']                 ])
+        
+        r(['Trigger:',          t['trigger_type'].capitalize()      ])
+
+        if(t['guard_permissions']):
+            r(['Guard permission:', ', '.join(t['guard_permissions'])])
+            
+        if(t['guard_roles']):
+            r(['Guard role:',       ', '.join(t['guard_roles'])     ])
+            
+        if(t['guard_expr']):
+            r(['Guard expression:', t['guard_expr']                 ])
+        
+        if(t['script_name']):
+            r(['Script before:',    t['script_name']                ])
+            
+        if(t['after_script_name']):
+            r(['Script after:',     t['after_script_name']          ])
+
+        if t['actbox_category'] != 'workflow':
+            r(['Category:', t['actbox_category']])
+
+        r([]) # terminator row
@@ -0,0 +1,373 @@
+"""Benchmark for the automatic transition handlers in collective.wtf.utils
+
+Run it with
+
+  bin/instance run path/to/collective/wtf/tests/benchmark.py [options]
+
+It builds a synthetic Plone site in a DemoStorage stacked on top of the
+instance's storage, so nothing is ever written to the real database. The
+site has a tree of folders and documents, whose workflow chains and
+automatic transitions are set up according to the options. The handlers
+are registered for IActionSucceededEvent, and a number of worker threads,
+each with its own ZODB connection, perform transitions on randomly chosen
+documents, committing after each one and retrying on ConflictError.
+
+At the end, throughput, latency percentiles, time spent in the handlers,
+automatic transitions fired, reindexing and conflict rates are printed.
+Use --save to record the results as a baseline, and --compare to compare
+a later run (e.g. after changing the handlers) to it. Use --help for the
+options.
+"""
+
+import sys
+import time
+import random
+import threading
+
+from optparse import OptionParser
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+import transaction
+from ZODB.DB import DB
+from ZODB.DemoStorage import DemoStorage
+from ZODB.POSException import ConflictError
+
+from zope.interface import Interface
+from zope.component import getGlobalSiteManager
+
+try:
+    from zope.site.hooks import setSite
+except ImportError: # Zope < 2.12
+    from zope.app.component.hooks import setSite
+
+from Testing.makerequest import makerequest
+from AccessControl.SecurityManagement import newSecurityManager
+from AccessControl.SecurityManagement import noSecurityManager
+from AccessControl.SpecialUsers import system
+
+from Products.CMFCore.interfaces import IActionSucceededEvent
+from Products.DCWorkflow.interfaces import IAfterTransitionEvent
+from Products.DCWorkflow.DCWorkflow import DCWorkflowDefinition
+from Products.DCWorkflow.Transitions import TRIGGER_AUTOMATIC
+from Products.DCWorkflow.Transitions import TRIGGER_USER_ACTION
+
+from collective.wtf import reindex
+from collective.wtf.utils import clear_chain_cache
+from collective.wtf.utils import trigger_automatic_transitions
+from collective.wtf.utils import trigger_automatic_transitions_in_parent
+
+SITE_ID = 'wtf-benchmark'
+
+# The user transition to perform on a document, by review state
+NEXT_TRANSITION = {'private': 'submit',
+                   'pending': 'publish',
+                   'published': 'retract',
+                   }
+
+# Expressions for the guards of the automatic transitions of folders
+PUBLISHED_CHILDREN = ("python:len(object.portal_catalog.unrestrictedSearchResults("
+                      "path={'query': '/'.join(object.getPhysicalPath()), 'depth': 1}, "
+                      "review_state='published'))")
+
+def parseOptions(argv):
+    parser = OptionParser(usage="bin/instance run %prog [options]")
+    parser.add_option('--threads', type='int', default=4,
+                      help="number of worker threads [%default]")
+    parser.add_option('--operations', type='int', default=200,
+                      help="transitions per thread [%default]")
+    parser.add_option('--chain', type='int', default=2,
+                      help="number of workflows in the chain of documents [%default]")
+    parser.add_option('--depth', type='int', default=3,
+                      help="depth of the folder tree [%default]")
+    parser.add_option('--breadth', type='int', default=3,
+                      help="subfolders per folder [%default]")
+    parser.add_option('--documents', type='int', default=5,
+                      help="documents per folder [%default]")
+    parser.add_option('--no-automatic', dest='automatic', action='store_false', default=True,
+                      help="do not add automatic transitions to the workflows")
+    parser.add_option('--no-parent', dest='parent', action='store_false', default=True,
+                      help="do not register trigger_automatic_transitions_in_parent")
+    parser.add_option('--partition', action='store_true', default=False,
+                      help="give each thread its own documents, to avoid conflicts")
+    parser.add_option('--seed', type='int', default=0,
+                      help="random seed [%default]")
+    parser.add_option('--save', metavar='FILE',
+                      help="save the results to FILE as a baseline")
+    parser.add_option('--compare', metavar='FILE',
+                      help="compare the results to a baseline saved in FILE")
+    return parser.parse_args(argv)[0]
+
+def addWorkflow(wtool, workflow_id, state_var, states, transitions):
+    """Add a workflow. states is a list of (id, transition ids) tuples, the
+    first one being the initial state. transitions is a list of (id, new
+    state, trigger type, guard expression) tuples.
+    """
+    wtool._setObject(workflow_id, DCWorkflowDefinition(workflow_id))
+    workflow = wtool[workflow_id]
+    workflow.variables.addVariable(state_var)
+    workflow.variables.setStateVar(state_var)
+    for state_id, exits in states:
+        workflow.states.addState(state_id)
+        workflow.states[state_id].setProperties(title=state_id, transitions=exits)
+    workflow.states.setInitialState(states[0][0])
+    for transition_id, new_state, trigger_type, expr in transitions:
+        workflow.transitions.addTransition(transition_id)
+        props = expr and {'guard_expr': expr} or None
+        workflow.transitions[transition_id].setProperties(
+            title=transition_id, new_state_id=new_state, trigger_type=trigger_type,
+            actbox_name=transition_id, props=props)
+    return workflow
+
+def buildSite(app, options):
+    """Create the benchmark site, and return the paths of its documents
+    """
+    from Products.CMFPlone.factory import addPloneSite
+
+    site = addPloneSite(app, SITE_ID, setup_content=False)
+    setSite(site)
+    wtool = site.portal_workflow
+    catalog = site.portal_catalog
+
+    automatic = options.automatic
+    addWorkflow(wtool, 'bench_review', 'review_state',
+                [('private', ('submit',)),
+                 ('pending', automatic and ('publish', 'auto_publish',) or ('publish',)),
+                 ('published', ('retract',))],
+                [('submit', 'pending', TRIGGER_USER_ACTION, None),
+                 ('publish', 'published', TRIGGER_USER_ACTION, None),
+                 ('retract', 'private', TRIGGER_USER_ACTION, None)] +
+                (automatic and [('auto_publish', 'published', TRIGGER_AUTOMATIC,
+                                 "python:object.getId().endswith('0')")] or []))
+
+    # Further workflows in the chain follow the review state automatically
+    chain = ['bench_review']
+    for index in range(1, options.chain):
+        workflow_id = 'bench_chain_%d' % index
+        state_var = 'bench_state_%d' % index
+        is_published = "python:object.portal_workflow.getInfoFor(object, 'review_state') == 'published'"
+        addWorkflow(wtool, workflow_id, state_var,
+                    [('idle', ('activate',)), ('active', ('deactivate',))],
+                    automatic and [('activate', 'active', TRIGGER_AUTOMATIC, is_published),
+                                   ('deactivate', 'idle', TRIGGER_AUTOMATIC, 'not:%s' % is_published)] or [])
+        catalog.addIndex(state_var, 'FieldIndex')
+        chain.append(workflow_id)
+
+    # Folders are busy while they have published children
+    addWorkflow(wtool, 'bench_folder', 'review_state',
+                [('quiet', ('wake',)), ('busy', ('sleep',))],
+                automatic and [('wake', 'busy', TRIGGER_AUTOMATIC, PUBLISHED_CHILDREN),
+                               ('sleep', 'quiet', TRIGGER_AUTOMATIC, 'not:%s' % PUBLISHED_CHILDREN)] or [])
+
+    wtool.setChainForPortalTypes(('Document',), chain)
+    wtool.setChainForPortalTypes(('Folder',), ('bench_folder',))
+
+    paths = []
+    def fill(folder, depth):
+        for index in range(options.documents):
+            document_id = 'doc%d' % index
+            folder.invokeFactory('Document', document_id)
+            paths.append('/'.join(folder[document_id].getPhysicalPath()))
+        if depth < options.depth:
+            for index in range(options.breadth):
+                folder_id = 'folder%d' % index
+                folder.invokeFactory('Folder', folder_id)
+                fill(folder[folder_id], depth + 1)
+    fill(site, 0)
+
+    transaction.commit()
+    return paths
+
+class Results(object):
+    """Counters shared by the worker threads and the handlers
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.handler_time = 0.0
+        self.handler_calls = 0
+        self.automatic = 0
+        self.conflicts = 0
+        self.failed = 0
+
+    def add(self, **kw):
+        self.lock.acquire()
+        try:
+            for name, value in kw.items():
+                setattr(self, name, getattr(self, name) + value)
+        finally:
+            self.lock.release()
+
+def timed(handler, results):
+    def wrapper(ob, event):
+        started = time.time()
+        try:
+            handler(ob, event)
+        finally:
+            results.add(handler_time=time.time() - started, handler_calls=1)
+    return wrapper
+
+def countAutomatic(results):
+    def handler(ob, event):
+        if event.transition is not None and event.transition.trigger_type == TRIGGER_AUTOMATIC:
+            results.add(automatic=1)
+    return handler
+
+def worker(db, paths, options, results, index):
+    rnd = random.Random(options.seed + index)
+    connection = db.open()
+    try:
+        app = makerequest(connection.root()['Application'])
+        newSecurityManager(None, system)
+        site = app[SITE_ID]
+        setSite(site)
+        wtool = site.portal_workflow
+        for count in range(options.operations):
+            path = rnd.choice(paths)
+            for attempt in range(4):
+                started = time.time()
+                try:
+                    ob = app.unrestrictedTraverse(path)
+                    state = wtool.getInfoFor(ob, 'review_state')
+                    wtool.doActionFor(ob, NEXT_TRANSITION[state])
+                    transaction.commit()
+                    results.add(latencies=[time.time() - started])
+                    break
+                except ConflictError:
+                    transaction.abort()
+                    results.add(conflicts=1)
+            else:
+                results.add(failed=1)
+    finally:
+        transaction.abort()
+        setSite(None)
+        noSecurityManager()
+        connection.close()
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def run(app, options):
+    """Build the site, run the workers, and return a dict of results
+    """
+    db = DB(DemoStorage(name='wtf-benchmark', base=app._p_jar.db().storage))
+    results = Results()
+    handlers = [(timed(trigger_automatic_transitions, results), (Interface, IActionSucceededEvent),),
+                (countAutomatic(results), (Interface, IAfterTransitionEvent),)]
+    if options.parent:
+        handlers.append((timed(trigger_automatic_transitions_in_parent, results),
+                         (Interface, IActionSucceededEvent),))
+    gsm = getGlobalSiteManager()
+    try:
+        connection = db.open()
+        try:
+            setup_app = makerequest(connection.root()['Application'])
+            newSecurityManager(None, system)
+            paths = buildSite(setup_app, options)
+        finally:
+            transaction.abort()
+            setSite(None)
+            noSecurityManager()
+            connection.close()
+
+        for handler, required in handlers:
+            gsm.registerHandler(handler, required)
+        clear_chain_cache()
+        stats = dict(reindex._stats)
+
+        threads = []
+        for index in range(options.threads):
+            if options.partition:
+                thread_paths = paths[index::options.threads] or paths
+            else:
+                thread_paths = paths
+            threads.append(threading.Thread(target=worker,
+                                            args=(db, thread_paths, options, results, index,)))
+        started = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - started
+    finally:
+        for handler, required in handlers:
+            gsm.unregisterHandler(handler, required)
+        clear_chain_cache()
+        db.close()
+
+    latencies = sorted(results.latencies)
+    committed = len(latencies)
+    attempts = committed + results.conflicts
+    return {'objects': len(paths),
+            'transitions': committed,
+            'failed': results.failed,
+            'seconds': elapsed,
+            'throughput': elapsed and committed / elapsed or 0.0,
+            'latency_p50': percentile(latencies, 0.5),
+            'latency_p90': percentile(latencies, 0.9),
+            'latency_p99': percentile(latencies, 0.99),
+            'latency_max': latencies and latencies[-1] or 0.0,
+            'handler_calls': results.handler_calls,
+            'handler_time': results.handler_time,
+            'handler_time_per_call': results.handler_calls and results.handler_time / results.handler_calls or 0.0,
+            'automatic_transitions': results.automatic,
+            'reindex_queued': reindex._stats['queued'] - stats['queued'],
+            'reindex_merged': reindex._stats['merged'] - stats['merged'],
+            'reindexed': reindex._stats['reindexed'] - stats['reindexed'],
+            'conflicts': results.conflicts,
+            'conflict_rate': attempts and float(results.conflicts) / attempts or 0.0,
+            }
+
+# Metrics for which a lower value is better, for the comparison
+LOWER_IS_BETTER = ('seconds', 'latency_p50', 'latency_p90', 'latency_p99', 'latency_max',
+                   'handler_time', 'handler_time_per_call', 'reindexed', 'conflicts',
+                   'conflict_rate', 'failed',)
+
+def formatResults(results, baseline=None):
+    """Return a plain-text version of the results, compared to the baseline
+    results if given.
+    """
+    lines = []
+    for name in sorted(results.keys()):
+        value = results[name]
+        line = "%-24s %14.4f" % (name, value,)
+        if baseline is not None and name in baseline:
+            old = baseline[name]
+            change = old and (value - old) * 100.0 / old or 0.0
+            better = (change < 0) == (name in LOWER_IS_BETTER)
+            line += "  baseline %14.4f  %+7.1f%%%s" % (old, change,
+                                                       change and not better and ' (worse)' or '',)
+        lines.append(line)
+    return '\n'.join(lines)
+
+def main(app, argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    options = parseOptions(argv)
+
+    results = run(app, options)
+    results['options'] = dict([(k, v,) for k, v in vars(options).items()
+                                    if k not in ('save', 'compare',)])
+
+    baseline = None
+    if options.compare:
+        baseline = json.load(open(options.compare))
+        if baseline.get('options') != results['options']:
+            print "Warning: the baseline was recorded with different options"
+
+    print formatResults(dict([(k, v,) for k, v in results.items() if k != 'options']), baseline)
+
+    if options.save:
+        out = open(options.save, 'w')
+        json.dump(results, out, indent=2, sort_keys=True)
+        out.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(app)) # 'app' is provided by 'bin/instance run'
@@ -0,0 +1,452 @@
+import tarfile
+import zipfile
+try:
+    import json
+except ImportError:
+    import simplejson as json
+from StringIO import StringIO
+
+try:
+    from hashlib import md5
+except ImportError: # Python 2.4
+    from md5 import new as md5
+
+import transaction
+from BTrees.OOBTree import OOBTree
+
+from zope.component import getMultiAdapter
+
+from App.Common import rfc1123_date
+
+from Products.PloneTestCase.PloneTestCase import PloneTestCase
+from Testing.ZopeTestCase.sandbox import Sandboxed
+
+from collective.wtf.api import exportWorkflowInfo
+from collective.wtf.exportimport import readManifest
+from collective.wtf.jobs import ROOT_KEY
+
+from collective.wtf.tests.test_exportimport import GSLayer
+from collective.wtf.tests.test_plan import PROFILE_ID
+from collective.wtf.tests.test_plan import changeThroughZMI
+
+class BrowserTestCase(PloneTestCase):
+
+    layer = GSLayer
+
+    def afterSetUp(self):
+        self.setRoles(['Manager'])
+        self.written = []
+
+    def call(self, context, name, **headers):
+        """Call the named view on context, with the given request headers.
+        Returns the response and the body, streamed or returned.
+        """
+        request = self.app.REQUEST
+        response = request.response
+        response.setStatus(200)
+        response.headers.clear()
+        response.write = self.written.append
+        del self.written[:]
+        for key in ('HTTP_IF_NONE_MATCH', 'HTTP_IF_MODIFIED_SINCE',):
+            request.environ.pop(key, None)
+        for key, value in headers.items():
+            request.environ[key] = value
+        view = getMultiAdapter((context, request), name=name)
+        body = view()
+        return response, ''.join(self.written) + (body or '')
+
+class TestWorkflowArchive(Sandboxed, BrowserTestCase):
+
+    def test_zip(self):
+        wtool = self.portal.portal_workflow
+        response, body = self.call(wtool, 'workflow-archive')
+        self.assertEquals(200, response.getStatus())
+        self.assertEquals('application/zip', response.getHeader('Content-Type'))
+
+        archive = zipfile.ZipFile(StringIO(body))
+        self.assertEquals(None, archive.testzip())
+        names = archive.namelist()
+        self.failUnless('test_wf.csv' in names, names)
+        self.assertEquals('manifest.txt', names[-1])
+
+        csv = archive.read('test_wf.csv')
+        self.failUnless(csv.startswith('[Workflow]'), csv)
+        manifest = readManifest(archive.read('manifest.txt'))
+        self.assertEquals((md5(csv).hexdigest(), len(csv),), manifest['test_wf'][1:])
+        self.assertEquals(sorted([n[:-4] for n in names[:-1]]), sorted(manifest.keys()))
+
+    def test_tar(self):
+        wtool = self.portal.portal_workflow
+        self.app.REQUEST.set('format', 'tar')
+        response, body = self.call(wtool, 'workflow-archive')
+        self.assertEquals('application/x-tar', response.getHeader('Content-Type'))
+
+        archive = tarfile.open(fileobj=StringIO(body))
+        self.failUnless('test_wf.csv' in archive.getnames())
+        self.failUnless(archive.extractfile('test_wf.csv').read().startswith('[Workflow]'))
+
+    def test_not_modified(self):
+        wtool = self.portal.portal_workflow
+        response, body = self.call(wtool, 'workflow-archive')
+        etag = response.getHeader('ETag')
+        self.failUnless(etag.startswith('W/"'), etag)
+
+        response, body = self.call(wtool, 'workflow-archive', HTTP_IF_NONE_MATCH='"other", %s' % etag)
+        self.assertEquals(304, response.getStatus())
+        self.assertEquals('', body)
+
+        # Changing a workflow changes the ETag
+        wtool.test_wf.states.state_one.title = 'Changed'
+        response, body = self.call(wtool, 'workflow-archive', HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(200, response.getStatus())
+        self.failIf(response.getHeader('ETag') == etag)
+        self.failUnless(body)
+
+    def test_committed_change(self):
+        wtool = self.portal.portal_workflow
+        response, body = self.call(wtool, 'workflow-archive')
+        etag = response.getHeader('ETag')
+        response, body = self.call(wtool, 'workflow-archive', HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(304, response.getStatus())
+
+        # The fingerprints are cached until a workflow changes, down to
+        # the guards of its transitions
+        wtool.test_wf.transitions.to_state_two.guard.roles = ('Reviewer',)
+        transaction.commit()
+        response, body = self.call(wtool, 'workflow-archive', HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(200, response.getStatus())
+        self.failIf(response.getHeader('ETag') == etag)
+
+class TestToCSV(Sandboxed, BrowserTestCase):
+
+    def afterSetUp(self):
+        BrowserTestCase.afterSetUp(self)
+        # Make sure the workflow has a committed serial
+        self.portal.portal_workflow.test_wf._p_changed = True
+        transaction.commit()
+
+    def test_etag(self):
+        wf = self.portal.portal_workflow.test_wf
+        response, body = self.call(wf, 'to-csv')
+        etag = response.getHeader('ETag')
+        self.failUnless(etag, response.headers)
+        self.failUnless(body.startswith('[Workflow]'), body)
+
+        response, body = self.call(wf, 'to-csv', HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(304, response.getStatus())
+        self.assertEquals('', body)
+
+        response, body = self.call(wf, 'to-csv', HTTP_IF_NONE_MATCH='"other"')
+        self.assertEquals(200, response.getStatus())
+
+        # A change through the ZMI, not yet committed: no caching at all
+        wf.states.state_one.title = 'Changed'
+        response, body = self.call(wf, 'to-csv', HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(200, response.getStatus())
+        self.assertEquals(None, response.getHeader('ETag'))
+        self.failUnless('Title:,Changed' in body)
+
+        # Once committed, there is a new ETag
+        transaction.commit()
+        response, body = self.call(wf, 'to-csv', HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(200, response.getStatus())
+        self.failUnless('Title:,Changed' in body)
+        new_etag = response.getHeader('ETag')
+        self.failUnless(new_etag and new_etag != etag, new_etag)
+
+        response, body = self.call(wf, 'to-csv', HTTP_IF_NONE_MATCH=new_etag)
+        self.assertEquals(304, response.getStatus())
+
+    def test_permission_change(self):
+        wf = self.portal.portal_workflow.test_wf
+        response, body = self.call(wf, 'to-csv')
+        etag = response.getHeader('ETag')
+
+        # A change deep inside a state, committed
+        wf.states.state_one.setPermission('View', 0, ['Manager'])
+        transaction.commit()
+        response, changed = self.call(wf, 'to-csv', HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(200, response.getStatus())
+        self.failIf(response.getHeader('ETag') == etag)
+        self.failIf(changed == body)
+
+        response, body = self.call(wf, 'to-csv', HTTP_IF_NONE_MATCH=response.getHeader('ETag'))
+        self.assertEquals(304, response.getStatus())
+
+    def test_if_modified_since(self):
+        wf = self.portal.portal_workflow.test_wf
+        response, body = self.call(wf, 'to-csv')
+        last_modified = response.getHeader('Last-Modified')
+        self.failUnless(last_modified, response.headers)
+
+        response, body = self.call(wf, 'to-csv', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEquals(304, response.getStatus())
+        self.assertEquals('', body)
+
+        # With the length parameter some browsers add
+        response, body = self.call(wf, 'to-csv', HTTP_IF_MODIFIED_SINCE='%s; length=100' % last_modified)
+        self.assertEquals(304, response.getStatus())
+
+        response, body = self.call(wf, 'to-csv', HTTP_IF_MODIFIED_SINCE=rfc1123_date(0))
+        self.assertEquals(200, response.getStatus())
+        self.failUnless(body.startswith('[Workflow]'), body)
+
+        response, body = self.call(wf, 'to-csv', HTTP_IF_MODIFIED_SINCE='garbage')
+        self.assertEquals(200, response.getStatus())
+
+class TestWorkflowCensus(BrowserTestCase):
+
+    def test_text(self):
+        wtool = self.portal.portal_workflow
+        response, body = self.call(wtool, 'workflow-census')
+        self.failUnless(body.startswith('Workflow census'), body)
+        self.failUnless('test_wf (Test workflow) [CSV]' in body, body)
+        self.failUnless('The state variable defaults_to_review_state_but_here_is_another_one is not indexed.' in body, body)
+
+        workflow_id = wtool.getChainForPortalType('Document')[0]
+        self.failUnless('\n%s (' % workflow_id in body, body)
+
+    def test_json(self):
+        wtool = self.portal.portal_workflow
+        self.app.REQUEST.set('format', 'json')
+        response, body = self.call(wtool, 'workflow-census')
+        self.assertEquals('application/json', response.getHeader('Content-Type'))
+        census = json.loads(body)
+        self.assertEquals(sorted(wtool.objectIds()), sorted(census.keys()))
+        self.assertEquals(None, census['test_wf']['states'])
+
+    def test_csv_only(self):
+        wtool = self.portal.portal_workflow
+        self.app.REQUEST.set('format', 'json')
+        self.app.REQUEST.set('csv_only', '1')
+        response, body = self.call(wtool, 'workflow-census')
+        self.assertEquals(['test_wf'], json.loads(body).keys())
+
+class TestWorkflowHistoryExport(BrowserTestCase):
+
+    def afterSetUp(self):
+        BrowserTestCase.afterSetUp(self)
+        self.folder.invokeFactory('Document', 'doc')
+        self.workflow_id = self.portal.portal_workflow.getChainFor(self.folder.doc)[0]
+        self.app.REQUEST.set('workflow', self.workflow_id)
+        self.app.REQUEST.set('path', '/'.join(self.folder.getPhysicalPath()))
+
+    def test_export(self):
+        response, body = self.call(self.portal.portal_workflow, 'workflow-history-export')
+        self.assertEquals('text/csv', response.getHeader('Content-Type'))
+        rows = body.splitlines()
+        self.failUnless(rows[0].startswith('path,portal_type,workflow,'), rows)
+        path = '/'.join(self.folder.doc.getPhysicalPath())
+        self.failUnless([r for r in rows if r.startswith('%s,Document,%s,' % (path, self.workflow_id,))], rows)
+
+    def test_chunk_size(self):
+        response, expected = self.call(self.portal.portal_workflow, 'workflow-history-export')
+        for chunk_size in ('0', '-5', 'many', '',):
+            self.app.REQUEST.set('chunk_size', chunk_size)
+            response, body = self.call(self.portal.portal_workflow, 'workflow-history-export')
+            self.assertEquals(200, response.getStatus())
+            self.assertEquals(expected, body)
+
+class TestImportPlan(BrowserTestCase):
+
+    def test_usage(self):
+        response, body = self.call(self.portal.portal_setup, 'workflow-csv-plan')
+        self.failUnless('?profile_id=profile-<name>' in body, body)
+
+    def test_plan(self):
+        changeThroughZMI(self.portal.portal_workflow.test_wf)
+        self.app.REQUEST.set('profile_id', PROFILE_ID)
+        response, body = self.call(self.portal.portal_setup, 'workflow-csv-plan')
+        lines = body.splitlines()
+        self.assertEquals('Import plan for profile: %s' % PROFILE_ID, lines[0])
+        self.failUnless([l for l in lines if l.startswith('Workflow test_wf (') and l.endswith('): update')], body)
+        for line in ('  States added: state_three',
+                     '  States only in the live workflow (left in place): extra',
+                     '  Transitions added: to_state_three',
+                     '  Transitions only in the live workflow (left in place): extra_transition',
+                     '  Transition changed: to_state_two (title)',):
+            self.failUnless(line in lines, body)
+        self.failUnless([l for l in lines if l.startswith('  State changed: state_one (')], body)
+        self.failUnless('Total objects needing role mapping updates: 0' in lines, body)
+
+    def test_json(self):
+        changeThroughZMI(self.portal.portal_workflow.test_wf)
+        self.app.REQUEST.set('profile_id', PROFILE_ID)
+        self.app.REQUEST.set('format', 'json')
+        response, body = self.call(self.portal.portal_setup, 'workflow-csv-plan')
+        self.assertEquals('application/json', response.getHeader('Content-Type'))
+        plan = dict([(e['workflow'], e,) for e in json.loads(body)])
+        self.assertEquals(['state_three'], plan['test_wf']['diff']['states_added'])
+
+class TestWorkflowDrift(BrowserTestCase):
+
+    def afterSetUp(self):
+        BrowserTestCase.afterSetUp(self)
+        self.app.REQUEST.set('profile_id', PROFILE_ID)
+        self.site_path = '/'.join(self.portal.getPhysicalPath())
+
+    def test_none(self):
+        response, body = self.call(self.portal.portal_setup, 'workflow-csv-drift')
+        self.failUnless('1 sites checked, 0 workflows drifted.' in body, body)
+
+    def test_drifted(self):
+        changeThroughZMI(self.portal.portal_workflow.test_wf)
+        response, body = self.call(self.portal.portal_setup, 'workflow-csv-drift')
+        lines = body.splitlines()
+        self.failUnless([l for l in lines if l.startswith('%s: test_wf changed (expected ' % self.site_path)], body)
+        self.failUnless('1 sites checked, 1 workflows drifted.' in lines, body)
+
+        self.app.REQUEST.set('format', 'json')
+        response, body = self.call(self.portal.portal_setup, 'workflow-csv-drift')
+        drifted = json.loads(body)
+        self.assertEquals([self.site_path], drifted.keys())
+        self.assertEquals(['test_wf'], [e['workflow'] for e in drifted[self.site_path]])
+
+    def test_diff(self):
+        changeThroughZMI(self.portal.portal_workflow.test_wf)
+        self.app.REQUEST.set('workflow', 'test_wf')
+        response, body = self.call(self.portal.portal_setup, 'workflow-csv-drift')
+        lines = body.splitlines()
+        self.failUnless(lines[0].startswith('Workflow test_wf in %s' % self.site_path), body)
+        self.failUnless('  States only in the profile: state_three' in lines, body)
+        self.failUnless('  States only in the live workflow: extra' in lines, body)
+        self.failUnless('  Transition changed: to_state_two (title)' in lines, body)
+
+    def test_root(self):
+        # On the Zope root, all sites are checked
+        changeThroughZMI(self.portal.portal_workflow.test_wf)
+        response, body = self.call(self.app, 'workflow-csv-drift')
+        self.failUnless([l for l in body.splitlines() if l.startswith('%s: test_wf changed' % self.site_path)], body)
+
+    def test_root_diff(self):
+        self.app.REQUEST.set('workflow', 'test_wf')
+        self.app.REQUEST.set('site', self.site_path)
+        response, body = self.call(self.app, 'workflow-csv-drift')
+        self.failUnless('  No differences.' in body.splitlines(), body)
+
+class TestWorkflowInfo(BrowserTestCase):
+
+    def post(self, data, **form):
+        request = self.app.REQUEST
+        request.set('REQUEST_METHOD', 'POST')
+        request.set('BODY', isinstance(data, basestring) and data or json.dumps(data))
+        for key, value in form.items():
+            request.set(key, value)
+        response, body = self.call(self.portal.portal_workflow, 'workflow-info')
+        return response.getStatus(), json.loads(body)
+
+    def copy(self, **kw):
+        info = exportWorkflowInfo(self.portal.portal_workflow.test_wf)
+        info.update(id='test_wf_copy', title='Copy')
+        info.update(kw)
+        return info
+
+    def test_get(self):
+        wtool = self.portal.portal_workflow
+        response, body = self.call(wtool, 'workflow-info')
+        self.assertEquals('application/json', response.getHeader('Content-Type'))
+        workflows = json.loads(body)['workflows']
+        self.assertEquals(sorted(wtool.objectIds()), sorted([w['id'] for w in workflows]))
+
+        self.app.REQUEST.set('ids', 'test_wf, no_such_workflow')
+        response, body = self.call(wtool, 'workflow-info')
+        workflows = json.loads(body)['workflows']
+        self.assertEquals(['test_wf'], [w['id'] for w in workflows])
+        self.assertEquals('Test workflow', workflows[0]['title'])
+
+    def test_import(self):
+        status, result = self.post({'workflows': [self.copy()]})
+        self.assertEquals(200, status)
+        self.assertEquals({'errors': {}, 'results': [['test_wf_copy', 'imported']]}, result)
+        copy = self.portal.portal_workflow.test_wf_copy
+        self.assertEquals('Copy', copy.title)
+        self.assertEquals('State one', copy.states.state_one.title)
+
+    def test_validate(self):
+        status, result = self.post(self.copy(), validate='1')
+        self.assertEquals((200, {},), (status, result['errors'],))
+
+        status, result = self.post(self.copy(initial_state='nowhere'), validate='1')
+        self.assertEquals(400, status)
+        self.assertEquals(['test_wf_copy'], result['errors'].keys())
+        self.failIf('test_wf_copy' in self.portal.portal_workflow.objectIds())
+
+    def test_invalid(self):
+        status, result = self.post('{"workflows": [')
+        self.assertEquals(400, status)
+        self.failUnless(result['errors'][''][0].startswith('Invalid JSON'), result)
+
+        status, result = self.post({'workflows': [self.copy(), {'id': 'broken_wf'}]})
+        self.assertEquals(400, status)
+        self.assertEquals(['broken_wf'], result['errors'].keys())
+        self.assertEquals([], result['results'])
+        self.failIf('test_wf_copy' in self.portal.portal_workflow.objectIds())
+
+    def test_python_script(self):
+        script = {'id': 'a_script', 'meta_type': 'Script (Python)', 'filename': 'a_script.py'}
+        info = self.copy()
+        info['script_info'] = list(info['script_info']) + [script]
+        status, result = self.post(info)
+        self.assertEquals(400, status)
+        messages = result['errors']['test_wf_copy']
+        self.failUnless([m for m in messages if "'Script (Python)'" in m], messages)
+        self.failIf('test_wf_copy' in self.portal.portal_workflow.objectIds())
+
+class TestImportJobs(BrowserTestCase):
+
+    def afterSetUp(self):
+        BrowserTestCase.afterSetUp(self)
+        self.site_path = '/'.join(self.portal.getPhysicalPath())
+        self.root = self.portal._p_jar.root()
+        self.root[ROOT_KEY] = jobs = OOBTree()
+        for job_id in ('%s profile-collective.wtf:testing 2026-01-01 10:00:00' % self.site_path,
+                       '%s history 2026-01-02 10:00:00' % self.site_path,
+                       '/other profile-collective.wtf:testing 2026-01-03 10:00:00',):
+            jobs[job_id] = {'id': job_id, 'status': 'done', 'phase': None, 'steps': ['one'],
+                            'done': 1, 'counts': {}, 'timings': [], 'started': 1.0,
+                            'finished': 2.0, 'error': None}
+
+    def test_listing(self):
+        response, body = self.call(self.portal.portal_setup, 'workflow-csv-jobs')
+        self.failUnless('profile-collective.wtf:testing 2026-01-01' in body, body)
+        self.failIf('history' in body, body)
+        self.failIf('/other' in body, body)
+
+        # History jobs can still be polled
+        job_id = '%s history 2026-01-02 10:00:00' % self.site_path
+        self.app.REQUEST.set('job_id', job_id)
+        response, body = self.call(self.portal.portal_setup, 'workflow-csv-jobs')
+        self.failUnless(body.startswith('Job: %s' % job_id), body)
+
+    def test_redirect(self):
+        from collective.wtf.browser import jobs
+        started = []
+        def startCSVImport(site, profile_id, job_id):
+            started.append(profile_id)
+            return '%s %s 2026-01-01 10:00:00' % (self.site_path, profile_id,)
+        original = jobs.startCSVImport
+        jobs.startCSVImport = startCSVImport
+        try:
+            self.app.REQUEST.set('REQUEST_METHOD', 'POST')
+            self.app.REQUEST.set('profile_id', 'profile-collective.wtf:testing')
+            response, body = self.call(self.portal.portal_setup, 'workflow-csv-jobs')
+        finally:
+            jobs.startCSVImport = original
+        self.assertEquals(['profile-collective.wtf:testing'], started)
+        self.assertEquals(302, response.getStatus())
+        location = response.getHeader('Location')
+        self.failUnless(location.endswith('?job_id=%s%%20profile-collective.wtf%%3Atesting%%202026-01-01%%2010%%3A00%%3A00'
+                                          % self.site_path), location)
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestWorkflowArchive))
+    suite.addTest(makeSuite(TestToCSV))
+    suite.addTest(makeSuite(TestWorkflowCensus))
+    suite.addTest(makeSuite(TestWorkflowHistoryExport))
+    suite.addTest(makeSuite(TestImportPlan))
+    suite.addTest(makeSuite(TestWorkflowDrift))
+    suite.addTest(makeSuite(TestWorkflowInfo))
+    suite.addTest(makeSuite(TestImportJobs))
+    return suite
@@ -0,0 +1,172 @@
+import unittest
+
+import transaction
+from ZODB.POSException import ConflictError
+
+from zope.component import getGlobalSiteManager
+
+from Products.CMFCore.interfaces import IActionSucceededEvent
+from Products.DCWorkflow.Transitions import TRIGGER_AUTOMATIC
+from Products.ATContentTypes.interfaces import IATDocument
+
+from Products.PloneTestCase.PloneTestCase import PloneTestCase
+from Testing.ZopeTestCase.sandbox import Sandboxed
+
+from collective.wtf.bulk import BulkTransition
+from collective.wtf.utils import defer_automatic_transitions
+from collective.wtf.utils import flush_automatic_transitions
+from collective.wtf.utils import trigger_automatic_transitions
+from collective.wtf.utils import trigger_automatic_transitions_in_parent
+
+from collective.wtf.tests.test_exportimport import ZCMLLayer
+
+class Flaky(BulkTransition):
+    """Raises a ConflictError after processing the first chunk, once
+    """
+
+    conflicts = 1
+
+    def _processChunk(self, chunk, counts, failed):
+        BulkTransition._processChunk(self, chunk, counts, failed)
+        if self.conflicts:
+            self.conflicts -= 1
+            raise ConflictError()
+
+class Interrupted(BulkTransition):
+    """Stops with an error before the chunk starting at 'stop'
+    """
+
+    def _processChunk(self, chunk, counts, failed):
+        if chunk[0] == self.stop:
+            raise ValueError("Interrupted")
+        BulkTransition._processChunk(self, chunk, counts, failed)
+
+class TestDeferral(unittest.TestCase):
+
+    def tearDown(self):
+        flush_automatic_transitions()
+
+    def test_nested(self):
+        defer_automatic_transitions()
+        defer_automatic_transitions()
+        trigger_automatic_transitions(DummyContent('/one'))
+        self.assertEquals({}, flush_automatic_transitions())
+
+        # still deferred for the outer call
+        trigger_automatic_transitions(DummyContent('/two'))
+        self.assertEquals(['/one', '/two'], sorted(flush_automatic_transitions().keys()))
+        self.assertEquals({}, flush_automatic_transitions())
+
+class DummyContent(object):
+
+    def __init__(self, path):
+        self.path = path
+
+    def getPhysicalPath(self):
+        return tuple(self.path.split('/'))
+
+class TestBulkTransition(Sandboxed, PloneTestCase):
+
+    layer = ZCMLLayer
+
+    def afterSetUp(self):
+        self.setRoles(['Manager'])
+        self.folder.invokeFactory('Folder', 'stuff')
+        for id in ('a', 'b', 'c',):
+            self.folder.stuff.invokeFactory('Document', id)
+        transaction.commit()
+
+    def paths(self):
+        return ['/'.join(self.folder.stuff[id].getPhysicalPath()) for id in ('a', 'b', 'c',)]
+
+    def states(self):
+        wtool = self.portal.portal_workflow
+        return [wtool.getInfoFor(self.folder.stuff[id], 'review_state') for id in ('a', 'b', 'c',)]
+
+    def catalogStates(self):
+        catalog = self.portal.portal_catalog
+        return [catalog(path={'query': path, 'depth': 0})[0].review_state for path in self.paths()]
+
+    def test_run(self):
+        report = BulkTransition(self.portal, 'publish', paths=self.paths(), chunk_size=2).run()
+        self.assertEquals(3, report['transitioned'])
+        self.assertEquals(0, report['skipped'])
+        self.assertEquals(3, report['position'])
+        self.assertEquals(['published'] * 3, self.states())
+        self.assertEquals(['published'] * 3, self.catalogStates())
+
+        # Running again skips everything
+        query = {'path': '/'.join(self.folder.stuff.getPhysicalPath()), 'portal_type': 'Document'}
+        report = BulkTransition(self.portal, 'publish', query=query).run()
+        self.assertEquals(0, report['transitioned'])
+        self.assertEquals(3, report['skipped'])
+
+    def test_resume(self):
+        paths = self.paths()
+        bulk = Interrupted(self.portal, 'publish', paths=paths, chunk_size=1)
+        bulk.stop = paths[1]
+        self.assertRaises(ValueError, bulk.run)
+        transaction.abort()
+
+        # The first chunk was committed
+        self.assertEquals(['published', 'private', 'private'], self.states())
+
+        report = BulkTransition(self.portal, 'publish', paths=paths, chunk_size=1).run(start=1)
+        self.assertEquals(1, report['start'])
+        self.assertEquals(2, report['transitioned'])
+        self.assertEquals(3, report['position'])
+        self.assertEquals(['published'] * 3, self.states())
+
+    def test_conflict_retry(self):
+        report = Flaky(self.portal, 'publish', paths=self.paths(), chunk_size=2).run()
+        self.assertEquals(1, report['conflicts'])
+        # The aborted attempt is not counted
+        self.assertEquals(3, report['transitioned'])
+        self.assertEquals(0, report['skipped'])
+        self.assertEquals(['published'] * 3, self.states())
+
+        # Out of retries
+        bulk = Flaky(self.portal, 'retract', paths=self.paths())
+        bulk.retries = 0
+        self.assertRaises(ConflictError, bulk.run)
+
+    def test_failure(self):
+        paths = self.paths()
+        paths.insert(1, paths[0] + '-missing')
+        report = BulkTransition(self.portal, 'publish', paths=paths).run()
+        self.assertEquals(3, report['transitioned'])
+        self.assertEquals([paths[1]], [path for path, error in report['failed']])
+
+    def test_automatic_after_chunk(self):
+        # Publish the folder automatically once all of its documents are
+        wtool = self.portal.portal_workflow
+        workflow = wtool.getWorkflowById(wtool.getChainFor(self.folder.stuff)[0])
+        workflow.transitions.addTransition('publish_folder')
+        workflow.transitions.publish_folder.setProperties(
+            title='', new_state_id='published', trigger_type=TRIGGER_AUTOMATIC,
+            props={'guard_expr': "python:here.portal_type == 'Folder' and not "
+                                 "[o for o in here.objectValues() if "
+                                 "o.portal_workflow.getInfoFor(o, 'review_state') != 'published']"})
+        state = workflow.states[wtool.getInfoFor(self.folder.stuff, 'review_state')]
+        state.transitions = state.transitions + ('publish_folder',)
+        transaction.commit()
+
+        sm = getGlobalSiteManager()
+        sm.registerHandler(trigger_automatic_transitions_in_parent, (IATDocument, IActionSucceededEvent,))
+        try:
+            report = BulkTransition(self.portal, 'publish', paths=self.paths(), chunk_size=2).run()
+        finally:
+            sm.unregisterHandler(trigger_automatic_transitions_in_parent, (IATDocument, IActionSucceededEvent,))
+
+        # The folder was collected in both chunks, but only moved in the last
+        self.assertEquals(1, report['automatic'])
+        self.assertEquals('published', wtool.getInfoFor(self.folder.stuff, 'review_state'))
+        path = '/'.join(self.folder.stuff.getPhysicalPath())
+        self.assertEquals('published', self.portal.portal_catalog(path={'query': path, 'depth': 0})[0].review_state)
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestDeferral))
+    suite.addTest(makeSuite(TestBulkTransition))
+    return suite
@@ -0,0 +1,98 @@
+import unittest
+
+from Products.PloneTestCase.PloneTestCase import PloneTestCase
+
+from collective.wtf.census import countAffected
+from collective.wtf.census import getTypesByWorkflow
+from collective.wtf.census import takeCensus
+
+from collective.wtf.tests.test_exportimport import GSLayer
+
+class TestCountAffected(unittest.TestCase):
+
+    census = {'wf': {'state_variable': 'review_state',
+                     'title': 'Workflow',
+                     'total': 6,
+                     'states': {'private': {'Document': 2, 'Folder': 3},
+                                'published': {'Document': 1},
+                                'pending': {},
+                                },
+                     },
+              'unindexed': {'state_variable': 'other',
+                            'title': 'Unindexed',
+                            'total': None,
+                            'states': None,
+                            },
+              }
+
+    def test_count(self):
+        self.assertEquals({'private': 5, 'published': 1},
+                          countAffected(self.census, 'wf', ['private', 'published']))
+
+    def test_empty(self):
+        # States without objects and unknown states are left out
+        self.assertEquals({}, countAffected(self.census, 'wf', ['pending', 'missing']))
+        self.assertEquals({}, countAffected(self.census, 'unindexed', ['private']))
+        self.assertEquals({}, countAffected(self.census, 'missing', ['private']))
+
+class TestCensus(PloneTestCase):
+
+    layer = GSLayer
+
+    def afterSetUp(self):
+        self.setRoles(['Manager'])
+        self.wtool = self.portal.portal_workflow
+        self.workflow_id = self.wtool.getChainForPortalType('Document')[0]
+
+    def count(self, census, state_id):
+        states = census[self.workflow_id]['states']
+        return states.get(state_id, {}).get('Document', 0)
+
+    def test_types_by_workflow(self):
+        types = getTypesByWorkflow(self.portal)
+        self.failUnless('Document' in types[self.workflow_id])
+        self.failIf('test_wf' in types)
+
+    def test_census(self):
+        before = takeCensus(self.portal)
+        self.folder.invokeFactory('Document', 'one')
+        self.folder.invokeFactory('Document', 'two')
+        initial = self.wtool.getInfoFor(self.folder.one, 'review_state')
+        action = [t['id'] for t in self.wtool.getTransitionsFor(self.folder.two)][0]
+        self.wtool.doActionFor(self.folder.two, action)
+        changed = self.wtool.getInfoFor(self.folder.two, 'review_state')
+        self.failIf(initial == changed)
+
+        after = takeCensus(self.portal)
+        self.assertEquals(1, self.count(after, initial) - self.count(before, initial))
+        self.assertEquals(1, self.count(after, changed) - self.count(before, changed))
+        self.assertEquals(2, after[self.workflow_id]['total'] - before[self.workflow_id]['total'])
+
+        # The counts are those of the catalog
+        catalog = self.portal.portal_catalog
+        for state_id in (initial, changed,):
+            self.assertEquals(len(catalog(portal_type='Document', review_state=state_id)),
+                              self.count(after, state_id))
+
+    def test_unindexed(self):
+        census = takeCensus(self.portal, ['test_wf'])
+        self.assertEquals(['test_wf'], census.keys())
+        entry = census['test_wf']
+        self.assertEquals('defaults_to_review_state_but_here_is_another_one', entry['state_variable'])
+        self.assertEquals(None, entry['states'])
+        self.assertEquals(None, entry['total'])
+
+    def test_unbound(self):
+        # A workflow bound to no type has no objects in its states
+        self.wtool.test_wf.state_var = 'review_state'
+        entry = takeCensus(self.portal, ['test_wf'])['test_wf']
+        self.assertEquals(0, entry['total'])
+        self.assertEquals(sorted(self.wtool.test_wf.states.objectIds()), sorted(entry['states'].keys()))
+        self.failIf([s for s in entry['states'].values() if s])
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestCountAffected))
+    suite.addTest(makeSuite(TestCensus))
+    return suite
@@ -0,0 +1,117 @@
+import transaction
+
+from zope.component import getMultiAdapter
+
+from OFS.SimpleItem import SimpleItem
+
+from Products.GenericSetup.interfaces import IBody
+from Products.GenericSetup.context import SetupEnviron
+
+from Products.PloneTestCase.PloneTestCase import PloneTestCase
+from Testing.ZopeTestCase.sandbox import Sandboxed
+
+from collective.wtf import utils
+from collective.wtf.api import exportWorkflowInfo
+from collective.wtf.utils import get_workflow_chain
+
+from collective.wtf.tests.test_exportimport import GSLayer
+
+chains_xml = """\
+<?xml version="1.0"?>
+<object name="portal_workflow" meta_type="Plone Workflow Tool">
+ <bindings>
+  <type type_id="Document">
+   <bound-workflow workflow_id="test_wf"/>
+  </type>
+ </bindings>
+</object>
+"""
+
+class TestChainCache(Sandboxed, PloneTestCase):
+
+    layer = GSLayer
+
+    def afterSetUp(self):
+        self.setRoles(['Manager'])
+        self.folder.invokeFactory('Document', 'doc')
+        transaction.commit()
+        utils.clear_chain_cache()
+
+    def beforeTearDown(self):
+        utils.clear_chain_cache()
+
+    def poison(self):
+        """Replace the cached chain of documents with a bogus one, to tell
+        whether the cache is used
+        """
+        wtool = self.portal.portal_workflow
+        key = (wtool.getPhysicalPath(), 'Document',)
+        serials, chain = utils._chains[key]
+        utils._chains[key] = (serials, ('bogus',),)
+
+    def test_cached(self):
+        wtool = self.portal.portal_workflow
+        doc = self.folder.doc
+        self.assertEquals(tuple(wtool.getChainFor(doc)), get_workflow_chain(doc))
+        self.poison()
+        self.assertEquals(('bogus',), get_workflow_chain(doc, wtool))
+
+    def test_set_chain(self):
+        wtool = self.portal.portal_workflow
+        doc = self.folder.doc
+        get_workflow_chain(doc)
+        self.poison()
+
+        # Bypassed while the chains are being changed
+        wtool.setChainForPortalTypes(('Document',), ('test_wf',))
+        self.assertEquals(('test_wf',), get_workflow_chain(doc))
+
+        # Revalidated once the change is committed
+        transaction.commit()
+        self.assertEquals(('test_wf',), get_workflow_chain(doc))
+        self.poison()
+        self.assertEquals(('bogus',), get_workflow_chain(doc))
+
+        wtool.setChainForPortalTypes(('Document',), ('(Default)',))
+        transaction.commit()
+        self.assertEquals(tuple(wtool.getChainFor(doc)), get_workflow_chain(doc))
+        self.failIf('test_wf' in get_workflow_chain(doc))
+
+    def test_import_chains(self):
+        wtool = self.portal.portal_workflow
+        doc = self.folder.doc
+        get_workflow_chain(doc)
+        self.poison()
+
+        environ = SetupEnviron()
+        environ._should_purge = False
+        getMultiAdapter((wtool, environ), IBody).body = chains_xml
+        transaction.commit()
+        self.assertEquals(('test_wf',), get_workflow_chain(doc))
+
+    def test_import_workflow(self):
+        wtool = self.portal.portal_workflow
+        doc = self.folder.doc
+        get_workflow_chain(doc)
+        self.poison()
+
+        info = exportWorkflowInfo(wtool.test_wf)
+        handler = getMultiAdapter((wtool.test_wf, SetupEnviron()), IBody, name=u'collective.wtf')
+        handler.body = info
+        self.assertEquals({}, utils._chains)
+        self.assertEquals(tuple(wtool.getChainFor(doc)), get_workflow_chain(doc))
+
+    def test_placeful(self):
+        wtool = self.portal.portal_workflow
+        doc = self.folder.doc
+        get_workflow_chain(doc)
+        self.poison()
+
+        self.portal.portal_placeful_workflow = SimpleItem()
+        self.assertEquals(tuple(wtool.getChainFor(doc)), get_workflow_chain(doc))
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestChainCache))
+    return suite
@@ -0,0 +1,149 @@
+import copy
+import unittest
+from StringIO import StringIO
+
+from collective.wtf.compare import diffWorkflowInfo
+from collective.wtf.compare import hasChanges
+from collective.wtf.compare import fingerprintInfo
+from collective.wtf.deserializer import DefaultDeserializer
+from collective.wtf.serializer import DefaultSerializer
+from collective.wtf.flyweight import freezeInfo
+
+from collective.wtf.tests.test_parsing import ConfigLayer
+from collective.wtf.tests.test_parsing import plone_workflow_info
+from collective.wtf.tests.test_parsing import plone_workflow_csv
+
+class TestDiff(unittest.TestCase):
+    
+    layer = ConfigLayer
+    
+    def parse(self):
+        deserializer = DefaultDeserializer()
+        return deserializer(StringIO(plone_workflow_csv))
+    
+    def test_parsed_equals_live(self):
+        info = self.parse()
+        diff = diffWorkflowInfo(info, self.parse())
+        self.failIf(hasChanges(diff), diff)
+        
+        # The sample CSV names its worklist differently
+        diff = diffWorkflowInfo(plone_workflow_info, info)
+        self.assertEquals(['reviewer-tasks'], diff['worklists_added'])
+        self.assertEquals(['reviewer_queue'], diff['worklists_removed'])
+        del diff['worklists_added'], diff['worklists_removed']
+        self.failIf(hasChanges(diff), diff)
+    
+    def test_create(self):
+        diff = diffWorkflowInfo(None, self.parse())
+        self.assertEquals(['pending', 'private', 'published', 'visible'], diff['states_added'])
+        self.assertEquals(['pending', 'private', 'published', 'visible'], diff['permissions_changed'])
+        
+    def test_changes(self):
+        info = self.parse()
+        live_info = copy.deepcopy(plone_workflow_info)
+        
+        del live_info['state_info'][0] # pending
+        live_info['transition_info'].append(dict(live_info['transition_info'][0], id='obsolete'))
+        
+        published = [s for s in info['state_info'] if s['id'] == 'published'][0]
+        published['title'] = 'Live'
+        published['permissions'][0]['roles'] = ['Manager']
+        
+        diff = diffWorkflowInfo(live_info, info)
+        
+        self.assertEquals(['pending'], diff['states_added'])
+        self.assertEquals({'published': ['permissions', 'title']}, diff['states_changed'])
+        self.assertEquals(['obsolete'], diff['transitions_removed'])
+        self.assertEquals(['pending', 'published'], diff['permissions_changed'])
+        self.assertEquals([], diff['workflow'])
+
+class TestFingerprint(unittest.TestCase):
+    
+    layer = ConfigLayer
+    
+    def parse(self):
+        deserializer = DefaultDeserializer()
+        return deserializer(StringIO(plone_workflow_csv))
+    
+    def test_order_independent(self):
+        info = self.parse()
+        shuffled = self.parse()
+        shuffled['state_info'].reverse()
+        shuffled['transition_info'].reverse()
+        for state in shuffled['state_info']:
+            state['transitions'] = tuple(reversed(state['transitions']))
+            for permission in state['permissions']:
+                permission['roles'] = list(reversed(permission['roles']))
+        self.assertEquals(fingerprintInfo(info), fingerprintInfo(shuffled))
+        self.assertEquals(fingerprintInfo(info), fingerprintInfo(freezeInfo(info)))
+    
+    def test_changed(self):
+        info = self.parse()
+        changed = self.parse()
+        changed['state_info'][0]['permissions'][0]['roles'] = ['Manager']
+        self.assertNotEquals(fingerprintInfo(info), fingerprintInfo(changed))
+        
+        changed = self.parse()
+        changed['transition_info'][0]['guard_expr'] = 'python:False'
+        self.assertNotEquals(fingerprintInfo(info), fingerprintInfo(changed))
+    
+    def test_changed_outside_csv(self):
+        # Things that can only be changed through the ZMI still count
+        info = self.parse()
+        def changed(change):
+            other = self.parse()
+            change(other)
+            return fingerprintInfo(other)
+        
+        fingerprint = fingerprintInfo(info)
+        self.assertNotEquals(fingerprint, changed(lambda i: i.update(manager_bypass=True)))
+        self.assertNotEquals(fingerprint, changed(lambda i: i.update(creation_guard={'guard_roles': ('Manager',)})))
+        self.assertEquals(fingerprint, changed(lambda i: i.update(creation_guard={'guard_roles': ()})))
+        self.assertNotEquals(fingerprint, changed(lambda i: i['transition_info'][0].update(guard_groups=('Reviewers',))))
+        self.assertNotEquals(fingerprint, changed(lambda i: i['worklist_info'][0].update(guard_groups=('Reviewers',))))
+        self.assertNotEquals(fingerprint, changed(lambda i: i['worklist_info'][0].update(actbox_url='http://example.com')))
+        self.assertNotEquals(fingerprint, changed(lambda i: i['worklist_info'][0].update(actbox_category='other')))
+        self.assertNotEquals(fingerprint, changed(lambda i: i['state_info'][0].update(groups=[('Reviewers', ('Reader',))])))
+        self.assertNotEquals(fingerprint, changed(lambda i: i['variable_info'][0].update(default_expr='string:')))
+        self.assertNotEquals(fingerprint, changed(lambda i: i['variable_info'].pop()))
+        
+        other = self.parse()
+        other['manager_bypass'] = True
+        self.assertEquals(['manager_bypass'], diffWorkflowInfo(info, other)['workflow'])
+
+class TestFlyweight(unittest.TestCase):
+    
+    layer = ConfigLayer
+    
+    def parse(self):
+        deserializer = DefaultDeserializer()
+        return deserializer(StringIO(plone_workflow_csv))
+    
+    def test_shared(self):
+        one = freezeInfo(self.parse())
+        two = freezeInfo(self.parse())
+        self.failUnless(one is two)
+        self.failUnless(one['state_info'][0]['permissions'][0]['roles'] is \
+                        two['state_info'][0]['permissions'][0]['roles'])
+        self.assertRaises(TypeError, one.__setitem__, 'id', 'foo')
+    
+    def test_serialize_frozen(self):
+        info = self.parse()
+        serializer = DefaultSerializer()
+        
+        expected = StringIO()
+        serializer(info, expected)
+        
+        frozen = StringIO()
+        serializer(freezeInfo(info), frozen)
+        
+        self.assertEquals(expected.getvalue(), frozen.getvalue())
+        self.failIf(diffWorkflowInfo(info, freezeInfo(info)) != diffWorkflowInfo(info, info))
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestDiff))
+    suite.addTest(makeSuite(TestFingerprint))
+    suite.addTest(makeSuite(TestFlyweight))
+    return suite
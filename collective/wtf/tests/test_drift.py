@@ -0,0 +1,75 @@
+from Products.PloneTestCase.PloneTestCase import PloneTestCase
+
+from collective.wtf.compare import hasChanges
+from collective.wtf.exportimport import getLiveFingerprint
+from collective.wtf.fingerprint import checkDrift
+from collective.wtf.fingerprint import checkDriftInSites
+from collective.wtf.fingerprint import diffDrift
+
+from collective.wtf.tests.test_exportimport import GSLayer
+from collective.wtf.tests.test_plan import PROFILE_ID
+from collective.wtf.tests.test_plan import changeThroughZMI
+
+class TestDrift(PloneTestCase):
+
+    layer = GSLayer
+
+    def afterSetUp(self):
+        self.setRoles(['Manager'])
+        self.import_context = self.portal.portal_setup._getImportContext(PROFILE_ID)
+
+    def check(self):
+        return dict([(e['workflow'], e,) for e in checkDrift(self.import_context)])
+
+    def test_ok(self):
+        entry = self.check()['test_wf']
+        self.assertEquals('ok', entry['status'])
+        self.assertEquals(entry['expected'], entry['live'])
+        self.failIf(hasChanges(diffDrift(self.import_context, 'test_wf')))
+
+    def test_changed(self):
+        wf = self.portal.portal_workflow.test_wf
+        expected = self.check()['test_wf']['expected']
+        changeThroughZMI(wf)
+
+        entry = self.check()['test_wf']
+        self.assertEquals('changed', entry['status'])
+        self.assertEquals(expected, entry['expected'])
+        self.assertEquals(getLiveFingerprint(wf), entry['live'])
+        self.failIf(entry['live'] == entry['expected'])
+
+        diff = diffDrift(self.import_context, 'test_wf')
+        self.assertEquals(['state_three'], diff['states_added'])
+        self.assertEquals(['extra'], diff['states_removed'])
+        self.assertEquals(['to_state_three'], diff['transitions_added'])
+        self.assertEquals({'to_state_two': ['title']}, diff['transitions_changed'])
+
+    def test_one_setting(self):
+        # Changes deep inside a transition are noticed too
+        self.portal.portal_workflow.test_wf.transitions.to_state_two.guard.roles = ('Reviewer',)
+        self.assertEquals('changed', self.check()['test_wf']['status'])
+        diff = diffDrift(self.import_context, 'test_wf')
+        self.assertEquals({'to_state_two': ['guard_roles']}, diff['transitions_changed'])
+
+    def test_missing(self):
+        self.portal.portal_workflow.manage_delObjects(['test_wf'])
+        entry = self.check()['test_wf']
+        self.assertEquals(('missing', None,), (entry['status'], entry['live'],))
+        diff = diffDrift(self.import_context, 'test_wf')
+        self.assertEquals(['state_one', 'state_three', 'state_two'], diff['states_added'])
+
+    def test_unknown(self):
+        self.assertEquals(None, diffDrift(self.import_context, 'no_such_workflow'))
+
+    def test_sites(self):
+        changeThroughZMI(self.portal.portal_workflow.test_wf)
+        results = checkDriftInSites([self.portal], PROFILE_ID)
+        self.assertEquals(['/'.join(self.portal.getPhysicalPath())], [path for path, entries in results])
+        statuses = dict([(e['workflow'], e['status'],) for e in results[0][1]])
+        self.assertEquals('changed', statuses['test_wf'])
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestDrift))
+    return suite
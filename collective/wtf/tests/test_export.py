@@ -0,0 +1,175 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from hashlib import md5
+except ImportError: # Python 2.4
+    from md5 import new as md5
+
+import transaction
+from persistent import Persistent
+from BTrees.OOBTree import OOBTree
+from ZODB.DB import DB
+from ZODB.DemoStorage import DemoStorage
+
+from Products.PloneTestCase.PloneTestCase import PloneTestCase
+
+from collective.wtf import exportimport
+from collective.wtf.exportimport import MANIFEST
+from collective.wtf.exportimport import exportCSVWorkflowToDirectory
+from collective.wtf.exportimport import exportWorkflowBody
+from collective.wtf.exportimport import getLiveFingerprint
+from collective.wtf.exportimport import readManifest
+from collective.wtf.serial import modificationSerial
+
+from collective.wtf.tests.test_exportimport import GSLayer
+
+class Container(Persistent):
+    pass
+
+class TestSerial(unittest.TestCase):
+
+    def setUp(self):
+        self.db = DB(DemoStorage())
+        self.connection = self.db.open()
+
+    def tearDown(self):
+        transaction.abort()
+        self.connection.close()
+        self.db.close()
+
+    def test_btree(self):
+        ob = self.connection.root()['ob'] = Container()
+        ob.tree = OOBTree()
+        ob.tree['key'] = 'value'
+        self.assertEquals(None, modificationSerial(ob))
+        transaction.commit()
+
+        serial = modificationSerial(ob)
+        self.assertEquals(ob._p_serial, serial)
+
+        ob.tree['key'] = 'changed'
+        self.assertEquals(None, modificationSerial(ob))
+        transaction.commit()
+        self.failUnless(modificationSerial(ob) > serial)
+
+    def test_workflow(self):
+        from Products.DCWorkflow.DCWorkflow import DCWorkflowDefinition
+        wf = self.connection.root()['wf'] = DCWorkflowDefinition('wf')
+        wf.states.addState('x')
+        wf.transitions.addTransition('go')
+        transaction.commit()
+        serial = modificationSerial(wf)
+        self.failIf(serial is None)
+
+        # States and transitions are kept in a plain dict in their container
+        wf.states.x.title = 'Changed'
+        self.assertEquals(None, modificationSerial(wf))
+        transaction.commit()
+        changed = modificationSerial(wf)
+        self.failUnless(changed > serial)
+
+        wf.states.x.setPermission('View', 0, ['Manager'])
+        self.assertEquals(None, modificationSerial(wf))
+        transaction.commit()
+        self.failUnless(modificationSerial(wf) > changed)
+        changed = modificationSerial(wf)
+
+        wf.transitions.go.setProperties('Go', 'x', props={'guard_roles': 'Manager'})
+        self.assertEquals(None, modificationSerial(wf))
+        transaction.commit()
+        self.failUnless(modificationSerial(wf) > changed)
+
+class TestDirectoryExport(PloneTestCase):
+
+    layer = GSLayer
+
+    def afterSetUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def beforeTearDown(self):
+        shutil.rmtree(self.path)
+
+    def read(self, filename):
+        data = open(os.path.join(self.path, filename), 'rb')
+        try:
+            return data.read()
+        finally:
+            data.close()
+
+    def test_manifest(self):
+        wf = self.portal.portal_workflow.test_wf
+        written = exportCSVWorkflowToDirectory(self.portal, self.path)
+        self.failUnless('test_wf' in written, written)
+
+        manifest = readManifest(self.read(MANIFEST))
+        self.assertEquals(sorted(written), sorted(manifest.keys()))
+        body = self.read(os.path.join('workflow_csv', 'test_wf.csv'))
+        self.assertEquals((getLiveFingerprint(wf), md5(body).hexdigest(), len(body),),
+                          manifest['test_wf'])
+
+    def test_unchanged(self):
+        wf = self.portal.portal_workflow.test_wf
+        exportCSVWorkflowToDirectory(self.portal, self.path)
+        self.assertEquals([], exportCSVWorkflowToDirectory(self.portal, self.path))
+
+        # Missing files are written again
+        os.remove(os.path.join(self.path, 'workflow_csv', 'test_wf.csv'))
+        self.assertEquals(['test_wf'], exportCSVWorkflowToDirectory(self.portal, self.path))
+
+        # So are those of workflows that changed
+        wf.title = 'Changed'
+        self.assertEquals(['test_wf'], exportCSVWorkflowToDirectory(self.portal, self.path))
+        self.failUnless('Title:,Changed' in self.read(os.path.join('workflow_csv', 'test_wf.csv')))
+
+    def test_extracted_once(self):
+        from Products.GenericSetup.context import SetupEnviron
+        from collective.wtf.exportimport import CSVWorkflowDefinitionConfigurator
+        wf = self.portal.portal_workflow.test_wf
+        live = getLiveFingerprint(wf)
+        exportimport._export_cache.clear()
+        exportimport._live_infos.clear()
+
+        calls = []
+        extract = CSVWorkflowDefinitionConfigurator._extractDCWorkflowInfo
+        def counting(self, workflow, workflow_info):
+            calls.append(workflow.getId())
+            return extract(self, workflow, workflow_info)
+        CSVWorkflowDefinitionConfigurator._extractDCWorkflowInfo = counting
+        try:
+            fingerprint, body = exportWorkflowBody(wf, SetupEnviron())
+            self.assertEquals(['test_wf'], calls)
+            self.failUnless(body.startswith('[Workflow]'), body)
+            self.assertEquals(live, fingerprint)
+
+            # Cached until the workflow changes, down to its states
+            self.assertEquals((fingerprint, body,), exportWorkflowBody(wf, SetupEnviron()))
+            self.assertEquals(['test_wf'], calls)
+            wf.states.state_one.title = 'Changed'
+            fingerprint, body = exportWorkflowBody(wf, SetupEnviron())
+            self.failUnless('Title:,Changed' in body, body)
+        finally:
+            del CSVWorkflowDefinitionConfigurator._extractDCWorkflowInfo
+            exportimport._export_cache.clear()
+            exportimport._live_infos.clear()
+
+    def test_cache_size(self):
+        size = exportimport._export_cache_size
+        exportimport._export_cache_size = 1
+        try:
+            exportimport._export_cache.clear()
+            for wf in self.portal.portal_workflow.objectValues():
+                exportWorkflowBody(wf, None)
+                self.failUnless(len(exportimport._export_cache) <= 1)
+        finally:
+            exportimport._export_cache_size = size
+            exportimport._export_cache.clear()
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestSerial))
+    suite.addTest(makeSuite(TestDirectoryExport))
+    return suite
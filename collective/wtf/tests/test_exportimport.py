@@ -14,6 +14,7 @@ from Products.PloneTestCase.PloneTestCase import PloneTestCase
 from Products.PloneTestCase.PloneTestCase import setupPloneSite
 from Products.PloneTestCase.layer import PloneSite
 from Testing import ZopeTestCase
+from Testing.ZopeTestCase.sandbox import Sandboxed
 
 from collective.wtf.tests.test_parsing import plone_workflow_csv
 
@@ -203,9 +204,254 @@ Function:,inline_test_two
         diff = '\n'.join(list(difflib.unified_diff(body.strip().splitlines(), expected.strip().splitlines())))
                                          
         self.failIf(diff, diff)
+    
+    def test_reimport_reverts_zmi_changes(self):
+        from Products.DCWorkflow.Guard import Guard
+        from collective.wtf.availability import AVAILABILITY_ATTR
+        wf = self.portal.portal_workflow.test_wf
+        portal_setup = self.portal.portal_setup
+        
+        def reimport():
+            portal_setup.runImportStepFromProfile('profile-collective.wtf:testing', 'workflow-csv',
+                                                  run_dependencies=False)
+        
+        # Unchanged: the compiled structures are restored if missing
+        delattr(wf, AVAILABILITY_ATTR)
+        reimport()
+        self.failUnless(getattr(wf, AVAILABILITY_ATTR, None))
+        
+        guard = Guard()
+        guard.groups = ('Reviewers',)
+        wf.transitions.to_state_three.guard = guard
+        wf.worklists.objectValues()[0].actbox_category = 'other'
+        wf.manager_bypass = 1
+        reimport()
+        
+        wf = self.portal.portal_workflow.test_wf
+        self.assertEquals(0, wf.manager_bypass)
+        guard = wf.transitions.to_state_three.guard
+        self.failIf(guard is not None and guard.groups, guard)
+        self.assertEquals('global', wf.worklists.objectValues()[0].actbox_category)
+        
+    def test_frozen_info(self):
+        from collective.wtf.exportimport import CSVWorkflowDefinitionConfigurator
+        from collective.wtf.flyweight import FrozenDict
+        wf = self.portal.portal_workflow.test_wf
+        
+        info = CSVWorkflowDefinitionConfigurator(wf).getWorkflowInfo(wf.getId(), frozen=True)
+        self.failUnless(isinstance(info, FrozenDict))
+        self.failUnless(info is CSVWorkflowDefinitionConfigurator(wf).getWorkflowInfo(wf.getId(), frozen=True))
+        
+        # Not shared while there are uncommitted changes
+        wf.title = 'Changed'
+        info = CSVWorkflowDefinitionConfigurator(wf).getWorkflowInfo(wf.getId(), frozen=True)
+        self.failIf(isinstance(info, FrozenDict))
+        self.assertEquals('Changed', info['title'])
+        
+    def test_frozen_info_state_change(self):
+        from collective.wtf.exportimport import CSVWorkflowDefinitionConfigurator
+        from collective.wtf.flyweight import FrozenDict
+        wf = self.portal.portal_workflow.test_wf
+        CSVWorkflowDefinitionConfigurator(wf).getWorkflowInfo(wf.getId(), frozen=True)
+        
+        # Changes to the states count as changes to the workflow
+        wf.states.state_one.title = 'Changed'
+        info = CSVWorkflowDefinitionConfigurator(wf).getWorkflowInfo(wf.getId(), frozen=True)
+        self.failIf(isinstance(info, FrozenDict))
+        states = dict([(s['id'], s,) for s in info['state_info']])
+        self.assertEquals('Changed', states['state_one']['title'])
+        
+    def test_api_copy(self):
+        from collective.wtf.api import exportWorkflowInfo, importWorkflowInfos
+        wtool = self.portal.portal_workflow
+        
+        info = dict(exportWorkflowInfo(wtool.test_wf), id='test_wf_copy', title='Copy')
+        errors, results = importWorkflowInfos(wtool, [info])
+        
+        self.assertEquals({}, errors)
+        self.assertEquals([('test_wf_copy', 'imported',)], results)
+        self.assertEquals('Copy', wtool.test_wf_copy.title)
+        self.assertEquals('State one', wtool.test_wf_copy.states.state_one.title)
+    
+    def test_api_validate(self):
+        from collective.wtf.api import importWorkflowInfos
+        wtool = self.portal.portal_workflow
+        
+        errors, results = importWorkflowInfos(wtool, [{'id': 'broken_wf',
+                                                       'initial_state': 'nowhere',
+                                                       'state_info': [{'id': 'one', 'transitions': ['go']}],
+                                                       'transition_info': [{'id': 'go', 'new_state_id': 'two',
+                                                                            'guard_expr': 'python:('}],
+                                                       'bogus': 1,
+                                                       }])
+        self.assertEquals([], results)
+        self.assertEquals(4, len(errors['broken_wf']), errors)
+        self.failIf('broken_wf' in wtool.objectIds())
+        
+    def test_invalid_guard_expression(self):
+        from StringIO import StringIO
+        from collective.wtf.deserializer import DefaultDeserializer
+        from collective.wtf.interfaces import ParsingError
+        
+        body = plone_workflow_csv.rstrip() + "\n\n[Transition]\nId:,broken\nTarget state:,private\nGuard expression:,python:(\n"
+        try:
+            DefaultDeserializer()(StringIO(body), filename='broken.csv')
+        except ParsingError, e:
+            self.assertEquals(('broken.csv', len(body.splitlines()), 2,), (e.filename, e.line, e.column,))
+            self.failUnless("'Guard expression:'" in str(e), str(e))
+            # The position is given once, by the error itself
+            self.failIf('starting on line' in str(e), str(e))
+        else:
+            self.fail("No error")
+        
+    def test_overlay_of_overlay(self):
+        from collective.wtf.exportimport import parseCSVWorkflow
+        from collective.wtf.interfaces import ParsingError
+        from collective.wtf.tests.test_overlay import overlay_csv
+        
+        info = parseCSVWorkflow(overlay_csv, base_body=plone_workflow_csv, filename='intranet_workflow.csv')
+        self.assertEquals('intranet_workflow', info['id'])
+        
+        overlay = overlay_csv.replace("Id:,intranet_workflow\nBase:,plone_workflow", "Id:,extranet_workflow\nBase:,intranet_workflow")
+        try:
+            parseCSVWorkflow(overlay, base_body=overlay_csv, filename='extranet_workflow.csv',
+                             base_filename='intranet_workflow.csv')
+        except ParsingError, e:
+            self.assertEquals('extranet_workflow.csv', e.filename)
+            self.failUnless('intranet_workflow.csv is an overlay of plone_workflow' in str(e), str(e))
+        else:
+            self.fail("No error")
+        
+        # Errors in the base are reported against the base
+        try:
+            parseCSVWorkflow(overlay_csv, base_body=plone_workflow_csv.replace('[Workflow]', ''),
+                             filename='intranet_workflow.csv', base_filename='plone_workflow.csv')
+        except ParsingError, e:
+            self.assertEquals('plone_workflow.csv', e.filename)
+        else:
+            self.fail("No error")
+        
+    def test_availability(self):
+        from collective.wtf.availability import AVAILABILITY_ATTR
+        from collective.wtf.availability import getStateAvailability
+        from collective.wtf.availability import listAvailableTransitions
+        wf = self.portal.portal_workflow.test_wf
+        
+        table = getattr(wf, AVAILABILITY_ATTR)
+        self.assertEquals(['to_state_two', 'to_state_three'],
+                          [e[0] for e in table['state_one'][1]])
+        
+        # Only the guard with an expression is checked in full
+        entries = getStateAvailability(wf, wf.states.state_three)
+        self.assertEquals([True], [e[3] for e in entries])
+        entries = getStateAvailability(wf, wf.states.state_one)
+        self.assertEquals([False, False], [e[3] for e in entries])
+        self.assertEquals(('Modify portal content',), entries[0][2])
+        
+        def expected():
+            sdef = wf._getWorkflowStateOf(self.folder)
+            return [t for t in sdef.transitions
+                        if wf._checkTransitionGuard(wf.transitions[t], self.folder)]
+        
+        available = [t.getId() for t in listAvailableTransitions(wf, self.folder)]
+        self.assertEquals(expected(), available)
+        
+        self.logout()
+        available = [t.getId() for t in listAvailableTransitions(wf, self.folder)]
+        self.assertEquals(['to_state_three'], available)
+        self.assertEquals(expected(), available)
+        self.login()
+        
+        # Changes made since compiling are noticed
+        wf.transitions.to_state_two.guard.permissions = ('Manage portal',)
+        self.assertEquals(None, getStateAvailability(wf, wf.states.state_one))
+        available = [t.getId() for t in listAvailableTransitions(wf, self.folder)]
+        self.assertEquals(expected(), available)
+        
+    def test_history_export(self):
+        from StringIO import StringIO
+        from DateTime import DateTime
+        from collective.wtf.history import iterHistory, writeHistoryCSV
+        wtool = self.portal.portal_workflow
+        
+        self.setRoles(['Manager'])
+        self.folder.invokeFactory('Document', 'doc')
+        doc = self.folder.doc
+        workflow_id = wtool.getChainFor(doc)[0]
+        transition = [t['id'] for t in wtool.getTransitionsFor(doc)][0]
+        wtool.doActionFor(doc, transition, comment='Audited')
+        
+        records = list(iterHistory(self.portal, {'path': '/'.join(doc.getPhysicalPath())},
+                                   workflow_ids=[workflow_id]))
+        self.assertEquals([None, transition], [r['entry']['action'] for r in records])
+        
+        records = list(iterHistory(self.portal, workflow_ids=[workflow_id],
+                                   actions=[transition], start=DateTime() - 1, chunk_size=1))
+        self.assertEquals(['Audited'], [r['entry']['comments'] for r in records])
+        self.assertEquals(wtool.getInfoFor(doc, 'review_state'), records[0]['state'])
+        
+        self.assertEquals([], list(iterHistory(self.portal, workflow_ids=[workflow_id],
+                                               end=DateTime() - 1)))
+        
+        out = StringIO()
+        self.assertEquals(1, writeHistoryCSV(records, out))
+        lines = out.getvalue().splitlines()
+        self.assertEquals('path,portal_type,workflow,time,action,state,actor,comments', lines[0])
+        self.failUnless(lines[1].endswith(',Audited'), lines[1])
+        
+class TestReimport(Sandboxed, PloneTestCase):
+    """Re-imports and cached workflow info after changes made through the
+    ZMI and committed, so that the caches keyed on the workflow's serial
+    are used
+    """
+    
+    layer = GSLayer
+    
+    def reimport(self):
+        self.portal.portal_setup.runImportStepFromProfile('profile-collective.wtf:testing', 'workflow-csv',
+                                                          run_dependencies=False)
+        transaction.commit()
+    
+    def test_committed_zmi_change(self):
+        from collective.wtf.serial import modificationSerial
+        wf = self.portal.portal_workflow.test_wf
+        self.reimport()
+        serial = modificationSerial(wf)
+        
+        # Unchanged, so skipped
+        self.reimport()
+        self.assertEquals(serial, modificationSerial(self.portal.portal_workflow.test_wf))
+        
+        wf.states.state_one.title = 'Changed'
+        wf.states.state_one.setPermission('View', 0, ['Manager'])
+        transaction.commit()
+        self.reimport()
+        
+        state = self.portal.portal_workflow.test_wf.states.state_one
+        self.assertEquals('State one', state.title)
+        self.assertEquals(['Manager', 'Member', 'Owner'], sorted(state.getPermissionInfo('View')['roles']))
+        self.failUnless(state.getPermissionInfo('View')['acquired'])
+        
+    def test_committed_frozen_info(self):
+        from collective.wtf.exportimport import CSVWorkflowDefinitionConfigurator
+        wf = self.portal.portal_workflow.test_wf
+        transaction.commit()
+        before = CSVWorkflowDefinitionConfigurator(wf).getWorkflowInfo(wf.getId(), frozen=True)
+        
+        wf.states.state_one.setPermission('View', 0, ['Manager'])
+        transaction.commit()
+        info = CSVWorkflowDefinitionConfigurator(wf).getWorkflowInfo(wf.getId(), frozen=True)
+        self.failIf(info is before)
+        state = [s for s in info['state_info'] if s['id'] == 'state_one'][0]
+        view = [p for p in state['permissions'] if p['name'] == 'View'][0]
+        self.assertEquals((False, ('Manager',),), (bool(view['acquired']), tuple(view['roles']),))
+        
+        # And shared again until the next change
+        self.failUnless(info is CSVWorkflowDefinitionConfigurator(wf).getWorkflowInfo(wf.getId(), frozen=True))
         
 def test_suite():
     from unittest import TestSuite, makeSuite
     suite = TestSuite()
     suite.addTest(makeSuite(TestGenericSetup))
+    suite.addTest(makeSuite(TestReimport))
     return suite
@@ -0,0 +1,187 @@
+import os
+import tempfile
+import unittest
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+import transaction
+from DateTime import DateTime
+
+from collective.wtf.history import HistoryArchive
+from collective.wtf.history import compactHistory
+
+class Dummy(object):
+
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
+
+    def getId(self):
+        return self.id
+
+class DummyVariables(object):
+
+    def __init__(self, variables):
+        self.variables = variables
+
+    def objectValues(self):
+        return self.variables
+
+class DummyWorkflowTool(object):
+
+    def __init__(self, **workflows):
+        self.workflows = workflows
+
+    def getWorkflowById(self, workflow_id):
+        return self.workflows.get(workflow_id, None)
+
+def entry(action, days_ago, **kw):
+    kw.update({'action': action, 'review_state': action, 'actor': 'admin',
+               'comments': '', 'time': DateTime() - days_ago})
+    return kw
+
+class TestCompactHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.ob = Dummy(workflow_history={
+            'wf': (entry('one', 100), entry('two', 50), entry('three', 10), entry('four', 1),),
+            'other': (entry('only', 100),),
+            })
+
+    def actions(self, workflow_id='wf'):
+        return [e['action'] for e in self.ob.workflow_history[workflow_id]]
+
+    def test_default(self):
+        # Without a policy, nothing is removed
+        self.assertEquals(({}, 0,), compactHistory(self.ob))
+        self.assertEquals(['one', 'two', 'three', 'four'], self.actions())
+
+    def test_keep(self):
+        removed, saved = compactHistory(self.ob, keep=2)
+        self.assertEquals(['three', 'four'], self.actions())
+        self.assertEquals(['one', 'two'], [e['action'] for e in removed['wf']])
+        self.failIf('other' in removed)
+        self.failUnless(saved > 0)
+
+        # The current status is always kept
+        compactHistory(self.ob, keep=0)
+        self.assertEquals(['four'], self.actions())
+        self.assertEquals(['only'], self.actions('other'))
+
+    def test_max_age(self):
+        removed, saved = compactHistory(self.ob, max_age=30)
+        self.assertEquals(['three', 'four'], self.actions())
+        self.assertEquals(['only'], self.actions('other'))
+
+    def test_keep_and_max_age(self):
+        # Entries are only removed if they are neither recent nor young
+        compactHistory(self.ob, keep=3, max_age=30)
+        self.assertEquals(['two', 'three', 'four'], self.actions())
+
+        self.ob.workflow_history['wf'] += ({'action': 'untimed', 'review_state': 'untimed'},)
+        compactHistory(self.ob, keep=1, max_age=30)
+        self.assertEquals(['three', 'four', 'untimed'], self.actions())
+
+    def test_strip(self):
+        workflow = Dummy(state_var='review_state',
+                         variables=DummyVariables([Dummy(id='action', for_status=1),
+                                                   Dummy(id='actor', for_status=0),
+                                                   Dummy(id='time', for_status=1)]))
+        wtool = DummyWorkflowTool(wf=workflow)
+        removed, saved = compactHistory(self.ob, strip=True, wtool=wtool)
+        self.assertEquals({}, removed)
+        self.failUnless(saved > 0)
+        self.assertEquals(['one', 'two', 'three', 'four'], self.actions())
+        self.assertEquals(['action', 'review_state', 'time'], sorted(self.ob.workflow_history['wf'][0].keys()))
+
+        # Workflows that no longer exist are left alone
+        self.assertEquals(['action', 'actor', 'comments', 'review_state', 'time'],
+                          sorted(self.ob.workflow_history['other'][0].keys()))
+
+    def test_no_history(self):
+        self.assertEquals(({}, 0,), compactHistory(Dummy(), keep=1))
+
+class Failing(object):
+    """A data manager that makes the transaction fail to commit
+    """
+
+    transaction_manager = transaction.manager
+
+    def abort(self, txn):
+        pass
+
+    tpc_abort = tpc_begin = commit = tpc_finish = abort
+
+    def tpc_vote(self, txn):
+        raise ValueError("Failed")
+
+    def sortKey(self):
+        return '~failing'
+
+class TestHistoryArchive(unittest.TestCase):
+
+    def setUp(self):
+        transaction.abort()
+        fd, self.filename = tempfile.mkstemp()
+        os.close(fd)
+        self.archive = HistoryArchive(self.filename)
+
+    def tearDown(self):
+        transaction.abort()
+        os.remove(self.filename)
+
+    def records(self):
+        return [json.loads(line) for line in open(self.filename).readlines()]
+
+    def test_commit(self):
+        self.archive.add('/plone/doc', 'wf', [{'action': 'one'}, {'action': 'two'}])
+        self.archive.add('/plone/other', 'wf', [{'action': 'three', 'time': DateTime('2026/01/01 UTC')}])
+        # Nothing is written before the commit
+        self.assertEquals([], self.records())
+
+        transaction.commit()
+        records = self.records()
+        self.assertEquals(['/plone/doc', '/plone/doc', '/plone/other'], [r['path'] for r in records])
+        self.assertEquals(['one', 'two', 'three'], [r['entry']['action'] for r in records])
+        self.assertEquals('wf', records[0]['workflow'])
+        self.failUnless(records[2]['entry']['time'].startswith('2026-01-01'))
+
+        # Later transactions append
+        self.archive.add('/plone/doc', 'wf', [{'action': 'four'}])
+        transaction.commit()
+        self.assertEquals(4, len(self.records()))
+
+    def test_abort(self):
+        self.archive.add('/plone/doc', 'wf', [{'action': 'one'}])
+        transaction.abort()
+        transaction.commit()
+        self.assertEquals([], self.records())
+
+    def test_failed_commit(self):
+        self.archive.add('/plone/doc', 'wf', [{'action': 'one'}])
+        transaction.commit()
+
+        # Written before the commit, removed again when it fails
+        self.archive.add('/plone/doc', 'wf', [{'action': 'two'}])
+        transaction.get().join(Failing())
+        self.assertRaises(ValueError, transaction.commit)
+        transaction.abort()
+        self.assertEquals(['one'], [r['entry']['action'] for r in self.records()])
+
+    def test_failed_hook(self):
+        def fail():
+            raise ValueError("Failed")
+        self.archive.add('/plone/doc', 'wf', [{'action': 'one'}])
+        transaction.get().addBeforeCommitHook(fail)
+        self.assertRaises(ValueError, transaction.commit)
+        transaction.abort()
+        self.assertEquals([], self.records())
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestCompactHistory))
+    suite.addTest(makeSuite(TestHistoryArchive))
+    return suite
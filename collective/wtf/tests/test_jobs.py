@@ -0,0 +1,126 @@
+import unittest
+
+import transaction
+from ZODB.DB import DB
+from ZODB.DemoStorage import DemoStorage
+from ZODB.POSException import ConflictError
+
+from collective.wtf.jobs import JobRunner
+from collective.wtf.jobs import getJobStatus
+from collective.wtf.jobs import listJobs
+from collective.wtf.jobs import startJob
+
+def setItem(key, value):
+    def step(connection):
+        connection.root()[key] = value
+        return {'items': 1}
+    return step
+
+def fail(connection):
+    connection.root()['failed'] = True
+    raise ValueError("Broken step")
+
+class TestJobRunner(unittest.TestCase):
+
+    def setUp(self):
+        self.db = DB(DemoStorage())
+
+    def tearDown(self):
+        transaction.abort()
+        self.db.close()
+
+    def status(self, job_id):
+        connection = self.db.open()
+        try:
+            return getJobStatus(connection.root(), job_id)
+        finally:
+            connection.close()
+
+    def root(self):
+        connection = self.db.open()
+        try:
+            return dict(connection.root())
+        finally:
+            connection.close()
+
+    def test_run(self):
+        steps = [('one', setItem('one', 1)), ('two', setItem('two', 2))]
+        progress = JobRunner(self.db, 'job', steps).run()
+
+        self.assertEquals('done', progress['status'])
+        self.assertEquals(progress, self.status('job'))
+        self.assertEquals(2, progress['done'])
+        self.assertEquals(['one', 'two'], progress['steps'])
+        self.assertEquals({'items': 2}, progress['counts'])
+        self.assertEquals(['one', 'two'], [name for name, seconds in progress['timings']])
+
+        root = self.root()
+        self.assertEquals(1, root['one'])
+        self.assertEquals(2, root['two'])
+
+    def test_failure_and_resume(self):
+        steps = [('one', setItem('one', 1)), ('broken', fail), ('three', setItem('three', 3))]
+        progress = JobRunner(self.db, 'job', steps).run()
+
+        self.assertEquals('failed', progress['status'])
+        self.assertEquals('broken', progress['phase'])
+        self.assertEquals(1, progress['done'])
+        self.failUnless('Broken step' in progress['error'])
+
+        # the first step was committed, the failed one rolled back
+        root = self.root()
+        self.assertEquals(1, root['one'])
+        self.failIf('failed' in root)
+        self.failIf('three' in root)
+
+        # resuming picks up at the failed step
+        steps[1] = ('broken', setItem('two', 2))
+        progress = JobRunner(self.db, 'job', steps).run()
+        self.assertEquals('done', progress['status'])
+        self.assertEquals({'items': 3}, progress['counts'])
+        self.assertEquals(3, self.root()['three'])
+
+    def test_conflict_retry(self):
+        calls = []
+        def flaky(connection):
+            calls.append(1)
+            if len(calls) < 3:
+                raise ConflictError()
+            return {'items': 1}
+
+        progress = JobRunner(self.db, 'job', [('flaky', flaky)]).run()
+        self.assertEquals('done', progress['status'])
+        self.assertEquals({'items': 1, 'conflicts': 2}, progress['counts'])
+
+    def test_failure_conflicts(self):
+        # Recording the failure gives up eventually
+        class Runner(JobRunner):
+            saves = 0
+            def _save(self, connection, progress):
+                if progress['status'] == 'failed':
+                    self.saves += 1
+                    raise ConflictError()
+                JobRunner._save(self, connection, progress)
+
+        runner = Runner(self.db, 'job', [('broken', fail)])
+        progress = runner.run()
+        self.assertEquals('failed', progress['status'])
+        self.assertEquals(runner.retries + 1, runner.saves)
+        self.assertEquals('running', self.status('job')['status'])
+
+    def test_thread(self):
+        thread = startJob(self.db, 'threaded', [('one', setItem('one', 1))])
+        thread.join(10)
+        self.assertEquals('done', self.status('threaded')['status'])
+
+        connection = self.db.open()
+        try:
+            self.assertEquals(['threaded'], [p['id'] for p in listJobs(connection.root())])
+        finally:
+            connection.close()
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestJobRunner))
+    return suite
@@ -0,0 +1,85 @@
+import unittest
+
+import transaction
+from ZODB.DB import DB
+from ZODB.DemoStorage import DemoStorage
+from ZODB.POSException import ConflictError
+
+from collective.wtf.interfaces import ImportLockTimeout
+from collective.wtf.locking import ImportLock
+from collective.wtf.locking import lockForTransaction
+from collective.wtf.locking import ROOT_KEY
+
+class TestImportLock(unittest.TestCase):
+    
+    def setUp(self):
+        self.db = DB(DemoStorage())
+    
+    def tearDown(self):
+        transaction.abort()
+        self.db.close()
+    
+    def holder(self):
+        connection = self.db.open()
+        try:
+            entry = connection.root().get(ROOT_KEY, {}).get('/plone/portal_workflow', None)
+            return entry and entry[0] or None
+        finally:
+            connection.close()
+    
+    def test_exclusive(self):
+        one = ImportLock(self.db, '/plone/portal_workflow')
+        two = ImportLock(self.db, '/plone/portal_workflow', wait=0)
+        two.poll = 0
+        
+        one.acquire()
+        self.assertEquals(one.token, self.holder())
+        self.assertRaises(ImportLockTimeout, two.acquire)
+        
+        one.release()
+        self.assertEquals(None, self.holder())
+        two.acquire()
+        self.assertEquals(two.token, self.holder())
+        two.release()
+    
+    def test_stale(self):
+        one = ImportLock(self.db, '/plone/portal_workflow', timeout=-1)
+        two = ImportLock(self.db, '/plone/portal_workflow', wait=0)
+        
+        one.acquire()
+        two.acquire()
+        self.assertEquals(two.token, self.holder())
+        
+        # releasing a lock that was taken over does not release the new one
+        one.release()
+        self.assertEquals(two.token, self.holder())
+        two.release()
+    
+    def test_transaction(self):
+        lock = lockForTransaction(self.db, '/plone/portal_workflow')
+        self.failUnless(lockForTransaction(self.db, '/plone/portal_workflow') is lock)
+        self.assertEquals(lock.token, self.holder())
+        transaction.commit()
+        self.assertEquals(None, self.holder())
+        
+        lock = lockForTransaction(self.db, '/plone/portal_workflow')
+        self.assertEquals(lock.token, self.holder())
+        transaction.savepoint().rollback()
+        transaction.abort()
+        self.assertEquals(None, self.holder())
+
+    def test_conflicts(self):
+        class Conflicting(ImportLock):
+            def _take(self, locks):
+                raise ConflictError()
+        lock = Conflicting(self.db, '/plone/portal_workflow')
+        lock.retries = 2
+        self.assertRaises(ImportLockTimeout, lock.acquire)
+        self.assertEquals(3, lock.conflicts)
+        self.assertEquals(None, self.holder())
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestImportLock))
+    return suite
@@ -0,0 +1,124 @@
+from zope.interface import alsoProvides
+
+from OFS.Folder import Folder
+
+from Products.CMFCore.interfaces import ISiteRoot
+from Products.PloneTestCase.PloneTestCase import PloneTestCase
+
+from collective.wtf import exportimport
+from collective.wtf.exportimport import getParseStats
+from collective.wtf.exportimport import parseCSVWorkflow
+from collective.wtf.multisite import findSites
+from collective.wtf.multisite import importInSites
+from collective.wtf.multisite import formatReport
+
+from collective.wtf.tests.test_parsing import plone_workflow_csv
+from collective.wtf.tests.test_exportimport import GSLayer
+
+class TestParseCache(PloneTestCase):
+
+    layer = GSLayer
+
+    def afterSetUp(self):
+        exportimport._parse_cache.clear()
+
+    def beforeTearDown(self):
+        exportimport._parse_cache.clear()
+
+    def test_hits(self):
+        before = getParseStats()
+        first = parseCSVWorkflow(plone_workflow_csv)
+        second = parseCSVWorkflow(plone_workflow_csv)
+        after = getParseStats()
+        self.assertEquals(1, after['misses'] - before['misses'])
+        self.assertEquals(1, after['hits'] - before['hits'])
+        self.assertEquals(first, second)
+
+        # The counters returned are a copy
+        after['hits'] = -1
+        self.failIf(getParseStats()['hits'] < 0)
+
+    def test_copies(self):
+        first = parseCSVWorkflow(plone_workflow_csv)
+        second = parseCSVWorkflow(plone_workflow_csv)
+        self.failIf(first is second)
+
+        first['title'] = 'Changed'
+        first['state_info'][0]['permissions'][0]['roles'].append('Changed')
+        del first['transition_info'][:]
+
+        third = parseCSVWorkflow(plone_workflow_csv)
+        self.assertEquals(second, third)
+        self.failIf('Changed' in third['state_info'][0]['permissions'][0]['roles'])
+
+        # The frozen version is shared
+        self.failUnless(parseCSVWorkflow(plone_workflow_csv, frozen=True)
+                            is parseCSVWorkflow(plone_workflow_csv, frozen=True))
+        self.assertEquals(third['title'], parseCSVWorkflow(plone_workflow_csv, frozen=True)['title'])
+
+    def test_size(self):
+        size = exportimport._parse_cache_size
+        exportimport._parse_cache_size = 1
+        try:
+            parseCSVWorkflow(plone_workflow_csv)
+            before = getParseStats()
+            parseCSVWorkflow(plone_workflow_csv.replace('Plone', 'Other'))
+            parseCSVWorkflow(plone_workflow_csv)
+            self.assertEquals(2, getParseStats()['misses'] - before['misses'])
+            self.assertEquals(1, len(exportimport._parse_cache))
+        finally:
+            exportimport._parse_cache_size = size
+
+class TestMultiSite(PloneTestCase):
+
+    layer = GSLayer
+
+    def afterSetUp(self):
+        exportimport._parse_cache.clear()
+
+    def beforeTearDown(self):
+        exportimport._parse_cache.clear()
+
+    def test_find_sites(self):
+        self.app._setObject('wtf_sites', Folder('wtf_sites'))
+        folder = self.app.wtf_sites
+        folder._setObject('other', Folder('other'))
+        alsoProvides(folder.other, ISiteRoot)
+        # Sites are not searched for sites
+        folder.other._setObject('nested', Folder('nested'))
+        alsoProvides(folder.other.nested, ISiteRoot)
+
+        paths = ['/'.join(s.getPhysicalPath()) for s in findSites(self.app)]
+        self.failUnless('/'.join(self.portal.getPhysicalPath()) in paths, paths)
+        self.failUnless('/wtf_sites/other' in paths, paths)
+        self.failIf('/wtf_sites/other/nested' in paths, paths)
+
+    def test_import(self):
+        report = importInSites([self.portal], 'collective.wtf:testing', commit=False)
+        self.assertEquals([None], [s['error'] for s in report['sites']])
+        self.assertEquals(1, report['parsed'])
+        self.assertEquals(0, report['reused'])
+
+        # The second time round, the file is not parsed again
+        report = importInSites([self.portal, self.portal], 'profile-collective.wtf:testing', commit=False)
+        self.assertEquals([None, None], [s['error'] for s in report['sites']])
+        self.assertEquals(0, report['parsed'])
+        self.assertEquals(2, report['reused'])
+        self.failUnless('2 sites, 0 failed' in formatReport(report))
+
+    def test_failure(self):
+        broken = Folder('broken')
+        alsoProvides(broken, ISiteRoot)
+        self.app._setObject('broken', broken)
+
+        report = importInSites([self.app.broken], 'collective.wtf:testing', commit=False)
+        self.assertEquals(['/broken'], [s['path'] for s in report['sites']])
+        self.failUnless(report['sites'][0]['error'].startswith('AttributeError'))
+        self.failUnless('1 sites, 1 failed' in formatReport(report))
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestParseCache))
+    suite.addTest(makeSuite(TestMultiSite))
+    return suite
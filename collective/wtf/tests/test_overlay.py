@@ -0,0 +1,160 @@
+import unittest
+from StringIO import StringIO
+
+from collective.wtf.compare import diffWorkflowInfo
+from collective.wtf.compare import hasChanges
+from collective.wtf.deserializer import DefaultDeserializer
+from collective.wtf.flyweight import freezeInfo
+from collective.wtf.interfaces import ParsingError
+from collective.wtf.overlay import getOverlayBase
+from collective.wtf.overlay import parseOverlay
+from collective.wtf.overlay import applyOverlay
+from collective.wtf.overlay import writeOverlay
+
+from collective.wtf.tests.test_parsing import ConfigLayer
+from collective.wtf.tests.test_parsing import plone_workflow_csv
+
+class TestOverlay(unittest.TestCase):
+
+    layer = ConfigLayer
+
+    def base(self):
+        return freezeInfo(DefaultDeserializer()(StringIO(plone_workflow_csv)))
+
+    def test_base(self):
+        self.assertEquals('plone_workflow', getOverlayBase(overlay_csv))
+        self.assertEquals(None, getOverlayBase(plone_workflow_csv))
+
+    def test_apply(self):
+        base = self.base()
+        info = applyOverlay(base, parseOverlay(overlay_csv))
+
+        self.assertEquals('intranet_workflow', info['id'])
+        self.assertEquals('Intranet Workflow', info['title'])
+        self.assertEquals(base['description'], info['description'])
+
+        states = dict([(s['id'], s,) for s in info['state_info']])
+        self.assertEquals(['pending', 'private', 'published', 'visible', 'archived'],
+                          [s['id'] for s in info['state_info']])
+
+        # Only the Anonymous cell of View changed
+        view = [p for p in states['published']['permissions'] if p['name'] == 'View'][0]
+        self.assertEquals(['Manager', 'Site Administrator'], view['roles'])
+        other = [p for p in states['published']['permissions'] if p['name'] == 'Access contents information'][0]
+        self.assertEquals(['Anonymous'], list(other['roles']))
+        self.assertEquals(('reject', 'retract', 'archive',), tuple(states['published']['transitions']))
+        self.assertEquals('Archived', states['archived']['title'])
+
+        # Untouched states are shared with the base
+        self.failUnless(states['private'] is base['state_info'][1])
+
+        transitions = dict([(t['id'], t,) for t in info['transition_info']])
+        self.assertEquals(('Reviewer',), tuple(transitions['publish']['guard_roles']))
+        self.assertEquals(('Review portal content',), tuple(transitions['publish']['guard_permissions']))
+        self.assertEquals('Publish', transitions['publish']['actbox_name'])
+        self.assertEquals('archived', transitions['archive']['new_state_id'])
+
+        # The base is not modified
+        diff = diffWorkflowInfo(base, self.base())
+        self.failIf(hasChanges(diff), diff)
+
+    def test_invalid(self):
+        self.assertRaises(ParsingError, parseOverlay, "[Workflow]\nId:,no_base\n")
+        bad = overlay_csv.replace("Title:,Intranet Workflow", "Initial state:,bogus")
+        self.assertRaises(ParsingError, applyOverlay, self.base(), parseOverlay(bad))
+
+    def test_positions(self):
+        try:
+            parseOverlay("[Workflow]\nId:,no_base\n", filename='no_base.csv')
+        except ParsingError, e:
+            self.assertEquals(('no_base.csv', 1,), (e.filename, e.line,))
+        else:
+            self.fail("No error")
+
+        # A new state must be complete
+        bad = overlay_csv.replace("Title:,Archived\n", "")
+        try:
+            applyOverlay(self.base(), parseOverlay(bad, filename='bad.csv'))
+        except ParsingError, e:
+            start = bad.splitlines().index('Id:,archived')
+            self.assertEquals(('bad.csv', start,), (e.filename, e.line,))
+            self.failUnless(str(e).startswith('bad.csv, line %d: ' % start), str(e))
+        else:
+            self.fail("No error")
+
+        bad = overlay_csv.replace("Permissions,Acquire,Anonymous,Manager,Site", "Permissions,Anonymous,Manager,Site")
+        try:
+            applyOverlay(self.base(), parseOverlay(bad, filename='bad.csv'))
+        except ParsingError, e:
+            line = bad.splitlines().index('Permissions,Anonymous,Manager,Site Administrator') + 1
+            self.assertEquals(('bad.csv', line, 2,), (e.filename, e.line, e.column,))
+        else:
+            self.fail("No error")
+
+        # Problems with the workflow as a whole have no line
+        bad = overlay_csv.replace("Title:,Intranet Workflow", "Initial state:,bogus")
+        try:
+            applyOverlay(self.base(), parseOverlay(bad, filename='bad.csv'))
+        except ParsingError, e:
+            self.assertEquals(('bad.csv', None,), (e.filename, e.line,))
+        else:
+            self.fail("No error")
+
+    def test_write(self):
+        base = self.base()
+        info = applyOverlay(base, parseOverlay(overlay_csv))
+
+        output_stream = StringIO()
+        writeOverlay(base, info, output_stream)
+        written = output_stream.getvalue().replace('\r\n', '\n')
+
+        self.failIf('Id:,hide' in written, written)
+        self.failIf('Id:,private' in written, written)
+
+        rebuilt = applyOverlay(base, parseOverlay(written))
+        diff = diffWorkflowInfo(info, rebuilt)
+        self.failIf(hasChanges(diff), diff)
+
+        smaller = dict(info)
+        smaller['state_info'] = info['state_info'][1:]
+        self.assertRaises(ValueError, writeOverlay, base, smaller, StringIO())
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestOverlay))
+    return suite
+
+overlay_csv = """\
+[Workflow]
+Id:,intranet_workflow
+Base:,plone_workflow
+Title:,Intranet Workflow
+
+[State]
+Id:,published
+Transitions,"reject, retract, archive"
+Permissions,Acquire,Anonymous,Manager,Site Administrator
+View,,N,Y,Y
+
+[State]
+Id:,archived
+Title:,Archived
+Description:,No longer current.
+Transitions,
+Permissions,Acquire,Anonymous,Manager,Owner
+View,N,N,Y,Y
+
+[Transition]
+Id:,publish
+Guard role:,Reviewer
+
+[Transition]
+Id:,archive
+Title:,Archive
+Description:,Manager archives content
+Target state:,archived
+URL:,%(content_url)s/content_status_modify?workflow_action=archive
+Trigger:,User
+Guard permission:,Manage portal
+"""
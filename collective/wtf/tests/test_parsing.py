@@ -1,3 +1,4 @@
+import copy
 import difflib
 import unittest
 from StringIO import StringIO
@@ -8,6 +9,8 @@ import zope.component.testing
 from collective.wtf.config import DefaultConfig
 from collective.wtf.deserializer import DefaultDeserializer
 from collective.wtf.serializer import DefaultSerializer
+from collective.wtf.interfaces import ParsingError
+from collective.wtf.interfaces import ParsingErrors
 
 class ConfigLayer:
     
@@ -38,6 +41,21 @@ class TestSerializer(unittest.TestCase):
                                          
         self.failIf(diff, diff)
     
+    def test_serialize_variables(self):
+        info = copy.deepcopy(plone_workflow_info)
+        for variable in info['variable_info']:
+            variable['for_status'] = variable['id'] in ('action', 'time',)
+        
+        output_stream = StringIO()
+        DefaultSerializer()(info, output_stream)
+        returned = output_stream.getvalue()
+        
+        self.failUnless('[Variables]\r\nRecord:,"action, time"\r\n' in returned, returned)
+        
+        parsed = DefaultDeserializer()(StringIO(returned.replace('\r\n', '\n')))
+        self.assertEquals(['action', 'time'],
+                          [v['id'] for v in parsed['variable_info'] if v['for_status']])
+    
 class TestDeserializer(unittest.TestCase):
     
     layer = ConfigLayer
@@ -80,6 +98,51 @@ class TestDeserializer(unittest.TestCase):
         self.assertEquals(sorted(['reviewer-tasks']),
                           sorted([s['id'] for s in info['worklist_info']]))
         
+        # Variables recorded in the history by default
+        self.assertEquals(['action', 'actor', 'comments', 'time'],
+                          [v['id'] for v in info['variable_info'] if v['for_status']])
+        
+    def test_deserialize_variables(self):
+        
+        deserializer = DefaultDeserializer()
+        
+        info = deserializer(StringIO(plone_workflow_csv + "\n[Variables]\nRecord:,none\n"))
+        self.assertEquals([], [v['id'] for v in info['variable_info'] if v['for_status']])
+        
+        # the other variables are still there
+        self.assertEquals(5, len(info['variable_info']))
+        
+        self.assertRaises(ParsingError, deserializer,
+                          StringIO(plone_workflow_csv + "\n[Variables]\nRecord:,\"action, bogus\"\n"))
+        
+    def test_collect_errors(self):
+        
+        deserializer = DefaultDeserializer()
+        
+        # A valid file parses the same in collecting mode
+        self.assertEquals(deserializer(StringIO(plone_workflow_csv)),
+                          deserializer(StringIO(plone_workflow_csv), collect=True))
+        
+        # Otherwise, the first error is raised, with its position
+        try:
+            deserializer(StringIO(broken_workflow_csv), filename='broken.csv')
+        except ParsingErrors:
+            self.fail("Not collecting")
+        except ParsingError, e:
+            self.assertEquals(('broken.csv', 10, 2,), (e.filename, e.line, e.column,))
+        else:
+            self.fail("No error")
+        
+        try:
+            deserializer(StringIO(broken_workflow_csv), filename='broken.csv', collect=True)
+        except ParsingErrors, e:
+            self.assertEquals([(4, 2,), (10, 2,), (18, 2,), (20, None,), (None, None,)],
+                              [(p.line, p.column,) for p in e.errors])
+            self.assertEquals(['broken.csv'], list(set([p.filename for p in e.errors])))
+            self.failUnless('broken.csv, line 18, column 2: The \'Record:\'' in str(e), str(e))
+        else:
+            self.fail("No errors")
+        
 def test_suite():
     from unittest import TestSuite, makeSuite
     suite = TestSuite()
@@ -469,4 +532,28 @@ Target state:,pending
 URL:,%(content_url)s/content_status_modify?workflow_action=submit
 Trigger:,User
 Guard permission:,Request review
-"""                    
\ No newline at end of file
+"""
+
+broken_workflow_csv = """\
+[Workflow]
+Id:,broken_workflow
+Initial state:,draft
+Oops
+
+[State]
+Id:,draft
+Title:,Draft
+Transitions,publish
+Permissions,Anonymous,Manager
+View,Y,Y
+
+[Transition]
+Id:,publish
+Target state:,draft
+
+[Variables]
+Record:,bogus
+
+[Transition]
+Title:,No id
+"""
@@ -0,0 +1,68 @@
+from Products.PloneTestCase.PloneTestCase import PloneTestCase
+
+from collective.wtf.compare import hasChanges
+from collective.wtf.exportimport import planCSVWorkflow
+
+from collective.wtf.tests.test_exportimport import GSLayer
+
+PROFILE_ID = 'profile-collective.wtf:testing'
+
+def changeThroughZMI(wf):
+    """Change the test workflow the way a site manager might in the ZMI,
+    so that it differs from its CSV file
+    """
+    wf.states.addState('extra')
+    wf.states.deleteStates(['state_three'])
+    wf.states.state_one.title = 'Changed'
+    wf.states.state_one.setPermission('View', 0, ['Manager'])
+    wf.transitions.addTransition('extra_transition')
+    wf.transitions.deleteTransitions(['to_state_three'])
+    wf.transitions.to_state_two.title = 'Changed'
+
+class TestPlan(PloneTestCase):
+
+    layer = GSLayer
+
+    def afterSetUp(self):
+        self.setRoles(['Manager'])
+
+    def plan(self):
+        import_context = self.portal.portal_setup._getImportContext(PROFILE_ID)
+        return dict([(e['workflow'], e,) for e in planCSVWorkflow(import_context)])
+
+    def test_unchanged(self):
+        entry = self.plan()['test_wf']
+        self.assertEquals('update', entry['action'])
+        self.assertEquals('workflow_csv/test_wf.csv', entry['filename'].replace('\\', '/'))
+        self.failIf(hasChanges(entry['diff']), entry['diff'])
+        self.assertEquals({}, entry['affected'])
+
+    def test_changed(self):
+        changeThroughZMI(self.portal.portal_workflow.test_wf)
+        diff = self.plan()['test_wf']['diff']
+
+        # Added and removed as seen from the live workflow
+        self.assertEquals(['state_three'], diff['states_added'])
+        self.assertEquals(['extra'], diff['states_removed'])
+        self.assertEquals(['state_one'], diff['states_changed'].keys())
+        self.failUnless('title' in diff['states_changed']['state_one'])
+        self.failUnless('permissions' in diff['states_changed']['state_one'])
+        self.assertEquals(['state_one', 'state_three'], diff['permissions_changed'])
+
+        self.assertEquals(['to_state_three'], diff['transitions_added'])
+        self.assertEquals(['extra_transition'], diff['transitions_removed'])
+        self.assertEquals({'to_state_two': ['title']}, diff['transitions_changed'])
+
+    def test_create(self):
+        self.portal.portal_workflow.manage_delObjects(['test_wf'])
+        entry = self.plan()['test_wf']
+        self.assertEquals('create', entry['action'])
+        self.assertEquals(['state_one', 'state_three', 'state_two'], entry['diff']['states_added'])
+        self.assertEquals(entry['diff']['states_added'], entry['diff']['permissions_changed'])
+        self.assertEquals({}, entry['affected'])
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestPlan))
+    return suite
@@ -0,0 +1,142 @@
+import unittest
+
+import transaction
+
+from Products.DCWorkflow.Transitions import TRIGGER_AUTOMATIC
+
+from Products.PloneTestCase.PloneTestCase import PloneTestCase
+
+from collective.wtf.reindex import ReindexQueue
+from collective.wtf.reindex import getReindexQueue
+from collective.wtf.utils import trigger_automatic_transitions
+
+from collective.wtf.tests.test_exportimport import ZCMLLayer
+
+class DummyRoot(object):
+
+    def __init__(self):
+        self.objects = {}
+
+    def unrestrictedTraverse(self, path, default=None):
+        return self.objects.get(path, default)
+
+class DummyContent(object):
+
+    def __init__(self, root, path):
+        self.root = root
+        self.path = path
+        self.calls = []
+        root.objects[path] = self
+
+    def getPhysicalPath(self):
+        return tuple(self.path.split('/'))
+
+    def getPhysicalRoot(self):
+        return self.root
+
+    def reindexObject(self, idxs=[]):
+        self.calls.append(('reindexObject', idxs,))
+
+    def reindexObjectSecurity(self):
+        self.calls.append(('reindexObjectSecurity',))
+
+class TestReindexQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.root = DummyRoot()
+
+    def test_merge(self):
+        ob = DummyContent(self.root, '/site/doc')
+        queue = ReindexQueue()
+        queue.add(ob, ['review_state'], security=False)
+        queue.add(ob, ['review_state', 'other_state'], security=False)
+        self.assertEquals(1, len(queue))
+        queue.flush()
+        self.assertEquals([('reindexObject', ['other_state', 'review_state'],)], ob.calls)
+        self.assertEquals(0, len(queue))
+
+    def test_all_indexes(self):
+        ob = DummyContent(self.root, '/site/doc')
+        queue = ReindexQueue()
+        queue.add(ob, [])
+        queue.add(ob, ['review_state'])
+        queue.flush()
+        self.assertEquals([('reindexObject', [],), ('reindexObjectSecurity',)], ob.calls)
+
+        other = DummyContent(self.root, '/site/other')
+        queue.add(other, ['review_state'], security=False)
+        queue.add(other, [])
+        queue.flush()
+        self.assertEquals([('reindexObject', [],)], other.calls)
+
+    def test_deleted(self):
+        ob = DummyContent(self.root, '/site/doc')
+        replaced = DummyContent(self.root, '/site/replaced')
+        queue = ReindexQueue()
+        queue.add(ob, ['review_state'])
+        queue.add(replaced, ['review_state'])
+
+        del self.root.objects['/site/doc']
+        DummyContent(self.root, '/site/replaced')
+        queue.flush()
+        self.assertEquals([], ob.calls)
+        self.assertEquals([], replaced.calls)
+
+class DummyEvent(object):
+
+    def __init__(self, object):
+        self.object = object
+
+class TestTrigger(PloneTestCase):
+
+    layer = ZCMLLayer
+
+    def afterSetUp(self):
+        self.setRoles(['Manager'])
+        self.folder.invokeFactory('Document', 'doc')
+        doc = self.folder.doc
+
+        # Publish documents automatically
+        wtool = self.portal.portal_workflow
+        workflow = wtool.getWorkflowById(wtool.getChainFor(doc)[0])
+        workflow.transitions.addTransition('publish_document')
+        workflow.transitions.publish_document.setProperties(
+            title='', new_state_id='published', trigger_type=TRIGGER_AUTOMATIC,
+            props={'guard_expr': "python:here.portal_type == 'Document'"})
+        state = workflow.states[wtool.getInfoFor(doc, 'review_state')]
+        state.transitions = state.transitions + ('publish_document',)
+
+    def beforeTearDown(self):
+        transaction.abort()
+
+    def queued(self):
+        queue = getReindexQueue(create=False)
+        if queue is None:
+            return []
+        return sorted(queue.entries.keys())
+
+    def test_own_event(self):
+        # The workflow tool reindexes the object of the event itself
+        doc = self.folder.doc
+        trigger_automatic_transitions(doc, DummyEvent(doc))
+        self.assertEquals('published', self.portal.portal_workflow.getInfoFor(doc, 'review_state'))
+        self.assertEquals([], self.queued())
+
+    def test_other_event(self):
+        doc = self.folder.doc
+        trigger_automatic_transitions(doc, DummyEvent(self.folder))
+        path = '/'.join(doc.getPhysicalPath())
+        self.assertEquals([path], self.queued())
+
+        # The catalog is updated when the transaction commits
+        catalog = self.portal.portal_catalog
+        self.assertEquals('private', catalog(path={'query': path, 'depth': 0})[0].review_state)
+        getReindexQueue().flush()
+        self.assertEquals('published', catalog(path={'query': path, 'depth': 0})[0].review_state)
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestReindexQueue))
+    suite.addTest(makeSuite(TestTrigger))
+    return suite
@@ -0,0 +1,62 @@
+from DateTime import DateTime
+
+from Products.PloneTestCase.PloneTestCase import PloneTestCase
+
+from collective.wtf.rolemap import applyRoleMap
+from collective.wtf.rolemap import getStateGrants
+
+from collective.wtf.tests.test_exportimport import GSLayer
+
+class TestRoleMap(PloneTestCase):
+
+    layer = GSLayer
+
+    def afterSetUp(self):
+        self.setRoles(['Manager'])
+        self.wf = self.portal.portal_workflow.test_wf
+        for id in ('applied', 'updated',):
+            self.folder.invokeFactory('Document', id)
+
+    def setState(self, ob, state_id):
+        self.portal.portal_workflow.setStatusOf(self.wf.getId(), ob,
+            {self.wf.state_var: state_id, 'action': None, 'actor': 'test_user_1_',
+             'comments': '', 'time': DateTime()})
+        # Something to repair
+        ob.manage_permission('View', ['Anonymous'], acquire=0)
+        ob.manage_permission('Modify portal content', ['Member'], acquire=1)
+
+    def settings(self, ob):
+        return [(p, ob.acquiredRolesAreUsedBy(p),
+                 sorted([r['name'] for r in ob.rolesOfPermission(p) if r['selected']]),)
+                    for p in self.wf.permissions]
+
+    def compare(self, state_id):
+        applied, updated = self.folder.applied, self.folder.updated
+        self.setState(applied, state_id)
+        self.setState(updated, state_id)
+        self.failUnless(applyRoleMap(self.wf, applied))
+        self.failUnless(self.wf.updateRoleMappingsFor(updated))
+        self.assertEquals(self.settings(updated), self.settings(applied))
+
+        # Nothing left to change
+        self.failIf(applyRoleMap(self.wf, applied))
+        return self.settings(applied)
+
+    def test_same_as_dcworkflow(self):
+        for state_id in self.wf.states.objectIds():
+            self.failIf(getStateGrants(self.wf, state_id) is None, state_id)
+            self.compare(state_id)
+
+    def test_changed_state(self):
+        # A change through the ZMI makes the compiled grants stale
+        self.wf.states.state_one.setPermission('View', 0, ['Manager'])
+        self.assertEquals(None, getStateGrants(self.wf, 'state_one'))
+
+        settings = dict([(p, (a, r,)) for p, a, r in self.compare('state_one')])
+        self.assertEquals(('', ['Manager'],), settings['View'])
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestRoleMap))
+    return suite
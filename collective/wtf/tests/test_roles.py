@@ -0,0 +1,164 @@
+from zope.component import getGlobalSiteManager
+from zope.component import getMultiAdapter
+from zope.interface import Interface
+from zope.interface import alsoProvides
+
+from Products.PloneTestCase.PloneTestCase import PloneTestCase
+
+from borg.localrole.interfaces import ILocalRoleProvider
+
+from collective.wtf.roles import LocalRoleResolver
+from collective.wtf.roles import SubtreeLocalRoleMap
+from collective.wtf.roles import getPrincipalIds
+
+from collective.wtf.tests.test_exportimport import ZCMLLayer
+
+class IExtraRoles(Interface):
+    """Marker for objects on which bob is a Reviewer, by adapter
+    """
+
+class ExtraRoles(object):
+    """A local role provider other than __ac_local_roles__
+    """
+
+    def __init__(self, context):
+        self.context = context
+
+    def getRoles(self, principal_id):
+        if principal_id == 'bob':
+            return ('Reviewer',)
+        return ()
+
+    def getAllRoles(self):
+        yield 'bob', ('Reviewer',)
+
+class TestLocalRoleResolver(PloneTestCase):
+
+    layer = ZCMLLayer
+
+    def afterSetUp(self):
+        self.portal.acl_users._doAddUser('bob', 'secret', ['Member'], [])
+        self.setRoles(['Manager'])
+        self.folder.invokeFactory('Folder', 'sub')
+        self.folder.sub.invokeFactory('Document', 'doc')
+        self.folder.manage_setLocalRoles('bob', ['Reader'])
+        self.folder.sub.doc.manage_setLocalRoles('bob', ['Editor'])
+
+    def member(self):
+        return self.portal.portal_membership.getMemberById('bob')
+
+    def resolved(self, obj, resolver=None):
+        member = self.member()
+        if resolver is None:
+            resolver = LocalRoleResolver()
+        return resolver.getRolesInContext(getPrincipalIds(member), member.getRoles(), obj)
+
+    def expected(self, obj):
+        return sorted(self.member().getRolesInContext(obj))
+
+    def test_same_as_plone(self):
+        resolver = LocalRoleResolver()
+        for obj in (self.folder, self.folder.sub, self.folder.sub.doc,):
+            self.assertEquals(self.expected(obj), self.resolved(obj, resolver))
+
+        roles = self.resolved(self.folder.sub.doc)
+        self.failUnless('Reader' in roles and 'Editor' in roles, roles)
+        self.failIf('Editor' in self.resolved(self.folder.sub))
+
+    def test_blocked(self):
+        self.folder.sub.__ac_local_roles_block__ = True
+        roles = self.resolved(self.folder.sub.doc)
+        self.failIf('Reader' in roles, roles)
+        self.assertEquals(self.expected(self.folder.sub.doc), roles)
+
+    def test_provider(self):
+        sm = getGlobalSiteManager()
+        sm.registerAdapter(ExtraRoles, (IExtraRoles,), ILocalRoleProvider, name='wtf-test')
+        try:
+            alsoProvides(self.folder.sub, IExtraRoles)
+            roles = self.resolved(self.folder.sub.doc)
+            self.failUnless('Reviewer' in roles, roles)
+            self.assertEquals(self.expected(self.folder.sub.doc), roles)
+        finally:
+            sm.unregisterAdapter(ExtraRoles, (IExtraRoles,), ILocalRoleProvider, name='wtf-test')
+
+    def test_bulk_rows(self):
+        doc = self.folder.sub.doc
+        path = '/'.join(doc.getPhysicalPath())
+        request = self.app.REQUEST
+        request.set('users', 'bob, nobody')
+        request.set('paths', path)
+        view = getMultiAdapter((self.portal, request), name='display-roles-in-context')
+        self.assertEquals([('bob', path, self.expected(doc),), ('nobody', None, None,)],
+                          list(view.rows()))
+
+class TestSubtreeLocalRoleMap(PloneTestCase):
+
+    layer = ZCMLLayer
+
+    def afterSetUp(self):
+        self.setRoles(['Manager'])
+        self.folder.invokeFactory('Folder', 'sub')
+        self.folder.sub.invokeFactory('Document', 'plain')
+        self.folder.sub.invokeFactory('Document', 'special')
+        self.folder.sub.manage_setLocalRoles('bob', ['Reader'])
+        # no local roles of its own, not even Owner
+        plain = self.folder.sub.plain
+        plain.manage_delLocalRoles(plain.users_with_local_role('Owner'))
+        self.folder.sub.special.manage_setLocalRoles('bob', ['Editor'])
+
+    def rows(self):
+        return dict([(path, (local_map, source,),)
+                        for path, local_map, source in SubtreeLocalRoleMap(self.folder)])
+
+    def test_inherited(self):
+        rows = self.rows()
+        sub = rows['/'.join(self.folder.sub.getPhysicalPath())]
+        local_map, source = rows['/'.join(self.folder.sub.plain.getPhysicalPath())]
+        self.assertEquals('inherited', source)
+        self.assertEquals(sub[0], local_map)
+        self.assertEquals(frozenset(['Reader']), local_map['bob'])
+
+    def test_overridden(self):
+        # bob is already in the parent's map, with another role
+        local_map, source = self.rows()['/'.join(self.folder.sub.special.getPhysicalPath())]
+        self.assertEquals('local', source)
+        self.assertEquals(frozenset(['Reader', 'Editor']), local_map['bob'])
+        self.assertEquals(local_map, LocalRoleResolver().getLocalRoleMap(self.folder.sub.special))
+
+    def walk(self, chunk_size):
+        calls = []
+        role_map = SubtreeLocalRoleMap(self.folder, chunk_size=chunk_size)
+        role_map._minimizeCache = lambda: calls.append(1)
+        return list(role_map), len(calls)
+
+    def test_chunks(self):
+        rows, chunks = self.walk(1000)
+        small_rows, small_chunks = self.walk(1)
+        self.assertEquals(rows, small_rows)
+        # At least one chunk per child, not one per folder
+        self.failUnless(small_chunks >= len(rows) - 1, (small_chunks, len(rows),))
+        self.failUnless(small_chunks > chunks, (small_chunks, chunks,))
+
+    def test_view_chunk_size(self):
+        request = self.app.REQUEST
+        written = []
+        request.response.write = written.append
+        view = getMultiAdapter((self.folder, request), name='local-role-map')
+        view()
+        expected = ''.join(written)
+        self.failUnless('Reader' in expected, expected)
+
+        # Invalid chunk sizes fall back to something sensible
+        for chunk_size in ('0', '-5', 'many',):
+            del written[:]
+            request.set('chunk_size', chunk_size)
+            view()
+            self.assertEquals(expected, ''.join(written))
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestLocalRoleResolver))
+    suite.addTest(makeSuite(TestSubtreeLocalRoleMap))
+    return suite
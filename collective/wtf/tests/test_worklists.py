@@ -0,0 +1,133 @@
+import unittest
+import time
+
+import transaction
+
+from Products.PloneTestCase.PloneTestCase import PloneTestCase
+from Testing.ZopeTestCase.sandbox import Sandboxed
+
+from collective.wtf import worklists
+from collective.wtf.worklists import WorklistCountCache
+from collective.wtf.worklists import invalidateWorklistCounts
+
+from collective.wtf.tests.test_exportimport import ZCMLLayer
+
+class TestWorklistCountCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = WorklistCountCache()
+        self._time = time.time
+        self.now = 1000.0
+        time.time = lambda: self.now
+
+    def tearDown(self):
+        time.time = self._time
+
+    def test_get_set(self):
+        self.assertEquals(None, self.cache.get('key'))
+        self.cache.set('key', 3)
+        self.assertEquals(3, self.cache.get('key'))
+        # A cached None (worklist not visible) is a hit, not a miss
+        self.cache.set('hidden', None)
+        self.assertEquals(None, self.cache.get('hidden', 'miss'))
+
+    def test_expiry(self):
+        self.cache.set('key', 3)
+        self.now += self.cache.timeout - 1
+        self.assertEquals(3, self.cache.get('key'))
+        self.now += 2
+        self.assertEquals('miss', self.cache.get('key', 'miss'))
+
+    def test_max_size(self):
+        self.cache.max_size = 3
+        for i in range(3):
+            self.cache.set(i, i)
+        self.assertEquals(3, len(self.cache.data))
+        self.cache.set('one more', 4)
+        self.assertEquals({'one more': (4, self.now + self.cache.timeout,)}, self.cache.data)
+
+    def test_default_max_size(self):
+        self.assertEquals(10000, WorklistCountCache.max_size)
+        for i in range(10000):
+            self.cache.set(i, i)
+        self.assertEquals(10000, len(self.cache.data))
+        self.cache.set(10000, 10000)
+        self.assertEquals(1, len(self.cache.data))
+
+class TestInvalidation(unittest.TestCase):
+
+    def setUp(self):
+        transaction.abort()
+        worklists._cache.clear()
+        worklists._cache.set('key', 3)
+
+    def tearDown(self):
+        transaction.abort()
+        worklists._cache.clear()
+
+    def test_cleared_on_commit(self):
+        invalidateWorklistCounts()
+        # Not until the transaction commits
+        self.assertEquals(3, worklists._cache.get('key'))
+        transaction.commit()
+        self.assertEquals(None, worklists._cache.get('key'))
+
+    def test_kept_on_abort(self):
+        invalidateWorklistCounts()
+        transaction.abort()
+        self.assertEquals(3, worklists._cache.get('key'))
+
+    def test_kept_on_failed_commit(self):
+        invalidateWorklistCounts()
+        transaction.get().addBeforeCommitHook(_fail)
+        self.assertRaises(ValueError, transaction.commit)
+        transaction.abort()
+        self.assertEquals(3, worklists._cache.get('key'))
+
+    def test_hook_added_once(self):
+        invalidateWorklistCounts()
+        invalidateWorklistCounts(None, None)
+        hooks = [h for h, a, k in transaction.get().getAfterCommitHooks()
+                    if h is worklists._invalidateAfterCommit]
+        self.assertEquals(1, len(hooks))
+
+class TestContentEvents(Sandboxed, PloneTestCase):
+
+    layer = ZCMLLayer
+
+    def afterSetUp(self):
+        self.setRoles(['Manager'])
+        transaction.commit()
+        worklists._cache.set('key', 3)
+
+    def beforeTearDown(self):
+        worklists._cache.clear()
+
+    def test_other_commits(self):
+        self.folder.setTitle('Changed')
+        transaction.commit()
+        self.assertEquals(3, worklists._cache.get('key'))
+
+    def test_added(self):
+        self.folder.invokeFactory('Document', 'doc')
+        transaction.commit()
+        self.assertEquals(None, worklists._cache.get('key'))
+
+    def test_removed(self):
+        self.folder.invokeFactory('Document', 'doc')
+        transaction.commit()
+        worklists._cache.set('key', 3)
+        self.folder.manage_delObjects(['doc'])
+        transaction.commit()
+        self.assertEquals(None, worklists._cache.get('key'))
+
+def _fail():
+    raise ValueError("Commit failed")
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestWorklistCountCache))
+    suite.addTest(makeSuite(TestInvalidation))
+    suite.addTest(makeSuite(TestContentEvents))
+    return suite
@@ -1,24 +1,108 @@
+import threading
+
 from Products.CMFCore.utils import getToolByName
-from Acquisition import aq_parent, aq_inner
+from Acquisition import aq_base, aq_parent, aq_inner
 
-def trigger_automatic_transitions(context, event=None):
-    """Trigger automatic transitions for all workflows associated with the
-    given object, going through teh workflow chain in reverse order. This
-    allows a transition in a workflow lower down the chain to cause another
-    transition in a workflow higher up the chain.
+from collective.wtf.worklists import invalidateWorklistCounts
+from collective.wtf.expressions import primeTransitionGuards
+from collective.wtf.reindex import queueWorkflowReindex
+
+# Objects whose automatic transitions have been deferred, per thread
+_deferred = threading.local()
+
+# Workflow chains, keyed by (workflow tool path, portal_type). Values are
+# (serials, chain), where serials identify the revision of the workflow
+# tool and its chain mapping the chain was read from.
+_chains = {}
+
+def get_workflow_chain(context, wtool=None):
+    """Return the workflow chain of context as a tuple of workflow ids.
     
-    It is possible to register this for the IActionSucceededEvent object event
-    so that it takes place automatically on each transition for a given object
-    type:
+    This is the same as wtool.getChainFor(context), but the result is
+    cached by portal_type for as long as the workflow tool and its chain
+    mapping have not been modified. The cache is bypassed if the site has
+    a placeful workflow tool, since chains may then vary by location, and
+    while the chains are being changed in the current transaction.
+    """
+    if wtool is None:
+        wtool = getToolByName(context, 'portal_workflow')
     
-      <subscriber
-          for=".interfaces.IMyType
-               Products.CMFCore.interfaces.IActionSucceededEvent"
-          handler="collective.wtf.utils.trigger_automatic_transitions"
-          />
+    serials = _chain_serials(wtool)
+    if serials is None or not hasattr(aq_base(context), 'getPortalTypeName'):
+        return tuple(wtool.getChainFor(context))
+    
+    key = (wtool.getPhysicalPath(), context.getPortalTypeName(),)
+    entry = _chains.get(key, None)
+    if entry is not None and entry[0] == serials:
+        return entry[1]
+    
+    chain = tuple(wtool.getChainFor(context))
+    _chains[key] = (serials, chain,)
+    return chain
+
+def clear_chain_cache():
+    """Clear the workflow chain cache
+    """
+    _chains.clear()
+
+def _chain_serials(wtool):
+    portal = aq_parent(aq_inner(wtool))
+    if getattr(aq_base(portal), 'portal_placeful_workflow', None) is not None:
+        return None
+    
+    base = aq_base(wtool)
+    objects = [base]
+    if base._chains_by_type is not None:
+        objects.append(base._chains_by_type)
+    
+    serials = []
+    for ob in objects:
+        if getattr(ob, '_p_jar', None) is None:
+            return None
+        ob._p_activate()
+        if ob._p_changed:
+            return None
+        serials.append(ob._p_serial)
+    return tuple(serials)
+
+def defer_automatic_transitions():
+    """Until flush_automatic_transitions() is called, make the automatic
+    transition handlers below collect the objects they are called for in
+    this thread, instead of processing them straight away. This lets a
+    bulk operation evaluate automatic transitions once per object per
+    batch.
+    
+    Calls may be nested, as long as each is paired with a call to
+    flush_automatic_transitions(). The objects are collected until the
+    outermost call is flushed.
+    """
+    depth = getattr(_deferred, 'depth', 0)
+    if not depth:
+        _deferred.objects = {}
+    _deferred.depth = depth + 1
+
+def flush_automatic_transitions():
+    """Stop deferring automatic transitions, and return a dict of
+    physical path -> object for the objects that were collected. For a
+    nested call, this returns an empty dict, and the objects stay
+    collected for the outer call to process.
+    """
+    depth = getattr(_deferred, 'depth', 0)
+    if depth > 1:
+        _deferred.depth = depth - 1
+        return {}
+    objects = getattr(_deferred, 'objects', None)
+    _deferred.depth = 0
+    _deferred.objects = None
+    return objects or {}
+
+def fire_automatic_transitions(context):
+    """Fire the first available automatic transition of each workflow in
+    the chain of context, going through the chain in reverse order. Does
+    not reindex the object. Returns True if any transition was fired.
     """
     wtool = getToolByName(context, 'portal_workflow')
-    chain = list(wtool.getChainFor(context))
+    chain = list(get_workflow_chain(context, wtool))
     chain.reverse()
     changed = False
     for wfid in chain:
@@ -26,13 +110,47 @@ def trigger_automatic_transitions(context, event=None):
         sdef = workflow._getWorkflowStateOf(context)
         if sdef is None:
             continue
+        primeTransitionGuards(workflow, sdef)
         tdef = workflow._findAutomaticTransition(context, sdef)
         if tdef is None:
             continue
         changed = True
         workflow._changeStateOf(context, tdef)
-    if changed:
-        wtool._reindexWorkflowVariables(context)
+    return changed
+
+def trigger_automatic_transitions(context, event=None):
+    """Trigger automatic transitions for all workflows associated with the
+    given object, going through teh workflow chain in reverse order. This
+    allows a transition in a workflow lower down the chain to cause another
+    transition in a workflow higher up the chain.
+    
+    It is possible to register this for the IActionSucceededEvent object event
+    so that it takes place automatically on each transition for a given object
+    type:
+    
+      <subscriber
+          for=".interfaces.IMyType
+               Products.CMFCore.interfaces.IActionSucceededEvent"
+          handler="collective.wtf.utils.trigger_automatic_transitions"
+          />
+    
+    While automatic transitions are deferred (see
+    defer_automatic_transitions), the object is only recorded.
+    
+    Reindexing is queued until the transaction commits (see
+    collective.wtf.reindex), so that cascading transitions on the same
+    object only catalog it once. If the event is for a transition of this
+    very object, the workflow tool reindexes it straight after notifying
+    us, so nothing needs to be queued.
+    """
+    deferred = getattr(_deferred, 'objects', None)
+    if deferred is not None:
+        deferred['/'.join(context.getPhysicalPath())] = context
+        return
+    if fire_automatic_transitions(context):
+        if aq_base(getattr(event, 'object', None)) is not aq_base(context):
+            queueWorkflowReindex(context)
+        invalidateWorklistCounts(context, event)
 
 def trigger_automatic_transitions_in_parent(context, event=None):
     """Trigger automatic transitions in the parent of context.
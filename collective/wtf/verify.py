@@ -18,7 +18,7 @@ class BaseChecker(object):
     @memoize
     def info(self):
         wfdc = CSVWorkflowDefinitionConfigurator(self.context)
-        return wfdc.getWorkflowInfo(self.context.getId())
+        return wfdc.getWorkflowInfo(self.context.getId(), frozen=True)
 
 class StateVariable(BaseChecker):
     adapts(IDCWorkflowDefinition)
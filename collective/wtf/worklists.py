@@ -0,0 +1,169 @@
+import time
+import threading
+
+import transaction
+
+from AccessControl import getSecurityManager
+from Products.CMFCore.utils import getToolByName
+from Products.CMFCore.Expression import Expression
+
+from collective.wtf.interfaces import ICSVImportedWorkflow
+from collective.wtf.expressions import primeGuard
+
+class WorklistCountCache(object):
+    """A simple, thread-safe, process-wide cache of worklist counts.
+
+    Entries expire after 'timeout' seconds. This puts an upper bound on
+    how stale a count can get when content changes in other ways than
+    through a workflow transition or being added or removed (e.g. its
+    sharing), or when the change happened on another ZEO client.
+    """
+
+    timeout = 300
+    max_size = 10000
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = {}
+
+    def get(self, key, default=None):
+        entry = self.data.get(key, None)
+        if entry is None:
+            return default
+        value, expires = entry
+        if expires < time.time():
+            return default
+        return value
+
+    def set(self, key, value):
+        self.lock.acquire()
+        try:
+            if len(self.data) >= self.max_size:
+                self.data.clear()
+            self.data[key] = (value, time.time() + self.timeout,)
+        finally:
+            self.lock.release()
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self.data.clear()
+        finally:
+            self.lock.release()
+
+_cache = WorklistCountCache()
+
+def getWorklistCount(workflow, worklist, portal):
+    """Return the number of items in the given worklist for the current
+    user, or None if the worklist guard does not allow the user to see it.
+
+    The result is cached, keyed by the worklist, the user's roles in the
+    portal, the guard permissions the user has, and the user's id and
+    groups, which (with the roles) determine what the catalog lets the
+    user see.
+    Worklists with a guard expression or with dynamic variable matches
+    have their guard or search evaluated every time.
+    """
+
+    sm = getSecurityManager()
+    user = sm.getUser()
+    guard = worklist.getGuard()
+
+    criteria = []
+    for key in worklist.getVarMatchKeys():
+        values = worklist.getVarMatch(key)
+        if isinstance(values, Expression) or [v for v in values if '%' in v]:
+            criteria = None
+            break
+        criteria.append((key, tuple(values),))
+
+    roles = tuple(sorted(user.getRolesInContext(portal)))
+    permissions = tuple([p for p in guard.permissions if sm.checkPermission(p, portal)])
+    allowed = _getPrincipalTokens(user)
+
+    key = ('/'.join(portal.getPhysicalPath()), workflow.getId(), worklist.getId(),
+           roles, permissions, allowed, criteria and tuple(criteria) or None,)
+
+    # A guard expression may depend on anything, so it is always evaluated
+    has_expr = guard.expr is not None
+    primeGuard(guard)
+    if has_expr and not guard.check(sm, workflow, portal):
+        return None
+
+    if criteria is not None:
+        count = _cache.get(key, _marker)
+        if count is not _marker:
+            return count
+
+    if not has_expr and not guard.check(sm, workflow, portal):
+        count = None
+    else:
+        count = len(worklist.search() or ())
+
+    if criteria is not None:
+        _cache.set(key, count)
+
+    return count
+
+def _getPrincipalTokens(user):
+    """Return the user's id and the ids of the groups the user is in
+    """
+    groups = ()
+    getGroups = getattr(user, 'getGroups', None)
+    if getGroups is not None:
+        groups = tuple(sorted(getGroups() or ()))
+    return (user.getId(),) + groups
+
+def listWorklistCounts(context):
+    """Return a list of dicts with keys 'workflow', 'id', 'name', 'url'
+    and 'count' for each non-empty worklist of a CSV-imported workflow
+    that the current user may see.
+    """
+
+    portal = getToolByName(context, 'portal_url').getPortalObject()
+    portal_workflow = getToolByName(context, 'portal_workflow')
+
+    result = []
+    for workflow_id in portal_workflow.getWorkflowIds():
+        workflow = portal_workflow.getWorkflowById(workflow_id)
+        if not ICSVImportedWorkflow.providedBy(workflow):
+            continue
+        for worklist in workflow.worklists.objectValues():
+            if not worklist.actbox_name:
+                continue
+            count = getWorklistCount(workflow, worklist, portal)
+            if not count:
+                continue
+            info = {'count': count, 'portal_url': portal.absolute_url()}
+            result.append({'workflow': workflow_id,
+                           'id': worklist.getId(),
+                           'name': _format(worklist.actbox_name, info),
+                           'url': _format(worklist.actbox_url, info),
+                           'count': count})
+    return result
+
+def _format(text, info):
+    try:
+        return text % info
+    except (KeyError, ValueError, TypeError,):
+        return text
+
+def invalidateWorklistCounts(context=None, event=None):
+    """Clear cached worklist counts once the current transaction commits.
+
+    This is registered for IActionSucceededEvent, and for content being
+    added or removed, which puts it in or takes it out of worklists without
+    a transition. It is also called by the automatic transition handlers in
+    collective.wtf.utils.
+    """
+    txn = transaction.get()
+    for hook, args, kws in txn.getAfterCommitHooks():
+        if hook is _invalidateAfterCommit:
+            return
+    txn.addAfterCommitHook(_invalidateAfterCommit)
+
+def _invalidateAfterCommit(status):
+    if status:
+        _cache.clear()
+
+_marker = object()